@@ -0,0 +1,207 @@
+import gzip
+import json
+import os
+from datetime import timedelta
+from audit_records import AppCorrelation
+import entra_orphaned_apps
+import entra_unused_apps
+from owner_graph import OwnerGraph
+from expiry_index import parse_datetime
+import columnar_snapshot
+from columnar_snapshot import APP_INDEX, ColumnarSnapshot
+
+# The secret and orphaned audits look at applications, the unused audit at service
+# principals; the two only share the appId. AppIndex joins them on appId once, when a
+# snapshot is saved, so cross-audit questions ("unused AND orphaned AND still holding a
+# valid secret") are answered from one dict in one pass instead of joining reports.
+#
+# Entries keep the raw facts (credential windows, last sign-in) rather than findings, so
+# any thresholds can be used at query time. Orphan status doesn't depend on the date and
+# is stored as the orphaned audit's reason (owner chains included, see owner_graph).
+
+
+class AppIndex:
+    """
+    {appId: entry} over the applications and service principals of a snapshot. An entry
+    has the app registration's and/or the service principal's side (None where the tenant
+    has only one of them, e.g. a service principal of another tenant's app).
+
+    Written next to a TenantSnapshot (see TenantSnapshot.save), as an Arrow table
+    (columnar_snapshot); indexes saved before that, as gzipped JSON, still load.
+    """
+
+    FILE = "app_index.arrow"
+    JSON_FILE = "app_index.json.gz"
+
+    def __init__(self, entries=None, taken_at=None):
+        self.entries = entries or {}
+        self.taken_at = taken_at
+
+    def _entry(self, app_id, display_name):
+        entry = self.entries.get(app_id)
+        if entry is None:
+            entry = self.entries[app_id] = {
+                "app_id": app_id,
+                "display_name": display_name,
+                "application_id": None,
+                "service_principal_id": None,
+                "credentials": [],  # [start, end] of every secret and certificate
+                "owner_count": None,
+                "orphan_reason": None,
+                "last_sign_in": None,
+            }
+        return entry
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        index = cls(taken_at=snapshot.taken_at)
+        graph = OwnerGraph()
+        for app in snapshot.applications.values():
+            if not app["app_id"]:
+                continue
+            entry = index._entry(app["app_id"], app["display_name"])
+            entry["display_name"] = app["display_name"]
+            entry["application_id"] = app["id"]
+            entry["credentials"] = [[cred.get("start_date_time"), cred["end_date_time"]]
+                                    for cred in app["password_credentials"] + app["key_credentials"]]
+            entry["owner_count"] = len(app["owners"])
+            orphaned = entra_orphaned_apps.check_orphaned(app)
+            entry["orphan_reason"] = orphaned.reason if orphaned else None
+            graph.add_application(app)
+        for item in graph.transitive_orphans():
+            index.entries[item.app_id]["orphan_reason"] = item.reason
+        for sp in snapshot.service_principals.values():
+            if not sp["app_id"]:
+                continue
+            entry = index._entry(sp["app_id"], sp["display_name"])
+            entry["service_principal_id"] = sp["id"]
+            entry["last_sign_in"] = sp["last_sign_in"]
+        return index
+
+    def save(self, path):
+        entries = self.entries.values()
+        columns = {name: [entry[name] for entry in entries] for name in (
+            "app_id", "display_name", "application_id", "service_principal_id", "owner_count", "orphan_reason", "last_sign_in")}
+        columns["credential_starts"] = [[start for start, _ in entry["credentials"]] for entry in entries]
+        columns["credential_ends"] = [[end for _, end in entry["credentials"]] for entry in entries]
+        columnar_snapshot.write_app_index(path, columns, self.taken_at)
+        if os.path.exists(os.path.join(path, self.JSON_FILE)):
+            os.remove(os.path.join(path, self.JSON_FILE))
+
+    @classmethod
+    def load(cls, path):
+        if not os.path.exists(os.path.join(path, cls.FILE)):
+            return cls._load_json(path)
+        table = ColumnarSnapshot(path).table(APP_INDEX)
+        taken_at = (table.schema.metadata or {}).get(b"taken_at", b"").decode()
+        columns = columnar_snapshot.to_pydict(table)
+        starts, ends = columns.pop("credential_starts"), columns.pop("credential_ends")
+        entries = {}
+        for row, values in enumerate(zip(*columns.values())):
+            entry = dict(zip(columns, values))
+            entry["credentials"] = [list(window) for window in zip(starts[row], ends[row])]
+            entries[entry["app_id"]] = entry
+        return cls(entries, parse_datetime(taken_at))
+
+    @classmethod
+    def _load_json(cls, path):
+        with gzip.open(os.path.join(path, cls.JSON_FILE), "rt", encoding="utf-8") as f:
+            data = json.load(f)
+        entries = {}
+        for entry in data["entries"]:
+            entry["credentials"] = [[parse_datetime(start), parse_datetime(end)] for start, end in entry["credentials"]]
+            entry["last_sign_in"] = parse_datetime(entry["last_sign_in"])
+            entries[entry["app_id"]] = entry
+        return cls(entries, parse_datetime(data["taken_at"]))
+
+    @classmethod
+    def exists(cls, path):
+        return any(os.path.exists(os.path.join(path, name)) for name in (cls.FILE, cls.JSON_FILE))
+
+    def __len__(self):
+        return len(self.entries)
+
+    def query(self, filters):
+        """Entries matching every filter (callables taking an entry), in one pass over the index."""
+        return [entry for entry in self.entries.values() if all(matches(entry) for matches in filters)]
+
+
+# --- Filters -----------------------------------------------------------------
+# Each returns a predicate over index entries, for AppIndex.query.
+
+def live_credentials(entry, today):
+    """Secrets/certificates valid right now."""
+    return sum(1 for start, end in entry["credentials"]
+               if (start is None or start <= today) and (end is None or end > today))
+
+
+def unused(today, threshold_date):
+    """Has a service principal that hasn't signed in since threshold_date (as in the unused audit)."""
+    def matches(entry):
+        if entry["service_principal_id"] is None:
+            return False
+        sp = {"id": entry["service_principal_id"], "app_id": entry["app_id"],
+              "display_name": entry["display_name"], "last_sign_in": entry["last_sign_in"]}
+        return entra_unused_apps.check_unused(sp, today, threshold_date) is not None
+    return matches
+
+
+def orphaned():
+    """App registration with no owners, or only disabled/deleted ones."""
+    return lambda entry: entry["orphan_reason"] is not None
+
+
+def holding_live_credentials(today):
+    return lambda entry: live_credentials(entry, today) > 0
+
+
+def expiring(today, threshold_date):
+    """At least one credential that expires on or before threshold_date (already expired included)."""
+    return lambda entry: any(end and end <= threshold_date for _, end in entry["credentials"])
+
+
+def without_service_principal():
+    """App registration that has no service principal in the tenant (never consented / used here)."""
+    return lambda entry: entry["application_id"] is not None and entry["service_principal_id"] is None
+
+
+def without_application():
+    """Service principal whose app is registered elsewhere (another tenant, or a Microsoft app)."""
+    return lambda entry: entry["application_id"] is None
+
+
+def build_filters(today, unused_days=None, orphaned_only=False, live=False, expiring_days=None,
+                  no_service_principal=False, no_application=False):
+    """The filters for a query_apps.py command line (or a daemon /apps query), to AND together."""
+    filters = []
+    if unused_days is not None:
+        filters.append(unused(today, today - timedelta(days=unused_days)))
+    if orphaned_only:
+        filters.append(orphaned())
+    if live:
+        filters.append(holding_live_credentials(today))
+    if expiring_days is not None:
+        filters.append(expiring(today, today + timedelta(days=expiring_days)))
+    if no_service_principal:
+        filters.append(without_service_principal())
+    if no_application:
+        filters.append(without_application())
+    return filters
+
+
+def to_record(entry, today):
+    """The index entry as an export row."""
+    last_sign_in = entry["last_sign_in"]
+    ends = [end for _, end in entry["credentials"] if end and end > today]
+    return AppCorrelation(
+        app=entry["display_name"],
+        app_id=entry["app_id"],
+        application_id=entry["application_id"],
+        service_principal_id=entry["service_principal_id"],
+        last_sign_in=str(last_sign_in) if last_sign_in else "Never",
+        days_inactive=(today - last_sign_in).days if last_sign_in else None,
+        owner_count=entry["owner_count"],
+        orphan_reason=entry["orphan_reason"],
+        live_credentials=live_credentials(entry, today),
+        next_expiry=min(ends) if ends else None,
+    )
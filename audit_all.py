@@ -0,0 +1,325 @@
+import asyncio
+import argparse
+import json
+import os
+from datetime import datetime, timezone, timedelta
+from azure.identity import DefaultAzureCredential
+from msgraph import GraphServiceClient
+import entra_app_secret_audit
+import entra_orphaned_apps
+import entra_unused_apps
+from tenant_snapshot import TenantSnapshot, crawl_tenant
+from delta_sync import sync_tenant
+from owner_resolution import OwnerResolver
+from owner_graph import OwnerGraph
+from request_scheduler import attach_graph_client, get_scheduler
+from export_sinks import export_rows
+from crawl_checkpoint import CrawlCheckpoint
+from parallel_evaluation import default_workers, evaluate_parallel
+from object_cache import DEFAULT_CACHE_PATH, DEFAULT_TTL_HOURS, open_cache
+from audit_records import ExpiringCredential, InactiveServicePrincipal, OrphanedApp
+import telemetry
+from tenant_auth import default_credential
+import daemon_client
+from daemon_client import DEFAULT_DAEMON_URL
+
+# (key, title, module) for each Graph audit, in report order.
+AUDITS = [
+    ("secrets", "Secrets Expiring", entra_app_secret_audit),
+    ("unused", "Unused Apps", entra_unused_apps),
+    ("orphaned", "Orphaned Apps", entra_orphaned_apps),
+]
+RECORD_TYPES = {"secrets": ExpiringCredential, "unused": InactiveServicePrincipal, "orphaned": OrphanedApp}
+
+
+class AuditRun:
+    """
+    Evaluates every Graph audit rule against projected tenant objects.
+
+    Applications feed the secret and orphaned audits, service principals feed the
+    unused audit, so one pass over the tenant answers all three.
+    """
+
+    def __init__(self, secret_days=30, unused_days=365, today=None):
+        self.secret_days = secret_days
+        self.unused_days = unused_days
+        self.today = today or datetime.now(timezone.utc)
+        self.expiry_threshold = self.today + timedelta(days=secret_days)
+        self.inactivity_threshold = self.today - timedelta(days=unused_days)
+        self.application_count = 0
+        self.service_principal_count = 0
+        self.findings = {key: [] for key, _, _ in AUDITS}
+        # Ownership between apps, for the orphans that only show once the whole tenant is in.
+        self.owner_graph = OwnerGraph()
+
+    def evaluate_application(self, app):
+        self.application_count += 1
+        self.owner_graph.add_application(app)
+        self.findings["secrets"].extend(
+            entra_app_secret_audit.find_expiring_credentials(app, self.today, self.expiry_threshold))
+        item = entra_orphaned_apps.check_orphaned(app)
+        if item:
+            self.findings["orphaned"].append(item)
+
+    def evaluate_service_principal(self, sp):
+        self.service_principal_count += 1
+        item = entra_unused_apps.check_unused(sp, self.today, self.inactivity_threshold)
+        if item:
+            self.findings["unused"].append(item)
+
+    def evaluate_owner_chains(self):
+        """
+        Add the apps owned only through orphaned apps (or in ownership cycles), see
+        owner_graph. Call once every application has been evaluated.
+        """
+        self.findings["orphaned"].extend(self.owner_graph.transitive_orphans())
+
+    def evaluate_snapshot(self, snapshot, workers=None):
+        """Evaluate a whole TenantSnapshot; with workers > 1, in that many processes (see parallel_evaluation)."""
+        if workers and workers > 1:
+            self.application_count += len(snapshot.applications)
+            self.service_principal_count += len(snapshot.service_principals)
+            evaluate_parallel(self, snapshot.applications.values(), snapshot.service_principals.values(), workers)
+            for app in snapshot.applications.values():
+                self.owner_graph.add_application(app)
+        else:
+            for app in snapshot.applications.values():
+                self.evaluate_application(app)
+            for sp in snapshot.service_principals.values():
+                self.evaluate_service_principal(sp)
+        self.evaluate_owner_chains()
+
+    def evaluate_store(self, store, workers=None):
+        """
+        Evaluate a DeltaStore after an incremental sync. Expiry and inactivity depend on
+        today's date so they are re-checked over every cached object (no network calls),
+        in `workers` processes if more than one; direct orphan status is only re-evaluated
+        for apps that changed since the last run (owner chains always are: they depend on
+        other apps).
+        """
+        apps = store.snapshot.applications
+        sps = store.snapshot.service_principals
+        self.application_count = len(apps)
+        self.service_principal_count = len(sps)
+        self.findings["orphaned"] = store.cached_findings("orphaned", apps, entra_orphaned_apps.check_orphaned)
+        for app in apps.values():
+            self.owner_graph.add_application(app)
+        self.evaluate_owner_chains()
+        if workers and workers > 1:
+            evaluate_parallel(self, apps.values(), sps.values(), workers, orphaned=False)
+            return
+        for app in apps.values():
+            self.findings["secrets"].extend(
+                entra_app_secret_audit.find_expiring_credentials(app, self.today, self.expiry_threshold))
+        for sp in sps.values():
+            item = entra_unused_apps.check_unused(sp, self.today, self.inactivity_threshold)
+            if item:
+                self.findings["unused"].append(item)
+
+
+async def run_all_audits(graph_client, secret_days=30, unused_days=365, snapshot=None, checkpoint_dir=None, resume=False,
+                         object_cache=None, workers=None):
+    """
+    Crawl the tenant once and evaluate all Graph audits. Returns the AuditRun.
+
+    With checkpoint_dir, progress and findings are saved there after every page; with
+    resume, an unfinished checkpoint left by an interrupted run is continued instead of
+    starting over (its findings so far are loaded, the crawl goes on from the saved page).
+    The checkpoint is removed once the crawl completes. App owners are resolved through
+    object_cache (an ObjectCache) when one is given.
+
+    With workers > 1, the crawled objects are kept and evaluated afterwards in that many
+    processes instead of page by page (not combined with checkpoint_dir, which saves
+    findings per page).
+    """
+    run = AuditRun(secret_days, unused_days)
+    if workers and workers > 1:
+        if checkpoint_dir:
+            raise ValueError("Parallel evaluation can't be combined with a checkpoint")
+        snapshot = snapshot if snapshot is not None else TenantSnapshot()
+        await crawl_tenant(graph_client, snapshot=snapshot, owner_resolver=OwnerResolver(graph_client, object_cache))
+        with telemetry.span("evaluate.parallel"):
+            run.evaluate_snapshot(snapshot, workers)
+        return run
+    checkpoint = None
+    if checkpoint_dir:
+        checkpoint = CrawlCheckpoint(checkpoint_dir, {"secret_days": secret_days, "unused_days": unused_days})
+        if resume and checkpoint.resume(RECORD_TYPES):
+            # Same "today" as the interrupted run, so all findings use the same thresholds.
+            run = AuditRun(secret_days, unused_days, today=checkpoint.started_at)
+            run.findings = checkpoint.findings
+            run.application_count = checkpoint.processed("applications")
+            run.service_principal_count = checkpoint.processed("service_principals")
+            print(f"Resuming crawl started at {checkpoint.started_at}: {run.application_count} applications "
+                  f"and {run.service_principal_count} service principals already processed.")
+        else:
+            checkpoint.start(run.findings, run.today)
+    await crawl_tenant(graph_client,
+                       on_application=run.evaluate_application,
+                       on_service_principal=run.evaluate_service_principal,
+                       snapshot=snapshot,
+                       owner_resolver=OwnerResolver(graph_client, object_cache),
+                       checkpoint=checkpoint)
+    # Resumed: apps crawled before the interruption aren't in the owner graph, so chains
+    # through them aren't followed (their service principals count as real owners).
+    run.evaluate_owner_chains()
+    if checkpoint is not None:
+        checkpoint.clear()
+    return run
+
+
+async def run_incremental_audits(graph_client, state_dir, secret_days=30, unused_days=365, full=False, object_cache=None,
+                                 workers=None):
+    """Sync the delta store in state_dir, evaluate all Graph audits and save the store. Returns (AuditRun, DeltaChanges)."""
+    store, changes = await sync_tenant(graph_client, state_dir, full=full, object_cache=object_cache)
+    run = AuditRun(secret_days, unused_days)
+    with telemetry.span("evaluate.store"):
+        run.evaluate_store(store, workers)
+    store.save()
+    return run, changes
+
+
+def fetch_from_daemon(url, secret_days=30, unused_days=365):
+    """An AuditRun filled with the answers of a running audit_daemon.py instead of a crawl."""
+    run = AuditRun(secret_days, unused_days)
+    status = daemon_client.query(url, "status")
+    run.application_count = status["applications"] or 0
+    run.service_principal_count = status["service_principals"] or 0
+    answer = daemon_client.query(url, "secrets", days=secret_days)
+    run.findings["secrets"] = daemon_client.records(answer, ExpiringCredential, dates=("expires",))
+    run.findings["unused"] = daemon_client.records(daemon_client.query(url, "unused", days=unused_days), InactiveServicePrincipal)
+    run.findings["orphaned"] = daemon_client.records(daemon_client.query(url, "orphaned"), OrphanedApp)
+    print(f"Answered by the audit daemon from tenant state taken at {daemon_client.taken_at(answer)}.")
+    return run
+
+
+def print_changes(changes):
+    for collection, changed, removed in (
+            ("applications", changes.applications, changes.removed_applications),
+            ("service principals", changes.service_principals, changes.removed_service_principals)):
+        if collection.replace(" ", "_") in changes.full_sync:
+            print(f"Full crawl of {collection}: {len(changed)} objects.")
+        else:
+            print(f"Delta for {collection}: {len(changed)} changed, {len(removed)} removed.")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Run the secret, unused and orphaned app audits in a single pass over the tenant.")
+    parser.add_argument("--secret-days", type=int, default=30, help="Days to look ahead for expiring secrets (default: 30)")
+    parser.add_argument("--unused-days", type=int, default=365, help="Days of inactivity for unused apps (default: 365)")
+    parser.add_argument("--output-dir", help="Directory to export one file per audit (secrets.csv, unused.csv, orphaned.csv)")
+    parser.add_argument("--output-format", default="csv", choices=["csv", "csv.gz", "jsonl", "jsonl.gz", "parquet"], help="File format for --output-dir (default: csv)")
+    parser.add_argument("--save-snapshot", metavar="DIR", help="Save the fetched tenant objects to DIR for later offline runs (with --from-snapshot: re-save that snapshot, e.g. to convert an older one)")
+    parser.add_argument("--from-snapshot", metavar="DIR", help="Evaluate a snapshot saved with --save-snapshot instead of calling Graph")
+    parser.add_argument("--incremental", metavar="DIR", help="Keep tenant state in DIR and only fetch changes (Graph delta queries) on later runs")
+    parser.add_argument("--full-sync", action="store_true", help="With --incremental: ignore the stored delta tokens and crawl everything again")
+    parser.add_argument("--checkpoint", metavar="DIR", help="Save crawl progress and findings to DIR after every page (full crawl, not --incremental)")
+    parser.add_argument("--resume", action="store_true", help="With --checkpoint: continue an interrupted crawl from its last saved page")
+    parser.add_argument("--cache", metavar="FILE", default=DEFAULT_CACHE_PATH, help=f"Local cache of owner lookups, shared by the audit scripts (default: {DEFAULT_CACHE_PATH})")
+    parser.add_argument("--cache-ttl", type=float, default=DEFAULT_TTL_HOURS, metavar="HOURS", help=f"Look owners up again once their cached state is older than this; 0 disables the cache (default: {DEFAULT_TTL_HOURS})")
+    parser.add_argument("--workers", type=int, nargs="?", const=default_workers(), metavar="N", help="Evaluate the rules in N processes once all objects are fetched (default N: number of CPUs); for large tenants")
+    parser.add_argument("--daemon", metavar="URL", nargs="?", const=DEFAULT_DAEMON_URL, help=f"Ask a running audit_daemon.py instead of calling Graph (default URL: {DEFAULT_DAEMON_URL})")
+    parser.add_argument("--timings", action="store_true", help="Print where the time went (page fetches, batches, evaluation, export) and request/byte counters")
+    args = parser.parse_args()
+
+    if args.resume and not args.checkpoint:
+        parser.error("--resume needs --checkpoint DIR")
+    if args.workers and args.checkpoint:
+        parser.error("--workers can't be combined with --checkpoint (findings are checkpointed page by page)")
+    if args.resume and args.save_snapshot:
+        parser.error("--save-snapshot can't be combined with --resume (the pages crawled before the interruption aren't kept)")
+    if args.daemon and (args.from_snapshot or args.save_snapshot or args.incremental or args.checkpoint or args.workers):
+        parser.error("--daemon answers from the daemon's own tenant state: don't combine it with snapshot, --incremental, --checkpoint or --workers options")
+
+    print(f"Starting combined audit (secrets: {args.secret_days} days, unused: {args.unused_days} days)...")
+    run_telemetry = telemetry.start("audit_all")
+
+    try:
+        if args.daemon:
+            run = fetch_from_daemon(args.daemon, args.secret_days, args.unused_days)
+        elif args.from_snapshot:
+            print(f"Loading snapshot from {args.from_snapshot}...")
+            snapshot = TenantSnapshot.load(args.from_snapshot)
+            print(f"Snapshot taken at {snapshot.taken_at}.")
+            run = AuditRun(args.secret_days, args.unused_days)
+            with telemetry.span("evaluate.snapshot"):
+                run.evaluate_snapshot(snapshot, args.workers)
+            if args.save_snapshot:
+                # E.g. to convert a snapshot saved in an older format.
+                snapshot.save(args.save_snapshot)
+                print(f"Snapshot saved to {args.save_snapshot}.")
+        else:
+            # Load config
+            tenant_id = None
+            config_path = "audit_config.json"
+            if os.path.exists(config_path):
+                try:
+                    with open(config_path, "r") as f:
+                        config = json.load(f)
+                        tenant_id = config.get("tenant_id")
+                        if tenant_id and "ENTER_YOUR" in tenant_id:
+                            tenant_id = None
+                except Exception as e:
+                    print(f"Warning: Failed to read {config_path}: {e}")
+
+            if tenant_id:
+                print(f"Using tenant {tenant_id} from {config_path}.")
+            else:
+                print("Using default tenant from environment/CLI context.")
+            credential = telemetry.TimedCredential(default_credential(DefaultAzureCredential, tenant_id))
+            graph_client = attach_graph_client(GraphServiceClient(credentials=credential, scopes=['https://graph.microsoft.com/.default']))
+            telemetry.instrument_graph_client(graph_client)
+            object_cache = open_cache(args.cache, args.cache_ttl)
+
+            try:
+                if args.incremental:
+                    print(f"Syncing tenant state in {args.incremental}...")
+                    run, changes = await run_incremental_audits(graph_client, args.incremental, args.secret_days,
+                                                                args.unused_days, full=args.full_sync, object_cache=object_cache,
+                                                                workers=args.workers)
+                    print_changes(changes)
+                else:
+                    print("Fetching applications (with owners) and service principals...")
+                    snapshot = TenantSnapshot() if args.save_snapshot else None
+                    run = await run_all_audits(graph_client, args.secret_days, args.unused_days, snapshot=snapshot,
+                                               checkpoint_dir=args.checkpoint, resume=args.resume, object_cache=object_cache,
+                                               workers=args.workers)
+
+                    if snapshot is not None:
+                        snapshot.save(args.save_snapshot)
+                        print(f"Snapshot saved to {args.save_snapshot}.")
+            finally:
+                if object_cache is not None:
+                    object_cache.close()
+
+        print(f"\nScanned {run.application_count} applications and {run.service_principal_count} service principals.")
+        stats = get_scheduler("graph").stats()
+        if stats["requests"]:
+            print(f"Graph requests: {stats['requests']} ({stats['retries']} retried, {stats['throttled']} throttled).")
+
+        # Report
+        for key, title, module in AUDITS:
+            items = run.findings[key]
+            print(f"\n=== {title}: {len(items)} ===")
+            if items:
+                module.print_header()
+                for item in items:
+                    module.print_item(item)
+
+        # Export
+        if args.output_dir:
+            os.makedirs(args.output_dir, exist_ok=True)
+            for key, _, module in AUDITS:
+                export_rows(run.findings[key], os.path.join(args.output_dir, f"{key}.{args.output_format}"),
+                            module.FIELDNAMES, module.COLUMN_TYPES)
+
+        if args.timings:
+            telemetry.print_summary(run_telemetry)
+
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        if "403" in str(e):
+            print("\n[!] PERMISSION ERROR: The combined audit needs 'Application.Read.All', 'User.Read.All' and 'AuditLog.Read.All' (or 'Directory.Read.All').")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,315 @@
+import asyncio
+import argparse
+import bisect
+import json
+import os
+import time
+from datetime import datetime, timezone, timedelta
+from aiohttp import web
+from azure.identity import DefaultAzureCredential
+from msgraph import GraphServiceClient
+import app_index
+from app_index import AppIndex
+from audit_all import print_changes
+from delta_sync import DeltaStore, sync_tenant
+from expiry_index import ExpiryIndex, entry_to_item
+from rotation_risk import CredentialTable
+from owner_graph import OwnerGraph
+from object_cache import DEFAULT_CACHE_PATH, DEFAULT_TTL_HOURS, open_cache
+from daemon_client import DEFAULT_DAEMON_URL
+import entra_orphaned_apps
+import entra_unused_apps
+import telemetry
+from tenant_auth import default_credential
+from request_scheduler import attach_graph_client
+
+# Every CLI run pays for interpreter start-up, SDK imports, a token and a crawl (or at
+# least a delta round) before it can answer anything. The daemon pays once and stays up:
+# one Graph client (token cache, connection pool), the tenant state in memory, synced
+# with delta queries every --refresh minutes, and indexes built after each sync so any
+# threshold is a binary search or a single pass:
+#
+#   GET  /status                          last refresh, object counts, last error
+#   GET  /secrets?days=30                 expiring secrets/certificates
+#   GET  /rotation?days=30                apps running out of valid credentials
+#   GET  /unused?days=365                 service principals inactive for N days
+#   GET  /orphaned[?direct_only=1]        orphaned apps (owner chains included)
+#   GET  /apps?unused=90&orphaned=1&...   cross-audit query, same filters as query_apps.py
+#   POST /refresh[?full=1]                sync now instead of waiting for the schedule
+#
+# Answers are JSON, {"taken_at", "count", "items": [rows as exported]}, and each is kept
+# until the next refresh, so a query polled again is a dict lookup. The scripts' --daemon
+# option (daemon_client) turns them into thin clients of these endpoints.
+#
+# There is no authentication: the daemon listens on localhost only, keep it that way.
+
+DEFAULT_PORT = int(DEFAULT_DAEMON_URL.rsplit(":", 1)[1])
+DEFAULT_REFRESH_MINUTES = 15
+# Everything is crawled again (and every owner looked up again) this often, for anything delta misses.
+DEFAULT_FULL_SYNC_HOURS = 24
+# Distinct answers kept per refresh (one per path + parameters); dropped all at once beyond.
+ANSWER_CACHE_SIZE = 256
+
+
+class AuditView:
+    """
+    What the queries need from one refresh, built off the event loop after the sync.
+    A new view replaces the old one as a whole, so requests never see a half-synced tenant.
+    """
+
+    def __init__(self, snapshot, orphaned, owner_chains):
+        apps = snapshot.applications.values()
+        sps = snapshot.service_principals.values()
+        self.taken_at = snapshot.taken_at
+        self.application_count = len(snapshot.applications)
+        self.service_principal_count = len(snapshot.service_principals)
+        self.expiry_index = ExpiryIndex.from_applications(apps, self.taken_at)
+        self.credentials = CredentialTable()
+        for app in apps:
+            self.credentials.add_application(app)
+        # Sorted by last sign-in: the principals inactive since a date are a prefix, plus the never signed in.
+        self.never_signed_in = [sp for sp in sps if sp["last_sign_in"] is None]
+        self.signed_in = sorted((sp for sp in sps if sp["last_sign_in"] is not None), key=lambda sp: sp["last_sign_in"])
+        self.sign_in_dates = [sp["last_sign_in"] for sp in self.signed_in]
+        self.orphaned = orphaned
+        self.owner_chains = owner_chains
+        self.app_index = AppIndex.from_snapshot(snapshot)
+        self.answers = {}  # (path, query) -> encoded JSON answer
+
+    def secrets(self, today, days):
+        return [entry_to_item(entry, today) for entry in self.expiry_index.expiring(today + timedelta(days=days))]
+
+    def unused(self, today, days):
+        threshold_date = today - timedelta(days=days)
+        inactive = self.never_signed_in + self.signed_in[:bisect.bisect_right(self.sign_in_dates, threshold_date)]
+        return [entra_unused_apps.check_unused(sp, today, threshold_date) for sp in inactive]
+
+    def rotation(self, today, days):
+        return self.credentials.analyze(today, today + timedelta(days=days))
+
+
+def _error(error_class, message):
+    return error_class(text=json.dumps({"error": message}), content_type="application/json")
+
+
+def _int(request, name, default=None):
+    value = request.query.get(name)
+    if value is None:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise _error(web.HTTPBadRequest, f"{name} must be a whole number of days, not {value!r}") from None
+
+
+def _flag(request, name):
+    return request.query.get(name, "").lower() in ("1", "true", "yes")
+
+
+class AuditDaemon:
+    """Keeps a DeltaStore in memory, refreshes it on a schedule and answers queries about it."""
+
+    def __init__(self, graph_client, state_dir, object_cache=None):
+        self.graph_client = graph_client
+        self.state_dir = state_dir
+        self.object_cache = object_cache
+        self.store = DeltaStore.load(state_dir)
+        self.view = None
+        self.refreshed_at = None
+        self.full_synced_at = None
+        self.refreshes = 0
+        self.last_error = None
+        self.last_metrics = None
+        self._lock = asyncio.Lock()
+        self._manual_refresh = None
+
+    # --- Refresh ---------------------------------------------------------------
+
+    def _evaluate(self):
+        # Runs in a thread so requests keep being answered from the previous view;
+        # the refresh lock keeps the next sync away from the store meanwhile.
+        store = self.store
+        apps = store.snapshot.applications
+        orphaned = store.cached_findings("orphaned", apps, entra_orphaned_apps.check_orphaned)
+        graph = OwnerGraph()
+        for app in apps.values():
+            graph.add_application(app)
+        view = AuditView(store.snapshot, orphaned, graph.transitive_orphans())
+        store.save()
+        return view
+
+    async def refresh(self, full=False):
+        async with self._lock:
+            started = time.perf_counter()
+            try:
+                with telemetry.collect("audit_daemon") as run:
+                    _, changes = await sync_tenant(self.graph_client, self.state_dir, full=full,
+                                                   object_cache=self.object_cache, store=self.store)
+                    with telemetry.span("evaluate.view"):
+                        self.view = await asyncio.to_thread(self._evaluate)
+            except Exception as e:
+                # Keep answering from the last good view. The store may be half-synced:
+                # start the next round from what was last saved.
+                self.last_error = f"{datetime.now(timezone.utc)}: {e}"
+                print(f"Refresh failed: {e}")
+                self.store = DeltaStore.load(self.state_dir)
+                return
+            self.refreshed_at = datetime.now(timezone.utc)
+            if full or changes.full_sync:
+                self.full_synced_at = self.refreshed_at
+            self.refreshes += 1
+            self.last_error = None
+            self.last_metrics = run.summary()
+            print_changes(changes)
+            print(f"Refreshed in {time.perf_counter() - started:.1f}s: {self.view.application_count} applications, "
+                  f"{self.view.service_principal_count} service principals.")
+
+    async def run_schedule(self, refresh_minutes, full_sync_hours):
+        """Refresh now, then every refresh_minutes; a full crawl every full_sync_hours (0: delta only)."""
+        while True:
+            full = bool(full_sync_hours) and (
+                self.full_synced_at is None or datetime.now(timezone.utc) - self.full_synced_at >= timedelta(hours=full_sync_hours))
+            await self.refresh(full)
+            await asyncio.sleep(refresh_minutes * 60)
+
+    # --- HTTP ------------------------------------------------------------------
+
+    def _answer(self, request, build):
+        """JSON answer of build(view, today) -> (items, extra keys), kept until the next refresh."""
+        view = self.view
+        if view is None:
+            raise _error(web.HTTPServiceUnavailable, "The first sync of the tenant is still running, try again shortly")
+        key = (request.path, request.query_string)
+        body = view.answers.get(key)
+        if body is None:
+            items, extra = build(view, datetime.now(timezone.utc))
+            answer = {"taken_at": view.taken_at, "count": len(items), "items": [item.as_row() for item in items]}
+            answer.update(extra)
+            body = json.dumps(answer, default=str).encode("utf-8")
+            if len(view.answers) >= ANSWER_CACHE_SIZE:
+                view.answers.clear()
+            view.answers[key] = body
+        return web.Response(body=body, content_type="application/json")
+
+    async def handle_status(self, request):
+        view = self.view
+        return web.json_response({
+            "taken_at": view.taken_at if view else None,
+            "refreshed_at": self.refreshed_at,
+            "full_synced_at": self.full_synced_at,
+            "refreshes": self.refreshes,
+            "refreshing": self._lock.locked(),
+            "applications": view.application_count if view else None,
+            "service_principals": view.service_principal_count if view else None,
+            "last_error": self.last_error,
+            "last_refresh": self.last_metrics,
+        }, dumps=lambda data: json.dumps(data, default=str))
+
+    async def handle_secrets(self, request):
+        days = _int(request, "days", 30)
+        return self._answer(request, lambda view, today: (view.secrets(today, days), {}))
+
+    async def handle_rotation(self, request):
+        days = _int(request, "days", 30)
+
+        def build(view, today):
+            analysis = view.rotation(today, days)
+            return analysis.risks, {
+                "expiring_credentials": analysis.expiring_credentials,
+                "covered_credentials": analysis.covered_credentials,
+                "overlapping_apps": analysis.overlapping_apps,
+                "duplicate_apps": analysis.duplicate_apps,
+            }
+        return self._answer(request, build)
+
+    async def handle_unused(self, request):
+        days = _int(request, "days", 365)
+        return self._answer(request, lambda view, today: (view.unused(today, days), {}))
+
+    async def handle_orphaned(self, request):
+        direct_only = _flag(request, "direct_only")
+        return self._answer(request, lambda view, today: (
+            view.orphaned if direct_only else view.orphaned + view.owner_chains, {}))
+
+    async def handle_apps(self, request):
+        unused_days, expiring_days = _int(request, "unused"), _int(request, "expiring")
+        flags = [_flag(request, name) for name in ("orphaned", "live_credentials", "no_service_principal", "no_application")]
+
+        def build(view, today):
+            filters = app_index.build_filters(today, unused_days, flags[0], flags[1], expiring_days, flags[2], flags[3])
+            if not filters:
+                raise _error(web.HTTPBadRequest, "give at least one filter (e.g. unused=90&orphaned=1&live_credentials=1)")
+            items = [app_index.to_record(entry, today) for entry in view.app_index.query(filters)]
+            items.sort(key=lambda item: item.app.lower())
+            return items, {}
+        return self._answer(request, build)
+
+    async def handle_refresh(self, request):
+        if self._manual_refresh is None or self._manual_refresh.done():
+            self._manual_refresh = asyncio.create_task(self.refresh(full=_flag(request, "full")))
+        return web.json_response({"refreshing": True}, status=202)
+
+    def app(self):
+        app = web.Application()
+        app.add_routes([
+            web.get("/status", self.handle_status),
+            web.get("/secrets", self.handle_secrets),
+            web.get("/rotation", self.handle_rotation),
+            web.get("/unused", self.handle_unused),
+            web.get("/orphaned", self.handle_orphaned),
+            web.get("/apps", self.handle_apps),
+            web.post("/refresh", self.handle_refresh),
+        ])
+        return app
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Keep the tenant state warm and answer the Entra audits over a local HTTP/JSON API.")
+    parser.add_argument("--state", metavar="DIR", default="daemon_state", help="Tenant state kept between restarts, as with --incremental (default: daemon_state)")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"Port to listen on, on localhost (default: {DEFAULT_PORT})")
+    parser.add_argument("--refresh", type=float, default=DEFAULT_REFRESH_MINUTES, metavar="MINUTES", help=f"Sync the tenant (delta) this often (default: {DEFAULT_REFRESH_MINUTES})")
+    parser.add_argument("--full-sync-hours", type=float, default=DEFAULT_FULL_SYNC_HOURS, metavar="HOURS", help=f"Crawl everything again this often (and look every owner up again); 0: delta only (default: {DEFAULT_FULL_SYNC_HOURS})")
+    parser.add_argument("--cache", metavar="FILE", default=DEFAULT_CACHE_PATH, help=f"Local cache of owner lookups, shared by the audit scripts (default: {DEFAULT_CACHE_PATH})")
+    parser.add_argument("--cache-ttl", type=float, default=DEFAULT_TTL_HOURS, metavar="HOURS", help=f"Look owners up again once their cached state is older than this; 0 disables the cache (default: {DEFAULT_TTL_HOURS})")
+    args = parser.parse_args()
+
+    # Load config
+    tenant_id = None
+    config_path = "audit_config.json"
+    if os.path.exists(config_path):
+        try:
+            with open(config_path, "r") as f:
+                config = json.load(f)
+                tenant_id = config.get("tenant_id")
+                if tenant_id and "ENTER_YOUR" in tenant_id:
+                    tenant_id = None
+        except Exception as e:
+            print(f"Warning: Failed to read {config_path}: {e}")
+
+    if tenant_id:
+        print(f"Using tenant {tenant_id} from {config_path}.")
+    else:
+        print("Using default tenant from environment/CLI context.")
+    credential = telemetry.TimedCredential(default_credential(DefaultAzureCredential, tenant_id))
+    graph_client = attach_graph_client(GraphServiceClient(credentials=credential, scopes=['https://graph.microsoft.com/.default']))
+    telemetry.instrument_graph_client(graph_client)
+    object_cache = open_cache(args.cache, args.cache_ttl)
+
+    daemon = AuditDaemon(graph_client, args.state, object_cache)
+    runner = web.AppRunner(daemon.app())
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, "127.0.0.1", args.port).start()
+        print(f"Audit daemon listening on http://127.0.0.1:{args.port} (tenant state in {args.state}, "
+              f"refresh every {args.refresh:g} minutes).")
+        await daemon.run_schedule(args.refresh, args.full_sync_hours)
+    finally:
+        await runner.cleanup()
+        if object_cache is not None:
+            object_cache.close()
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        print("Audit daemon stopped.")
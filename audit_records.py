@@ -0,0 +1,144 @@
+import dataclasses
+from dataclasses import dataclass
+from datetime import datetime
+from typing import ClassVar, Optional
+
+# Compact record types for findings and cached directory objects. Slotted dataclasses
+# take a fraction of the memory of the equivalent dicts (no per-instance __dict__, no
+# repeated keys), which matters when a run holds hundreds of thousands of them.
+
+
+class Record:
+    """
+    Base for finding records. FIELDNAMES are the report / export column names, in the
+    same order as the dataclass fields.
+    """
+
+    __slots__ = ()
+    FIELDNAMES: ClassVar[list] = []
+
+    def as_row(self):
+        """The record as a dict keyed by column name (for exports and the JSON caches)."""
+        return dict(zip(self.FIELDNAMES, (getattr(self, name) for name in self.__slots__)))
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(*(row.get(name) for name in cls.FIELDNAMES))
+
+    @classmethod
+    def column_types(cls):
+        """Column name -> declared field type, for typed exports (see export_sinks)."""
+        return {name: field.type for name, field in zip(cls.FIELDNAMES, dataclasses.fields(cls))}
+
+
+@dataclass(slots=True)
+class ExpiringCredential(Record):
+    FIELDNAMES: ClassVar[list] = ["App", "AppId", "Type", "KeyId", "Expires", "DaysLeft"]
+
+    app: str
+    app_id: str
+    cred_type: str  # "Secret" or "Certificate"
+    key_id: Optional[str]
+    expires: datetime
+    days_left: int
+
+
+@dataclass(slots=True)
+class InactiveServicePrincipal(Record):
+    FIELDNAMES: ClassVar[list] = ["App", "AppId", "LastSignIn", "DaysInactive", "ObjectId"]
+
+    app: str
+    app_id: str
+    last_sign_in: str  # "Never" if it never signed in
+    days_inactive: str  # "Forever" if it never signed in
+    object_id: str
+
+
+@dataclass(slots=True)
+class OrphanedApp(Record):
+    FIELDNAMES: ClassVar[list] = ["App", "AppId", "Type", "OwnerCount", "Owners"]
+
+    app: str
+    app_id: str
+    reason: str
+    owner_count: int
+    owners: str  # display names, "; "-separated
+
+
+@dataclass(slots=True)
+class RotationRisk(Record):
+    FIELDNAMES: ClassVar[list] = ["App", "AppId", "Risk", "Status", "CoveredUntil", "DaysLeft", "Credentials", "ValidNow", "Duplicates"]
+
+    app: str
+    app_id: str
+    risk: str  # "Critical", "High" or "Medium"
+    status: str  # "Expiring" (no credential valid past covered_until) or "Expired" (none valid now)
+    covered_until: datetime
+    days_left: int  # negative once expired
+    credentials: int
+    valid_now: int  # more than one: overlapping credentials
+    duplicates: int  # credentials with the same type and validity window as another one
+
+
+@dataclass(slots=True)
+class AppCorrelation(Record):
+    FIELDNAMES: ClassVar[list] = ["App", "AppId", "ApplicationObjectId", "ServicePrincipalObjectId", "LastSignIn",
+                                  "DaysInactive", "OwnerCount", "OrphanReason", "LiveCredentials", "NextExpiry"]
+
+    app: str
+    app_id: str
+    application_id: Optional[str]  # None: no app registration in this tenant
+    service_principal_id: Optional[str]  # None: no service principal in this tenant
+    last_sign_in: str  # "Never" if it never signed in
+    days_inactive: Optional[int]
+    owner_count: Optional[int]
+    orphan_reason: Optional[str]
+    live_credentials: int
+    next_expiry: Optional[datetime]
+
+
+@dataclass(slots=True)
+class SnapshotChange(Record):
+    FIELDNAMES: ClassVar[list] = ["Change", "Kind", "App", "AppId", "ObjectId", "Detail"]
+
+    change: str  # "Added" or "Removed"
+    kind: str  # "Application", "ServicePrincipal", "Secret", "Certificate" or "Owner"
+    app: str
+    app_id: Optional[str]
+    object_id: str  # object id, credential key id, or owner object id
+    detail: Optional[str]  # credential end date, owner name
+
+
+@dataclass(slots=True)
+class DefenderItem(Record):
+    FIELDNAMES: ClassVar[list] = ["Type", "Name", "Severity", "Status", "ChangeDate", "Resource", "Change"]
+
+    item_type: str  # "Recommendation" or "AttackPath"
+    name: Optional[str]
+    severity: Optional[str]
+    status: Optional[str]
+    change_date: Optional[str]
+    resource: str
+    change: Optional[str] = None  # Added / Changed / Resolved, in diff mode
+
+
+@dataclass(slots=True)
+class DirectoryObject:
+    """
+    State of an app owner (user or service principal). One instance per object id is
+    shared by every app it owns (see OwnerResolver.cache).
+    """
+
+    id: str
+    display_name: str
+    type: str
+    account_enabled: Optional[bool]  # None when Graph didn't tell us
+    app_id: Optional[str] = None  # service principals: appId of their application (see owner_graph)
+
+    def as_dict(self):
+        return {"id": self.id, "display_name": self.display_name, "type": self.type,
+                "account_enabled": self.account_enabled, "app_id": self.app_id}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["id"], data["display_name"], data["type"], data["account_enabled"], data.get("app_id"))
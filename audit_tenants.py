@@ -0,0 +1,197 @@
+import asyncio
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from msgraph import GraphServiceClient
+from audit_all import AUDITS, run_all_audits, run_incremental_audits
+from request_scheduler import attach_graph_client, get_scheduler, reset_schedulers
+from tenant_auth import make_credential
+from object_cache import DEFAULT_CACHE_PATH, DEFAULT_TTL_HOURS, open_cache
+from export_sinks import export_rows
+
+# Tenants audited at the same time, each in its own worker process. Building the SDK
+# models is CPU-bound, so tenants sharing one event loop would mostly wait for each
+# other. Each tenant also gets its own request schedulers (the Graph limits are per
+# tenant): a pool worker that is reused for the next tenant starts over with fresh ones.
+MAX_PARALLEL_TENANTS = 4
+
+
+def load_tenants(config_path):
+    """
+    The "tenants" list of the config file, e.g.
+        {"tenants": [{"name": "contoso", "tenant_id": "...", "client_id": "...", "client_secret_env": "CONTOSO_SECRET"}]}
+    A config with only the single-tenant "tenant_id" is treated as a list of one.
+    """
+    with open(config_path, "r") as f:
+        config = json.load(f)
+    tenants = config.get("tenants") or []
+    if not tenants and config.get("tenant_id") and "ENTER_YOUR" not in config["tenant_id"]:
+        tenants = [{"tenant_id": config["tenant_id"]}]
+    for tenant in tenants:
+        tenant.setdefault("name", tenant.get("tenant_id") or "default")
+    names = [tenant["name"] for tenant in tenants]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        raise ValueError(f"Duplicate tenant names in {config_path}: {', '.join(duplicates)}")
+    return tenants
+
+
+class TenantResult:
+    """
+    Outcome of one tenant: the findings and object counts of its AuditRun, or the error
+    that stopped it. Only these go back to the parent process, not the whole AuditRun
+    (its owner graph holds every app of the tenant).
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.findings = None
+        self.application_count = 0
+        self.service_principal_count = 0
+        self.error = None  # message only: exceptions don't always survive the trip back from the worker
+        self.seconds = 0.0
+        self.requests = {"requests": 0, "retries": 0, "throttled": 0}
+
+    def set_run(self, run):
+        self.findings = run.findings
+        self.application_count = run.application_count
+        self.service_principal_count = run.service_principal_count
+
+    def count(self, key):
+        return len(self.findings[key]) if self.findings else 0
+
+
+async def audit_tenant(tenant, options):
+    """Run the Graph audits for one tenant. Never raises: errors end up in the TenantResult."""
+    result = TenantResult(tenant["name"])
+    print(f"[{tenant['name']}] Starting audit...", flush=True)
+    start = time.perf_counter()
+    object_cache = None
+    try:
+        # Object ids are unique across tenants, so the workers can share one cache file.
+        object_cache = open_cache(options["cache"], options["cache_ttl"])
+        async with make_credential(tenant) as credential:
+            graph_client = attach_graph_client(GraphServiceClient(credentials=credential, scopes=['https://graph.microsoft.com/.default']))
+            if options["incremental"]:
+                state_dir = os.path.join(options["incremental"], tenant["name"])
+                run, _ = await run_incremental_audits(graph_client, state_dir, options["secret_days"],
+                                                      options["unused_days"], full=options["full_sync"],
+                                                      object_cache=object_cache)
+            else:
+                run = await run_all_audits(graph_client, options["secret_days"], options["unused_days"],
+                                           object_cache=object_cache)
+            result.set_run(run)
+    except Exception as e:
+        # Some errors (timeouts) have an empty message.
+        result.error = str(e) or type(e).__name__
+    finally:
+        if object_cache is not None:
+            object_cache.close()
+    result.seconds = time.perf_counter() - start
+    result.requests = get_scheduler("graph").stats()
+
+    if result.error:
+        print(f"[{tenant['name']}] Failed after {result.seconds:.1f}s: {result.error}", flush=True)
+    else:
+        counts = ", ".join(f"{key}: {result.count(key)}" for key, _, _ in AUDITS)
+        print(f"[{tenant['name']}] Done in {result.seconds:.1f}s ({counts}).", flush=True)
+    return result
+
+
+def run_tenant(tenant, options):
+    """Worker process entry point."""
+    # Workers are reused across tenants: don't carry one tenant's request counts,
+    # token bucket or throttling pause over to the next.
+    reset_schedulers()
+    return asyncio.run(audit_tenant(tenant, options))
+
+
+def print_summary(results):
+    keys = [key for key, _, _ in AUDITS]
+    print(f"\n{'Tenant':<30} | {'Apps':>7} | {'SPs':>7} | " + " | ".join(f"{key.capitalize():>8}" for key in keys)
+          + f" | {'Requests':>8} | {'Time (s)':>8} | Status")
+    print("-" * 120)
+    for result in results:
+        apps = result.application_count
+        sps = result.service_principal_count
+        status = f"FAILED: {result.error}" if result.error else "OK"
+        print(f"{result.name[:28]:<30} | {apps:>7} | {sps:>7} | " + " | ".join(f"{result.count(key):>8}" for key in keys)
+              + f" | {result.requests['requests']:>8} | {result.seconds:>8.1f} | {status}")
+
+
+def tagged_rows(results, key):
+    """Findings of one audit across all tenants, as export rows with a leading Tenant column."""
+    for result in results:
+        if result.findings:
+            for item in result.findings[key]:
+                yield {"Tenant": result.name, **item.as_row()}
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Run the secret, unused and orphaned app audits across several tenants at once.")
+    parser.add_argument("--config", default="audit_config.json", help="Config file with a \"tenants\" list (default: audit_config.json)")
+    parser.add_argument("--tenants", nargs="+", metavar="NAME", help="Only audit these tenants (by name)")
+    parser.add_argument("--secret-days", type=int, default=30, help="Days to look ahead for expiring secrets (default: 30)")
+    parser.add_argument("--unused-days", type=int, default=365, help="Days of inactivity for unused apps (default: 365)")
+    parser.add_argument("--max-parallel", type=int, default=MAX_PARALLEL_TENANTS, help=f"Tenants audited at the same time (default: {MAX_PARALLEL_TENANTS})")
+    parser.add_argument("--output-dir", help="Directory to export one file per audit (secrets.csv, unused.csv, orphaned.csv), with a Tenant column")
+    parser.add_argument("--output-format", default="csv", choices=["csv", "csv.gz", "jsonl", "jsonl.gz", "parquet"], help="File format for --output-dir (default: csv)")
+    parser.add_argument("--incremental", metavar="DIR", help="Keep each tenant's state in DIR/<tenant name> and only fetch changes on later runs")
+    parser.add_argument("--full-sync", action="store_true", help="With --incremental: ignore the stored delta tokens and crawl everything again")
+    parser.add_argument("--cache", metavar="FILE", default=DEFAULT_CACHE_PATH, help=f"Local cache of owner lookups, shared by the audit scripts and tenants (default: {DEFAULT_CACHE_PATH})")
+    parser.add_argument("--cache-ttl", type=float, default=DEFAULT_TTL_HOURS, metavar="HOURS", help=f"Look owners up again once their cached state is older than this; 0 disables the cache (default: {DEFAULT_TTL_HOURS})")
+    parser.add_argument("--details", action="store_true", help="Print every finding, not just the per-tenant summary")
+    args = parser.parse_args()
+
+    try:
+        tenants = load_tenants(args.config)
+        if args.tenants:
+            unknown = set(args.tenants) - {tenant["name"] for tenant in tenants}
+            if unknown:
+                raise ValueError(f"Unknown tenants: {', '.join(sorted(unknown))}")
+            tenants = [tenant for tenant in tenants if tenant["name"] in args.tenants]
+        if not tenants:
+            print(f"No tenants configured in {args.config}.")
+            return
+
+        print(f"Auditing {len(tenants)} tenants, {args.max_parallel} at a time "
+              f"(secrets: {args.secret_days} days, unused: {args.unused_days} days)...")
+        start = time.perf_counter()
+        options = {"secret_days": args.secret_days, "unused_days": args.unused_days,
+                   "incremental": args.incremental, "full_sync": args.full_sync,
+                   "cache": args.cache, "cache_ttl": args.cache_ttl}
+        loop = asyncio.get_running_loop()
+        with ProcessPoolExecutor(max_workers=min(args.max_parallel, len(tenants))) as pool:
+            results = await asyncio.gather(*[loop.run_in_executor(pool, run_tenant, tenant, options) for tenant in tenants])
+        print(f"\nAll tenants done in {time.perf_counter() - start:.1f}s.")
+
+        print_summary(results)
+
+        if args.details:
+            for key, title, module in AUDITS:
+                print(f"\n=== {title}: {sum(result.count(key) for result in results)} ===")
+                for result in results:
+                    if result.count(key):
+                        print(f"\n--- {result.name} ---")
+                        module.print_header()
+                        for item in result.findings[key]:
+                            module.print_item(item)
+
+        # Export: one merged file per audit, tagged by tenant
+        if args.output_dir:
+            os.makedirs(args.output_dir, exist_ok=True)
+            for key, _, module in AUDITS:
+                export_rows(tagged_rows(results, key), os.path.join(args.output_dir, f"{key}.{args.output_format}"),
+                            ["Tenant"] + module.FIELDNAMES, {"Tenant": str, **module.COLUMN_TYPES})
+
+        failed = [result.name for result in results if result.error]
+        if failed:
+            print(f"\n[!] {len(failed)} tenant(s) failed: {', '.join(failed)}")
+
+    except Exception as e:
+        print(f"An error occurred: {e}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,470 @@
+"""
+Local stand-in for graph.microsoft.com and the Resource Graph 'resources' endpoint,
+serving a synthetic tenant. Used by run_benchmark.py; can also be started on its own:
+
+    python benchmarks/mock_server.py --port 8400 --apps 10000 --latency-ms 20 --throttle-rate 0.01
+
+Objects are generated from their index on every request, so even a 500k-app tenant
+takes next to no memory in the server. Every run with the same arguments serves the same data.
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from datetime import datetime, timezone, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+GRAPH_PREFIX = "/v1.0"
+BETA_PREFIX = "/beta"
+ARG_PATH = "/providers/Microsoft.ResourceGraph/resources"
+DEFAULT_TOP = 100
+ARG_TOP = 1000
+
+
+class Tenant:
+    """Deterministic synthetic tenant: apps, their service principals, owners and Defender items."""
+
+    def __init__(self, apps, users, defender_items, subscriptions, change_percent):
+        self.apps = apps
+        self.users = users
+        self.defender_items = defender_items
+        self.subscriptions = subscriptions
+        self.change_percent = change_percent
+        self.now = datetime.now(timezone.utc).replace(microsecond=0)
+
+    # Ids encode the object kind and index, so lookups by id need no table.
+    @staticmethod
+    def _guid(kind, index):
+        return f"00000000-0000-4000-{kind}000-{index:012d}"
+
+    @staticmethod
+    def _index(object_id):
+        return int(object_id.rsplit("-", 1)[1])
+
+    def _date(self, days):
+        return (self.now + timedelta(days=days)).isoformat().replace("+00:00", "Z")
+
+    def owner_ids(self, i):
+        if i % 10 == 0:
+            return []  # ~10% of apps have no owners at all
+        # Apps owned by other apps' service principals: chains ending in an ownerless app
+        # (i % 50 == 0), an ownership cycle (21 <-> 22) and an app owned through it (23).
+        if i % 50 == 7:
+            return [self._guid("c", i - 7)]
+        if i % 100 in (21, 22, 23):
+            return [self._guid("c", {21: i + 1, 22: i - 1, 23: i - 2}[i % 100])]
+        return [self._guid("d", (i * 7 + k) % self.users) for k in range(1 + i % 3)]
+
+    def _credential(self, key_id, end_days, lifetime_days):
+        return {"keyId": key_id, "startDateTime": self._date(end_days - lifetime_days), "endDateTime": self._date(end_days)}
+
+    def application(self, i, expand_owners=False):
+        app = {
+            "id": self._guid("a", i),
+            "appId": self._guid("b", i),
+            "displayName": f"Synthetic App {i}",
+            "passwordCredentials": [
+                self._credential(self._guid("e", i * 4 + k), (i * 37 + k * 90) % 430 - 30, 365)
+                for k in range(i % 3)
+            ],
+            "keyCredentials": [
+                self._credential(self._guid("f", i), (i * 53) % 730 - 30, 730)
+            ] if i % 5 == 0 else [],
+        }
+        if expand_owners:
+            app["owners"] = [{"@odata.type": "#microsoft.graph.directoryObject", "id": owner_id} for owner_id in self.owner_ids(i)]
+        return app
+
+    def service_principal(self, i):
+        sp = {
+            "id": self._guid("c", i),
+            "appId": self._guid("b", i),
+            "displayName": f"Synthetic App {i}",
+            "signInActivity": None,
+        }
+        if i % 11:
+            sp["signInActivity"] = {"lastSignInDateTime": self._date(-((i * 7) % 800))}
+        return sp
+
+    def directory_object(self, object_id):
+        """User / service principal state as returned by getByIds, or None for a deleted owner."""
+        u = self._index(object_id)
+        if object_id.split("-")[3][0] == "c":
+            return {
+                "@odata.type": "#microsoft.graph.servicePrincipal",
+                "id": object_id,
+                "appId": self._guid("b", u),
+                "displayName": f"Synthetic App {u}",
+                "accountEnabled": True,
+            }
+        if u % 29 == 0:
+            return None
+        return {
+            "@odata.type": "#microsoft.graph.user",
+            "id": object_id,
+            "displayName": f"Synthetic User {u}",
+            "accountEnabled": u % 13 != 0,
+        }
+
+    def changed(self, i, round_number):
+        # A stable pseudo-random change_percent% of the objects change every delta round.
+        return (i * 2654435761 + round_number * 40503) % 100 < self.change_percent
+
+    def defender_item(self, j):
+        subscription = self._guid("9", j % self.subscriptions)
+        if j % 10 == 0:
+            resource = f"/subscriptions/{subscription}/providers/Microsoft.Security/attackPaths/{j}"
+            return {"Type": "AttackPath", "Name": f"Attack path {j}", "Severity": ["Low", "Medium", "High"][j % 3],
+                    "Status": "Active", "ChangeDate": self._date(-(j % 30)), "Resource": resource, "subscriptionId": subscription}
+        resource = f"/subscriptions/{subscription}/providers/Microsoft.Security/assessments/{j}"
+        return {"Type": "Recommendation", "Name": f"Recommendation {j}", "Severity": ["Low", "Medium", "High"][j % 3],
+                "Status": "Unhealthy", "ChangeDate": self._date(-(j % 30)), "Resource": resource, "subscriptionId": subscription}
+
+
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.requests = {}
+        self.rows = 0
+        self.throttled = 0
+        self.bytes = 0
+
+    def count(self, endpoint, rows=0):
+        with self.lock:
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+            self.rows += rows
+
+    def snapshot(self):
+        with self.lock:
+            return {"requests": sum(self.requests.values()), "by_endpoint": dict(self.requests),
+                    "rows": self.rows, "throttled": self.throttled, "bytes": self.bytes}
+
+
+def _select(obj, select):
+    if not select:
+        return obj
+    fields = set(select.split(",")) | {"id", "@odata.type", "owners"}
+    return {k: v for k, v in obj.items() if k in fields}
+
+
+def _projects_id(query):
+    """Whether a KQL query keeps the `id` column (no `project`, or `id` among the projected ones)."""
+    projections = re.findall(r"\|\s*project\s+([^|]*)", query)
+    if not projections:
+        return True
+    return any(column.strip() == "id" for column in projections[-1].split(","))
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "MockGraph/1.0"
+
+    def log_message(self, format, *args):
+        pass
+
+    # --- plumbing ------------------------------------------------------------
+
+    def _send(self, status, body, headers=None):
+        data = json.dumps(body).encode("utf-8")
+        with self.server.stats.lock:
+            self.server.stats.bytes += len(data)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length)) if length else {}
+
+    def _throttle(self):
+        """Inject latency, and a 429 with the configured probability."""
+        config = self.server.config
+        if config.latency:
+            time.sleep(config.latency)
+        if config.throttle_rate and self.server.random.random() < config.throttle_rate:
+            with self.server.stats.lock:
+                self.server.stats.throttled += 1
+            return True
+        return False
+
+    def _throttled_response(self, endpoint):
+        self.server.stats.count(endpoint)
+        retry_after = str(self.server.config.retry_after)
+        if endpoint.startswith("arg"):
+            self._send(429, {"error": {"code": "RateLimiting", "message": "Too many requests"}},
+                       {"Retry-After": retry_after, "x-ms-user-quota-remaining": "0"})
+        else:
+            self._send(429, {"error": {"code": "TooManyRequests", "message": "Too many requests"}},
+                       {"Retry-After": retry_after})
+
+    # --- routing -------------------------------------------------------------
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        if url.path == "/_stats":
+            return self._send(200, self.server.stats.snapshot())
+        prefix = next((p for p in (GRAPH_PREFIX, BETA_PREFIX) if url.path.startswith(p + "/")), None)
+        if prefix is None:
+            return self._send(404, {"error": {"code": "NotFound", "message": url.path}})
+        path = url.path[len(prefix):]
+        if self._throttle():
+            return self._throttled_response("graph")
+
+        tenant = self.server.tenant
+        if path in ("/applications", "/servicePrincipals"):
+            return self._list(path, query)
+        if path in ("/applications/delta", "/servicePrincipals/delta"):
+            return self._delta(path, query)
+        match = re.fullmatch(r"/applications/([^/]+)/owners", path)
+        if match:
+            owners = [{"@odata.type": "#microsoft.graph.directoryObject", "id": owner_id}
+                      for owner_id in tenant.owner_ids(tenant._index(match.group(1)))]
+            self.server.stats.count("graph:owners", len(owners))
+            return self._send(200, {"value": owners})
+        match = re.fullmatch(r"/servicePrincipals/([^/]+)", path)
+        if match:
+            self.server.stats.count("graph:servicePrincipal", 1)
+            return self._send(200, _select(tenant.service_principal(tenant._index(match.group(1))), query.get("$select")))
+        return self._send(404, {"error": {"code": "Request_ResourceNotFound", "message": path}})
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        if url.path == "/_reset":
+            self.server.stats.reset()
+            return self._send(200, {})
+        body = self._body()
+        if url.path == f"{GRAPH_PREFIX}/$batch":
+            if self._throttle():
+                return self._throttled_response("graph")
+            return self._batch(body)
+        if url.path == ARG_PATH:
+            if self._throttle():
+                return self._throttled_response("arg")
+            return self._resources(body)
+        return self._send(404, {"error": {"code": "NotFound", "message": url.path}})
+
+    # --- Graph ---------------------------------------------------------------
+
+    def _page_link(self, path, query, offset, prefix=GRAPH_PREFIX):
+        query = dict(query, **{"$skiptoken": str(offset)})
+        return f"{self.server.base_url}{prefix}{path}?{urlencode(query)}"
+
+    def _sign_in_filter(self, expression):
+        """
+        Indexes of the service principals matching a signInActivity/lastSignInDateTime
+        filter ("le <date>" or "eq null"), or None if the filter isn't one of those.
+        Cached per expression, like a server-side index.
+        """
+        cache = self.server.filter_cache
+        with self.server.cache_lock:
+            if expression in cache:
+                return cache[expression]
+        match = re.fullmatch(r"signInActivity/lastSignInDateTime (le (\S+)|eq null)", expression)
+        if not match:
+            return None
+        tenant = self.server.tenant
+        threshold = datetime.fromisoformat(match.group(2).replace("Z", "+00:00")) if match.group(2) else None
+        indexes = []
+        for i in range(tenant.apps):
+            activity = tenant.service_principal(i)["signInActivity"]
+            if threshold is None:
+                if activity is None:
+                    indexes.append(i)
+            elif activity and datetime.fromisoformat(activity["lastSignInDateTime"].replace("Z", "+00:00")) <= threshold:
+                indexes.append(i)
+        with self.server.cache_lock:
+            cache[expression] = indexes
+        return indexes
+
+    def _list(self, path, query):
+        tenant = self.server.tenant
+        top = min(int(query.get("$top", DEFAULT_TOP)), 999)
+        offset = int(query.get("$skiptoken", 0))
+        if "$filter" in query:
+            # Advanced query: like Graph, only with ConsistencyLevel: eventual.
+            if path != "/servicePrincipals" or self.headers.get("ConsistencyLevel") != "eventual":
+                self.server.stats.count("graph:rejected")
+                return self._send(400, {"error": {"code": "Request_UnsupportedQuery", "message": "Unsupported query."}})
+            indexes = self._sign_in_filter(query["$filter"])
+            if indexes is None:
+                self.server.stats.count("graph:rejected")
+                return self._send(400, {"error": {"code": "Request_UnsupportedQuery", "message": query["$filter"]}})
+        else:
+            indexes = range(tenant.apps)
+        end = min(offset + top, len(indexes))
+        if path == "/applications":
+            expand = "owners" in query.get("$expand", "")
+            items = [tenant.application(i, expand) for i in indexes[offset:end]]
+        else:
+            items = [tenant.service_principal(i) for i in indexes[offset:end]]
+        body = {"value": [_select(item, query.get("$select")) for item in items]}
+        if query.get("$count") == "true":
+            body["@odata.count"] = len(indexes)
+        if end < len(indexes):
+            prefix = BETA_PREFIX if self.path.startswith(BETA_PREFIX) else GRAPH_PREFIX
+            body["@odata.nextLink"] = self._page_link(path, query, end, prefix)
+        self.server.stats.count(f"graph:{path.strip('/')}", len(items))
+        return self._send(200, body)
+
+    def _delta(self, path, query):
+        tenant = self.server.tenant
+        token = query.get("$deltatoken")
+        base = f"{self.server.base_url}{GRAPH_PREFIX}{path}"
+        if token == "latest":
+            self.server.stats.count(f"graph:{path.strip('/')}")
+            return self._send(200, {"value": [], "@odata.deltaLink": f"{base}?$deltatoken=1"})
+        round_number = int(token or 0)
+
+        # Walk the index space from the skip token, collecting up to one page of changed objects.
+        top = DEFAULT_TOP
+        position = int(query.get("$skiptoken", 0))
+        items = []
+        while position < tenant.apps and len(items) < top:
+            if tenant.changed(position, round_number):
+                if path.startswith("/applications"):
+                    items.append(tenant.application(position))
+                else:
+                    sp = tenant.service_principal(position)
+                    sp.pop("signInActivity")  # not returned by delta
+                    items.append(sp)
+            position += 1
+        body = {"value": items}
+        if position < tenant.apps:
+            body["@odata.nextLink"] = self._page_link(path, dict(query, **{"$deltatoken": str(round_number)}), position)
+        else:
+            body["@odata.deltaLink"] = f"{base}?$deltatoken={round_number + 1}"
+        self.server.stats.count(f"graph:{path.strip('/')}", len(items))
+        return self._send(200, body)
+
+    def _batch(self, body):
+        tenant = self.server.tenant
+        config = self.server.config
+        responses = []
+        rows = 0
+        for request in body.get("requests", []):
+            if config.throttle_rate and self.server.random.random() < config.throttle_rate:
+                with self.server.stats.lock:
+                    self.server.stats.throttled += 1
+                responses.append({"id": request["id"], "status": 429, "headers": {"Retry-After": str(config.retry_after)},
+                                  "body": {"error": {"code": "TooManyRequests", "message": "Too many requests"}}})
+                continue
+            objects = [obj for obj in (tenant.directory_object(object_id) for object_id in request["body"]["ids"]) if obj]
+            rows += len(objects)
+            responses.append({"id": request["id"], "status": 200, "headers": {"Content-Type": "application/json"},
+                              "body": {"value": objects}})
+        self.server.stats.count("graph:$batch", rows)
+        return self._send(200, {"responses": responses})
+
+    # --- Resource Graph --------------------------------------------------------
+
+    def _resources(self, body):
+        tenant = self.server.tenant
+        query = body.get("query", "")
+        options = body.get("options") or {}
+        top = min(int(options.get("$top") or ARG_TOP), ARG_TOP)
+        offset = int(options.get("$skipToken") or 0)
+        subscriptions = set(body.get("subscriptions") or [])
+
+        # Just enough "KQL" to tell the repo's queries apart.
+        if "resourcecontainers" in query:
+            rows = [{"subscriptionId": tenant._guid("9", s)} for s in range(tenant.subscriptions)]
+            if subscriptions:
+                rows = [row for row in rows if row["subscriptionId"] in subscriptions]
+            page = rows[offset:offset + top]
+            total = len(rows)
+        else:
+            indexes = self._defender_indexes(query, subscriptions)
+            page = [tenant.defender_item(j) for j in indexes[offset:offset + top]]
+            total = len(indexes)
+
+        # Like ARG: no $skipToken unless the query projects `id`, the result is just cut off.
+        pageable = _projects_id(query)
+        response = {"totalRecords": total, "count": len(page), "resultTruncated": "false" if pageable else "true",
+                    "data": page, "facets": []}
+        if offset + top < total and pageable:
+            response["$skipToken"] = str(offset + top)
+        self.server.stats.count("arg:resources", len(page))
+        return self._send(200, response, {"x-ms-user-quota-remaining": "14", "x-ms-user-quota-resets-after": "00:00:05"})
+
+    def _defender_indexes(self, query, subscriptions):
+        """Indexes of the Defender items a query returns (cached per query and scope, for paging)."""
+        tenant = self.server.tenant
+        ids = re.findall(r"'/subscriptions/[^']+/(\d+)'", query)
+        if ids:
+            # Detail query for explicit resource ids.
+            return sorted({int(j) for j in ids if int(j) < tenant.defender_items})
+        key = (query, frozenset(subscriptions))
+        with self.server.cache_lock:
+            if key not in self.server.query_cache:
+                wants_reco = "assessments" in query
+                wants_paths = "attackpaths" in query
+                wanted_subscriptions = {tenant._index(s) for s in subscriptions}
+                self.server.query_cache[key] = [
+                    j for j in range(tenant.defender_items)
+                    if (wants_paths if j % 10 == 0 else wants_reco)
+                    and (not subscriptions or j % tenant.subscriptions in wanted_subscriptions)
+                ]
+            return self.server.query_cache[key]
+
+
+class MockServer(ThreadingHTTPServer):
+    # The default backlog (5) drops connections when several clients open their pools at once.
+    request_queue_size = 256
+
+
+def make_server(config, port=0, host="127.0.0.1"):
+    tenant = Tenant(config.apps, config.users, config.defender_items, config.subscriptions, config.change_percent)
+    server = MockServer((host, port), Handler)
+    server.daemon_threads = True
+    server.config = config
+    server.tenant = tenant
+    server.stats = Stats()
+    server.random = random.Random(config.seed)
+    server.filter_cache = {}
+    server.query_cache = {}
+    server.cache_lock = threading.Lock()
+    server.base_url = f"http://{host}:{server.server_address[1]}"
+    return server
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Mock Microsoft Graph / Azure Resource Graph server with a synthetic tenant.")
+    parser.add_argument("--port", type=int, default=8400)
+    parser.add_argument("--apps", type=int, default=1000, help="Applications (and as many service principals) in the tenant")
+    parser.add_argument("--users", type=int, default=None, help="Distinct app owners (default: apps / 4)")
+    parser.add_argument("--defender-items", type=int, default=None, help="Recommendations + attack paths (default: same as --apps)")
+    parser.add_argument("--subscriptions", type=int, default=200, help="Subscriptions the Defender items are spread over")
+    parser.add_argument("--change-percent", type=int, default=1, help="Share of objects that change per delta round")
+    parser.add_argument("--latency-ms", type=float, default=0, help="Added latency per request")
+    parser.add_argument("--throttle-rate", type=float, default=0, help="Probability of a 429 per request (and per $batch sub-request)")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After seconds sent with a 429")
+    parser.add_argument("--seed", type=int, default=1)
+    return parser
+
+
+def finish_config(config):
+    config.users = config.users or max(1, config.apps // 4)
+    config.defender_items = config.apps if config.defender_items is None else config.defender_items
+    config.latency = config.latency_ms / 1000
+    return config
+
+
+if __name__ == "__main__":
+    config = finish_config(build_parser().parse_args())
+    server = make_server(config, config.port)
+    print(f"Serving {config.apps} apps on {server.base_url} (Graph: {server.base_url}{GRAPH_PREFIX})", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,69 @@
+"""
+Run one of the audit scripts against the mock server, exactly as from the command line,
+but with its clients pointed at BENCH_GRAPH_URL / BENCH_ARG_URL and a dummy credential.
+
+    BENCH_GRAPH_URL=http://127.0.0.1:8400/v1.0 python benchmarks/run_audit.py entra_unused_apps --days 90
+
+Started as a subprocess by run_benchmark.py so that each run's peak RSS is its own.
+"""
+import asyncio
+import importlib
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from azure.core.credentials import AccessToken
+from azure.core.pipeline.policies import SansIOHTTPPolicy
+from azure.mgmt.resourcegraph.aio import ResourceGraphClient
+from msgraph import GraphServiceClient
+
+
+class DummyCredential:
+    """
+    Stands in for DefaultAzureCredential. The mock server doesn't check tokens, and the
+    Resource Graph client is built without an authentication policy.
+    """
+
+    def get_token(self, *scopes, **kwargs):
+        return AccessToken("benchmark", int(time.time()) + 3600)
+
+    async def close(self):
+        pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+
+def mock_graph_client(credentials=None, scopes=None, **kwargs):
+    client = GraphServiceClient(credentials=credentials, scopes=scopes, **kwargs)
+    client.request_adapter.base_url = os.environ["BENCH_GRAPH_URL"]
+    return client
+
+
+def mock_arg_client(credential, **kwargs):
+    # Plain http to the mock: azure-core refuses to send bearer tokens without TLS,
+    # so the (unused) authentication policy is replaced by a no-op.
+    return ResourceGraphClient(credential, base_url=os.environ["BENCH_ARG_URL"],
+                               authentication_policy=SansIOHTTPPolicy(), **kwargs)
+
+
+def main():
+    module_name, script_args = sys.argv[1], sys.argv[2:]
+    module = importlib.import_module(module_name)
+    for name, replacement in (("DefaultAzureCredential", DummyCredential),
+                              ("GraphServiceClient", mock_graph_client),
+                              ("ResourceGraphClient", mock_arg_client),
+                              ("make_credential", lambda tenant: DummyCredential())):
+        if hasattr(module, name):
+            setattr(module, name, replacement)
+    sys.argv = [f"{module_name}.py"] + script_args
+    asyncio.run(module.main())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+"""
+Offline benchmarks: run the audit scripts against the local mock Graph / Resource Graph
+server (mock_server.py) over synthetic tenants, and report wall time, peak RSS, request
+count, rows/sec and response bytes for each.
+
+    python benchmarks/run_benchmark.py --sizes 1000 10000 100000
+    python benchmarks/run_benchmark.py --sizes 10000 --latency-ms 30 --throttle-rate 0.02 --real-limits
+    python benchmarks/run_benchmark.py --json bench.json --baseline bench_main.json
+
+Each audit runs in its own process, so peak RSS is per run. Its output goes to a log
+file in a temporary directory; the tail of it is printed if the run fails.
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# name -> (module, script arguments, warm-up first?). "{state}" is replaced by a fresh state directory;
+# scenarios with a warm-up are run once untimed first, so the timed run measures the incremental round.
+SCENARIOS = {
+    "secrets": ("entra_app_secret_audit", ["--days", "30"], False),
+    "unused": ("entra_unused_apps", ["--days", "365"], False),
+    "unused-client-side": ("entra_unused_apps", ["--days", "365", "--client-side-filter"], False),
+    "orphaned": ("entra_orphaned_apps", [], False),
+    "defender": ("defender_new_items", ["--days", "7"], False),
+    "all": ("audit_all", [], False),
+    "all-incremental": ("audit_all", ["--incremental", "{state}"], True),
+    "defender-diff": ("defender_new_items", ["--diff-db", "{state}/defender_snapshot.db"], True),
+}
+DEFAULT_SCENARIOS = ["secrets", "unused", "orphaned", "defender"]
+
+# Without --real-limits the client-side rate limits are lifted, so the numbers measure
+# the audit code rather than the token bucket.
+UNLIMITED = {
+    "GRAPH_REQUESTS_PER_SECOND": "100000", "GRAPH_BURST": "100000",
+    "ARG_REQUESTS_PER_SECOND": "100000", "ARG_BURST": "100000",
+}
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _call(url, method="GET"):
+    request = urllib.request.Request(url, data=b"" if method == "POST" else None, method=method)
+    with urllib.request.urlopen(request, timeout=10) as response:
+        return json.load(response)
+
+
+def start_server(args, size):
+    port = _free_port()
+    command = [sys.executable, os.path.join(BENCH_DIR, "mock_server.py"),
+               "--port", str(port), "--apps", str(size),
+               "--latency-ms", str(args.latency_ms), "--throttle-rate", str(args.throttle_rate),
+               "--retry-after", str(args.retry_after), "--change-percent", str(args.change_percent)]
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+    base_url = f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        try:
+            _call(f"{base_url}/_stats")
+            return process, base_url
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("Mock server did not start")
+
+
+def _failed(exit_code, log_path):
+    # The scripts report errors ("An error occurred: ...") and still exit 0.
+    if exit_code:
+        return True
+    with open(log_path, "r", encoding="utf-8", errors="replace") as f:
+        return any(line.startswith("An error occurred") for line in f)
+
+
+def run_scenario(name, size, base_url, env, workdir):
+    """Run one scenario to completion; returns its measurements."""
+    module, script_args, warm_up = SCENARIOS[name]
+    state_dir = os.path.join(workdir, f"state-{name}-{size}")
+    command = [sys.executable, os.path.join(BENCH_DIR, "run_audit.py"), module]
+    command += [arg.replace("{state}", state_dir) for arg in script_args]
+    log_path = os.path.join(workdir, f"{name}-{size}.log")
+
+    with open(log_path, "w") as log:
+        if warm_up:
+            subprocess.run(command, cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT, check=False)
+        _call(f"{base_url}/_reset", "POST")
+
+        # Output goes to a file: printing every finding is part of what the scripts do.
+        start = time.perf_counter()
+        process = subprocess.Popen(command, cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+        _, status, rusage = os.wait4(process.pid, 0)
+        wall = time.perf_counter() - start
+        process.returncode = os.waitstatus_to_exitcode(status)
+
+    stats = _call(f"{base_url}/_stats")
+    # ru_maxrss is in KiB on Linux, bytes on macOS.
+    peak_rss = rusage.ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+    return {
+        "scenario": name,
+        "size": size,
+        "failed": _failed(process.returncode, log_path),
+        "wall_seconds": round(wall, 3),
+        "peak_rss_mb": round(peak_rss / (1024 * 1024), 1),
+        "requests": stats["requests"],
+        "throttled": stats["throttled"],
+        "rows": stats["rows"],
+        "rows_per_second": round(stats["rows"] / wall) if wall else 0,
+        "response_mb": round(stats["bytes"] / (1024 * 1024), 1),
+        "by_endpoint": stats["by_endpoint"],
+        "log": log_path,
+    }
+
+
+def print_results(results):
+    print(f"\n{'Size':>8} | {'Scenario':<16} | {'Wall (s)':>9} | {'Peak RSS (MB)':>13} | {'Requests':>8} | {'429s':>5} | {'Rows':>9} | {'Rows/s':>9} | {'Resp (MB)':>9}")
+    print("-" * 112)
+    for r in results:
+        failed = "  FAILED" if r["failed"] else ""
+        print(f"{r['size']:>8} | {r['scenario']:<16} | {r['wall_seconds']:>9} | {r['peak_rss_mb']:>13} | "
+              f"{r['requests']:>8} | {r['throttled']:>5} | {r['rows']:>9} | {r['rows_per_second']:>9} | {r.get('response_mb', '-'):>9}{failed}")
+
+
+def compare(results, baseline_path, tolerance):
+    """Print wall time, RSS and request count changes against a saved run; returns the regressions."""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = {(r["size"], r["scenario"]): r for r in json.load(f)["results"]}
+    regressions = []
+    print(f"\nCompared to {baseline_path} (tolerance {tolerance:.0%}):")
+    for r in results:
+        base = baseline.get((r["size"], r["scenario"]))
+        if not base:
+            continue
+        for metric in ("wall_seconds", "peak_rss_mb", "requests"):
+            change = (r[metric] - base[metric]) / base[metric] if base[metric] else 0.0
+            flag = ""
+            if change > tolerance:
+                flag = "  REGRESSION"
+                regressions.append((r["size"], r["scenario"], metric, change))
+            print(f"  {r['size']:>8} {r['scenario']:<16} {metric:<13} {base[metric]:>10} -> {r[metric]:<10} ({change:+.0%}){flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the audit scripts against a local mock Graph / Resource Graph server.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000], help="Tenant sizes (number of applications) to generate (default: 1000 10000)")
+    parser.add_argument("--scenarios", nargs="+", choices=sorted(SCENARIOS), default=DEFAULT_SCENARIOS, help="What to run (default: the four audit scripts)")
+    parser.add_argument("--latency-ms", type=float, default=0, help="Latency added by the mock to every request")
+    parser.add_argument("--throttle-rate", type=float, default=0, help="Probability of a 429 per request")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After seconds sent with each 429")
+    parser.add_argument("--change-percent", type=int, default=1, help="Objects changed per delta round, for the incremental scenarios")
+    parser.add_argument("--real-limits", action="store_true", help="Keep the client-side rate limits (see request_scheduler.py) instead of lifting them")
+    parser.add_argument("--json", metavar="PATH", help="Write the results to PATH")
+    parser.add_argument("--baseline", metavar="PATH", help="Compare against results saved with --json; exit 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed slowdown / growth against --baseline (default: 0.2 = 20%%)")
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    if not args.real_limits:
+        env.update(UNLIMITED)
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix="audit-bench-") as workdir:
+        for size in args.sizes:
+            server, base_url = start_server(args, size)
+            env["BENCH_GRAPH_URL"] = f"{base_url}/v1.0"
+            env["BENCH_ARG_URL"] = base_url
+            try:
+                for name in args.scenarios:
+                    print(f"Running {name} on a tenant of {size} apps...", flush=True)
+                    result = run_scenario(name, size, base_url, env, workdir)
+                    if result["failed"]:
+                        with open(result["log"], "r", encoding="utf-8", errors="replace") as f:
+                            print(f.read()[-2000:])
+                    del result["log"]
+                    results.append(result)
+            finally:
+                server.terminate()
+                server.wait()
+        print_results(results)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({
+                "python": sys.version.split()[0],
+                "latency_ms": args.latency_ms,
+                "throttle_rate": args.throttle_rate,
+                "real_limits": args.real_limits,
+                "results": results,
+            }, f, indent=2)
+        print(f"\nResults written to {args.json}.")
+
+    failed = [r for r in results if r["failed"]]
+    regressions = compare(results, args.baseline, args.tolerance) if args.baseline else []
+    if failed or regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+import os
+from datetime import datetime, timedelta, timezone
+from audit_records import DefenderItem, DirectoryObject
+
+# On-disk form of a TenantSnapshot (and of Defender items): one Arrow IPC file per table.
+#
+#   applications.arrow        id, app_id, display_name
+#   credentials.arrow         application (row in applications), type, key_id, start_date_time, end_date_time
+#   directory_objects.arrow   id, display_name, type, account_enabled, app_id (every owner once)
+#   owners.arrow              application (row in applications), owner (row in directory_objects)
+#   service_principals.arrow  id, app_id, display_name, last_sign_in
+#   defender_items.arrow      the DefenderItem columns (defender_new_items.py --save-snapshot)
+#   app_index.arrow           AppIndex entries (see app_index)
+#   expiry_index.arrow        ExpiryIndex entries, sorted by end date (see expiry_index)
+#
+# Credentials and owners are flat tables pointing at their application's row instead of
+# nested lists, so an owner of a thousand apps is stored once. Repetitive strings (types,
+# severities, statuses) are dictionary encoded and the buffers are zstd-compressed, which
+# keeps a weekly history of snapshots cheap.
+#
+# Files are memory-mapped and read lazily: opening a snapshot only reads the file
+# footers, and ColumnarSnapshot.table(name, columns) reads just those columns, so e.g.
+# comparing the ids of two snapshots (compare_snapshots.py) never touches names,
+# credentials or owners. Tables are written in record batches of BATCH_SIZE rows, and
+# ColumnarSnapshot.rows(name, start, stop) decompresses only the batches holding those rows
+# (e.g. the first entries of the sorted expiry index).
+
+COMPRESSION = "zstd"
+# Rows per record batch (every batch but the last one is full).
+BATCH_SIZE = 65536
+
+APPLICATIONS = "applications"
+CREDENTIALS = "credentials"
+DIRECTORY_OBJECTS = "directory_objects"
+OWNERS = "owners"
+SERVICE_PRINCIPALS = "service_principals"
+DEFENDER_ITEMS = "defender_items"
+APP_INDEX = "app_index"
+EXPIRY_INDEX = "expiry_index"
+
+CREDENTIAL_TYPES = ("password_credentials", "key_credentials")
+# Credential type -> what the audits call it.
+CREDENTIAL_LABELS = {"password_credentials": "Secret", "key_credentials": "Certificate"}
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.compute
+        import pyarrow.ipc
+    except ImportError:
+        raise RuntimeError("The snapshot format needs pyarrow: pip install pyarrow")
+    return pyarrow
+
+
+def _schemas(pa):
+    text = pa.string()
+    dictionary = pa.dictionary(pa.int32(), pa.string())
+    timestamp = pa.timestamp("us", tz="UTC")
+    return {
+        APPLICATIONS: pa.schema([("id", text), ("app_id", text), ("display_name", text)]),
+        CREDENTIALS: pa.schema([("application", pa.int32()), ("type", dictionary), ("key_id", text),
+                                ("start_date_time", timestamp), ("end_date_time", timestamp)]),
+        DIRECTORY_OBJECTS: pa.schema([("id", text), ("display_name", text), ("type", dictionary),
+                                      ("account_enabled", pa.bool_()), ("app_id", text)]),
+        OWNERS: pa.schema([("application", pa.int32()), ("owner", pa.int32())]),
+        SERVICE_PRINCIPALS: pa.schema([("id", text), ("app_id", text), ("display_name", text), ("last_sign_in", timestamp)]),
+        DEFENDER_ITEMS: pa.schema([(name, dictionary if name in ("Type", "Severity", "Status", "Change") else text)
+                                   for name in DefenderItem.FIELDNAMES]),
+        APP_INDEX: pa.schema([("app_id", text), ("display_name", text), ("application_id", text),
+                              ("service_principal_id", text), ("credential_starts", pa.list_(timestamp)),
+                              ("credential_ends", pa.list_(timestamp)), ("owner_count", pa.int32()),
+                              ("orphan_reason", dictionary), ("last_sign_in", timestamp)]),
+        EXPIRY_INDEX: pa.schema([("end_date_time", timestamp), ("app_id", text), ("key_id", text),
+                                 ("type", dictionary), ("display_name", text)]),
+    }
+
+
+def _file(path, name):
+    return os.path.join(path, f"{name}.arrow")
+
+
+def _write_table(pa, path, name, columns, metadata=None):
+    schema = _schemas(pa)[name]
+    if metadata:
+        schema = schema.with_metadata(metadata)
+    table = pa.Table.from_arrays([pa.array(columns[field.name], field.type) for field in schema], schema=schema)
+    # Written next to the target and renamed over it, so a reader never sees half a file.
+    file_path = _file(path, name)
+    options = pa.ipc.IpcWriteOptions(compression=COMPRESSION)
+    with pa.OSFile(f"{file_path}.tmp", "wb") as sink, pa.ipc.new_file(sink, schema, options=options) as writer:
+        writer.write_table(table, max_chunksize=BATCH_SIZE)
+    os.replace(f"{file_path}.tmp", file_path)
+
+
+def write_tenant(path, applications, service_principals):
+    """Write projected applications (with resolved owners) and service principals to path."""
+    pa = _pyarrow()
+    os.makedirs(path, exist_ok=True)
+    apps = {"id": [], "app_id": [], "display_name": []}
+    creds = {"application": [], "type": [], "key_id": [], "start_date_time": [], "end_date_time": []}
+    objects = {"id": [], "display_name": [], "type": [], "account_enabled": [], "app_id": []}
+    owners = {"application": [], "owner": []}
+    object_rows = {}
+    for row, app in enumerate(applications):
+        for key in apps:
+            apps[key].append(app[key])
+        for cred_type in CREDENTIAL_TYPES:
+            for cred in app[cred_type]:
+                creds["application"].append(row)
+                creds["type"].append(cred_type)
+                creds["key_id"].append(cred["key_id"])
+                creds["start_date_time"].append(cred.get("start_date_time"))
+                creds["end_date_time"].append(cred["end_date_time"])
+        for owner in app["owners"]:
+            owner_row = object_rows.get(owner.id)
+            if owner_row is None:
+                owner_row = object_rows[owner.id] = len(objects["id"])
+                for key in objects:
+                    objects[key].append(getattr(owner, key))
+            owners["application"].append(row)
+            owners["owner"].append(owner_row)
+    sps = {"id": [], "app_id": [], "display_name": [], "last_sign_in": []}
+    for sp in service_principals:
+        for key in sps:
+            sps[key].append(sp[key])
+    for name, columns in ((APPLICATIONS, apps), (CREDENTIALS, creds), (DIRECTORY_OBJECTS, objects),
+                          (OWNERS, owners), (SERVICE_PRINCIPALS, sps)):
+        _write_table(pa, path, name, columns)
+
+
+def write_defender_items(path, items):
+    """Write DefenderItem records to path (next to a tenant snapshot, or on their own)."""
+    pa = _pyarrow()
+    os.makedirs(path, exist_ok=True)
+    columns = {name: [] for name in DefenderItem.FIELDNAMES}
+    for item in items:
+        for name, value in item.as_row().items():
+            columns[name].append(str(value) if value is not None else None)
+    _write_table(pa, path, DEFENDER_ITEMS, columns)
+
+
+def _datetimes(pa, values):
+    # pyarrow turns zoned timestamps into datetimes through zoneinfo, several times slower
+    # than adding microseconds to the epoch. This also gives timezone.utc, like the projection.
+    return [EPOCH + timedelta(microseconds=value) if value is not None else None
+            for value in values.cast(pa.int64()).to_pylist()]
+
+
+def to_pydict(table):
+    """table.to_pydict(), with timestamps (and lists of them) converted the fast way."""
+    pa = _pyarrow()
+    columns = {}
+    for field, column in zip(table.schema, table.columns):
+        if pa.types.is_timestamp(field.type):
+            columns[field.name] = _datetimes(pa, column)
+        elif pa.types.is_list(field.type) and pa.types.is_timestamp(field.type.value_type):
+            column = column.combine_chunks()
+            values = iter(_datetimes(pa, column.flatten()))
+            lengths = pa.compute.list_value_length(column).to_pylist()
+            columns[field.name] = [[next(values) for _ in range(length or 0)] for length in lengths]
+        elif pa.types.is_dictionary(field.type):
+            # Decoded in one go rather than value by value.
+            columns[field.name] = column.cast(field.type.value_type).to_pylist()
+        else:
+            columns[field.name] = column.to_pylist()
+    return columns
+
+
+def write_app_index(path, columns, taken_at=None):
+    """Write AppIndex columns ({column: values}, see _schemas) to path."""
+    pa = _pyarrow()
+    os.makedirs(path, exist_ok=True)
+    _write_table(pa, path, APP_INDEX, columns, {"taken_at": taken_at.isoformat() if taken_at else ""})
+
+
+def write_expiry_index(path, columns, taken_at=None):
+    """Write ExpiryIndex columns ({column: values}, rows already sorted by end date) to path."""
+    pa = _pyarrow()
+    os.makedirs(path, exist_ok=True)
+    _write_table(pa, path, EXPIRY_INDEX, columns, {"taken_at": taken_at.isoformat() if taken_at else ""})
+
+
+class ColumnarSnapshot:
+    """A snapshot directory written by write_tenant, opened without reading it."""
+
+    def __init__(self, path):
+        self.path = path
+        self.pa = _pyarrow()
+        self._schemas = {}
+
+    @staticmethod
+    def exists(path, name=APPLICATIONS):
+        return os.path.exists(_file(path, name))
+
+    def schema(self, name):
+        if name not in self._schemas:
+            self._schemas[name] = self.pa.ipc.open_file(self.pa.memory_map(_file(self.path, name))).schema
+        return self._schemas[name]
+
+    def table(self, name, columns=None):
+        """The table `name` as a pyarrow Table, with only `columns` read from disk (all of them by default)."""
+        options = None
+        if columns is not None:
+            schema = self.schema(name)
+            options = self.pa.ipc.IpcReadOptions(included_fields=[schema.get_field_index(column) for column in columns])
+        return self.pa.ipc.open_file(self.pa.memory_map(_file(self.path, name)), options=options).read_all()
+
+    def rows(self, name, start, stop):
+        """Rows start..stop of table `name` as a pyarrow Table, reading only the record batches that hold them."""
+        reader = self.pa.ipc.open_file(self.pa.memory_map(_file(self.path, name)))
+        if stop <= start:
+            return reader.schema.empty_table()
+        first = start // BATCH_SIZE
+        batches = [reader.get_batch(i) for i in range(first, (stop - 1) // BATCH_SIZE + 1)]
+        return self.pa.Table.from_batches(batches, reader.schema).slice(start - first * BATCH_SIZE, stop - start)
+
+    def columns(self, name, columns=None):
+        """The table `name` as {column: list of Python values}, reading only `columns`."""
+        return to_pydict(self.table(name, columns))
+
+    def applications(self):
+        """The applications as projected dicts (see tenant_snapshot.project_application)."""
+        apps = self.columns(APPLICATIONS)
+        records = [
+            {"id": object_id, "app_id": app_id, "display_name": display_name,
+             "password_credentials": [], "key_credentials": [], "owners": []}
+            for object_id, app_id, display_name in zip(apps["id"], apps["app_id"], apps["display_name"])
+        ]
+        creds = self.columns(CREDENTIALS)
+        for row, cred_type, key_id, start, end in zip(creds["application"], creds["type"], creds["key_id"],
+                                                     creds["start_date_time"], creds["end_date_time"]):
+            records[row][cred_type].append({"key_id": key_id, "start_date_time": start, "end_date_time": end})
+        objects = self.columns(DIRECTORY_OBJECTS)
+        # One DirectoryObject per owner, shared by every app it owns (as OwnerResolver does).
+        owners = [DirectoryObject(*fields) for fields in zip(objects["id"], objects["display_name"], objects["type"],
+                                                              objects["account_enabled"], objects["app_id"])]
+        links = self.columns(OWNERS)
+        for row, owner in zip(links["application"], links["owner"]):
+            records[row]["owners"].append(owners[owner])
+        return records
+
+    def service_principals(self):
+        """The service principals as projected dicts (see tenant_snapshot.project_service_principal)."""
+        sps = self.columns(SERVICE_PRINCIPALS)
+        return [dict(zip(sps, values)) for values in zip(*sps.values())]
+
+    def defender_items(self):
+        return [DefenderItem.from_row(row) for row in self.table(DEFENDER_ITEMS).to_pylist()]
@@ -0,0 +1,129 @@
+import argparse
+import json
+import os
+from audit_records import SnapshotChange
+from columnar_snapshot import (
+    APPLICATIONS, CREDENTIAL_LABELS, CREDENTIALS, DIRECTORY_OBJECTS, OWNERS, SERVICE_PRINCIPALS,
+    ColumnarSnapshot, to_pydict,
+)
+from export_sinks import export_rows
+
+FIELDNAMES = SnapshotChange.FIELDNAMES
+COLUMN_TYPES = SnapshotChange.column_types()
+
+# What changed between two saved snapshots (e.g. last week's and today's): applications
+# and service principals added/removed, secrets and certificates added/removed, and
+# owners added to / removed from apps.
+#
+# Only the key columns of both snapshots are read (memory-mapped, see columnar_snapshot)
+# and compared with Arrow set lookups; names and dates are read for the changed rows only.
+
+KINDS = ["Application", "ServicePrincipal", "Credential", "Owner"]
+
+
+def open_snapshot(path):
+    if not ColumnarSnapshot.exists(path):
+        raise ValueError(f"{path} is not a snapshot in the columnar format (older snapshots: load and save them once "
+                         f"with audit_all.py --from-snapshot {path} --save-snapshot DIR)")
+    with open(os.path.join(path, "snapshot.json"), "r", encoding="utf-8") as f:
+        taken_at = json.load(f)["taken_at"]
+    return ColumnarSnapshot(path), taken_at
+
+
+def _keys(snapshot, kind):
+    """The column that identifies each row of `kind`."""
+    if kind == "Owner":
+        links = snapshot.table(OWNERS)
+        app_ids = snapshot.table(APPLICATIONS, ["id"]).column(0).take(links.column("application"))
+        owner_ids = snapshot.table(DIRECTORY_OBJECTS, ["id"]).column(0).take(links.column("owner"))
+        return snapshot.pa.compute.binary_join_element_wise(app_ids, owner_ids, "/")
+    if kind == "Credential":
+        return snapshot.table(CREDENTIALS, ["key_id"]).column(0)
+    return snapshot.table(APPLICATIONS if kind == "Application" else SERVICE_PRINCIPALS, ["id"]).column(0)
+
+
+def _missing(pa, keys, other_keys):
+    """Row numbers of the keys that aren't among other_keys."""
+    present = pa.compute.is_in(keys, value_set=other_keys.combine_chunks())
+    return pa.compute.indices_nonzero(pa.compute.invert(present)).to_pylist()
+
+
+def _changes(snapshot, kind, change, rows):
+    if not rows:
+        return []
+    if kind in ("Application", "ServicePrincipal"):
+        table = APPLICATIONS if kind == "Application" else SERVICE_PRINCIPALS
+        found = to_pydict(snapshot.table(table, ["id", "app_id", "display_name"]).take(rows))
+        return [SnapshotChange(change, kind, name, app_id, object_id, None)
+                for object_id, app_id, name in zip(found["id"], found["app_id"], found["display_name"])]
+    apps = snapshot.table(APPLICATIONS, ["app_id", "display_name"])
+    if kind == "Credential":
+        creds = to_pydict(snapshot.table(CREDENTIALS, ["application", "type", "key_id", "end_date_time"]).take(rows))
+        found = to_pydict(apps.take(creds["application"]))
+        return [SnapshotChange(change, CREDENTIAL_LABELS[cred_type], name, app_id, key_id, str(end) if end else None)
+                for cred_type, key_id, end, app_id, name
+                in zip(creds["type"], creds["key_id"], creds["end_date_time"], found["app_id"], found["display_name"])]
+    links = to_pydict(snapshot.table(OWNERS).take(rows))
+    found = to_pydict(apps.take(links["application"]))
+    owners = to_pydict(snapshot.table(DIRECTORY_OBJECTS, ["id", "display_name"]).take(links["owner"]))
+    return [SnapshotChange(change, "Owner", name, app_id, owner_id, owner_name)
+            for app_id, name, owner_id, owner_name
+            in zip(found["app_id"], found["display_name"], owners["id"], owners["display_name"])]
+
+
+def compare(old, new):
+    """SnapshotChange records between two ColumnarSnapshots, by kind: added (in new only), then removed."""
+    changes = []
+    for kind in KINDS:
+        old_keys, new_keys = _keys(old, kind), _keys(new, kind)
+        changes.extend(_changes(new, kind, "Added", _missing(new.pa, new_keys, old_keys)))
+        changes.extend(_changes(old, kind, "Removed", _missing(old.pa, old_keys, new_keys)))
+    return changes
+
+
+def print_header():
+    print(f"\n{'Change':<8} | {'Kind':<16} | {'App Name':<30} | {'Detail':<32} | {'Object ID'}")
+    print("-" * 130)
+
+
+def print_item(item):
+    print(f"{item.change:<8} | {item.kind:<16} | {item.app[:28]:<30} | {(item.detail or '')[:30]:<32} | {item.object_id}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two saved tenant snapshots: apps, service principals, credentials and owners added or removed.")
+    parser.add_argument("old", metavar="OLD_DIR", help="The earlier snapshot (audit_all.py --save-snapshot, or an --incremental state directory)")
+    parser.add_argument("new", metavar="NEW_DIR", help="The later snapshot")
+    parser.add_argument("--summary", action="store_true", help="Only print the number of changes per kind")
+    parser.add_argument("--output", help="Export the changes to a file: .csv, .jsonl or .parquet (add .gz to compress csv/jsonl)")
+    args = parser.parse_args()
+
+    try:
+        old, old_taken_at = open_snapshot(args.old)
+        new, new_taken_at = open_snapshot(args.new)
+        print(f"Comparing the snapshot taken at {old_taken_at} with the one taken at {new_taken_at}...")
+
+        items = compare(old, new)
+
+        counts = {}
+        for item in items:
+            counts[(item.kind, item.change)] = counts.get((item.kind, item.change), 0) + 1
+        print(f"\n{'Kind':<16} | {'Added':>8} | {'Removed':>8}")
+        print("-" * 38)
+        for kind in ("Application", "ServicePrincipal", "Secret", "Certificate", "Owner"):
+            print(f"{kind:<16} | {counts.get((kind, 'Added'), 0):>8} | {counts.get((kind, 'Removed'), 0):>8}")
+
+        if items and not args.summary:
+            print_header()
+            for item in items:
+                print_item(item)
+        print(f"\n{len(items)} changes.")
+
+        if args.output:
+            export_rows(items, args.output, FIELDNAMES, COLUMN_TYPES)
+
+    except Exception as e:
+        print(f"An error occurred: {e}")
+
+if __name__ == "__main__":
+    main()
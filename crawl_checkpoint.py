@@ -0,0 +1,152 @@
+import dataclasses
+import json
+import os
+from datetime import datetime
+
+# Progress of a full crawl (see tenant_snapshot.crawl_tenant), saved after every page so
+# a crawl that gets killed (Functions timeout, Ctrl+C) continues where it stopped:
+#
+#   checkpoint.json          per collection: the nextLink of the next page, objects processed,
+#                            whether it is done; byte size of each findings file at that point
+#   findings_<key>.jsonl     findings of the pages processed so far, one row per line
+#
+# Findings are appended before checkpoint.json is replaced, so on resume anything past
+# the recorded size belongs to a page that wasn't checkpointed and is cut off (the page
+# is fetched again).
+
+COLLECTIONS = ("applications", "service_principals")
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def _restore(record_type, row):
+    """Rebuild a finding record from its JSON row, datetimes included."""
+    item = record_type.from_row(row)
+    for field in dataclasses.fields(record_type):
+        value = getattr(item, field.name)
+        if field.type is datetime and isinstance(value, str):
+            setattr(item, field.name, datetime.fromisoformat(value))
+    return item
+
+
+class CrawlCheckpoint:
+    """
+    Checkpoint directory for one audit run. params (e.g. the audit thresholds) are
+    stored with it: a checkpoint taken with other params is not resumed.
+    """
+
+    FILE = "checkpoint.json"
+
+    def __init__(self, path, params):
+        self.path = path
+        self.params = params
+        self.started_at = None
+        self.collections = {}
+        self.findings = {}
+        self.written = {}  # key -> rows of findings[key] already in the file
+        self.offsets = {}  # key -> file size after the last checkpointed page
+
+    def _findings_file(self, key):
+        return os.path.join(self.path, f"findings_{key}.jsonl")
+
+    def resume(self, record_types):
+        """
+        Load an unfinished checkpoint. Returns True if there was one for the same params;
+        self.findings then holds the findings so far ({key: [records]}, keys from record_types).
+        """
+        file_path = os.path.join(self.path, self.FILE)
+        if not os.path.exists(file_path):
+            return False
+        with open(file_path, "r", encoding="utf-8") as f:
+            state = json.load(f)
+        if state["params"] != self.params:
+            print(f"Checkpoint in {self.path} was taken with different settings ({state['params']}), starting over.")
+            return False
+
+        self.started_at = datetime.fromisoformat(state["started_at"])
+        self.collections = state["collections"]
+        for key, record_type in record_types.items():
+            findings_file = self._findings_file(key)
+            offset = state["offsets"].get(key, 0)
+            items = []
+            if os.path.exists(findings_file):
+                os.truncate(findings_file, offset)
+                with open(findings_file, "r", encoding="utf-8") as f:
+                    items = [_restore(record_type, json.loads(line)) for line in f if line.strip()]
+            self.findings[key] = items
+            self.written[key] = len(items)
+            self.offsets[key] = offset
+        return True
+
+    def start(self, findings, started_at):
+        """
+        Start a new checkpoint, replacing any previous one. findings is the {key: list}
+        the audit appends its findings to; page_done writes out what was added.
+        """
+        os.makedirs(self.path, exist_ok=True)
+        self.started_at = started_at
+        self.collections = {name: {"next_link": None, "processed": 0, "done": False} for name in COLLECTIONS}
+        self.findings = findings
+        for key in findings:
+            open(self._findings_file(key), "w", encoding="utf-8").close()
+            self.written[key] = 0
+            self.offsets[key] = 0
+        self._save()
+
+    def next_link(self, collection):
+        return self.collections[collection]["next_link"]
+
+    def done(self, collection):
+        return self.collections[collection]["done"]
+
+    def processed(self, collection):
+        return self.collections[collection]["processed"]
+
+    def page_done(self, collection, next_link, count):
+        """
+        Record that a page of `count` objects has been evaluated and the crawl continues at
+        next_link (None: the collection is complete). Call it right after evaluating the
+        page, without awaiting anything in between, so every finding written belongs to
+        a fully evaluated page.
+        """
+        for key, items in self.findings.items():
+            new_items = items[self.written[key]:]
+            if not new_items:
+                continue
+            with open(self._findings_file(key), "a", encoding="utf-8") as f:
+                for item in new_items:
+                    f.write(json.dumps(item.as_row(), default=_json_default))
+                    f.write("\n")
+                f.flush()
+                os.fsync(f.fileno())
+                self.offsets[key] = f.tell()
+            self.written[key] = len(items)
+
+        state = self.collections[collection]
+        state["next_link"] = next_link
+        state["processed"] += count
+        state["done"] = next_link is None
+        self._save()
+
+    def _save(self):
+        # Write-then-rename: a crash mid-write leaves the previous checkpoint intact.
+        file_path = os.path.join(self.path, self.FILE)
+        with open(file_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({
+                "params": self.params,
+                "started_at": self.started_at.isoformat(),
+                "collections": self.collections,
+                "offsets": self.offsets,
+            }, f, indent=2)
+        os.replace(file_path + ".tmp", file_path)
+
+    def clear(self):
+        """Remove the checkpoint once the crawl has completed."""
+        for name in [self.FILE] + [f"findings_{key}.jsonl" for key in self.findings]:
+            file_path = os.path.join(self.path, name)
+            if os.path.exists(file_path):
+                os.remove(file_path)
@@ -0,0 +1,60 @@
+import json
+from datetime import datetime
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlencode
+from urllib.request import Request, urlopen
+
+# Client side of audit_daemon.py, for the scripts' --daemon URL option: the answer comes
+# from the daemon's warm tenant state instead of a crawl. Standard library only, so a
+# thin client doesn't pay for importing the SDKs it no longer needs.
+
+DEFAULT_DAEMON_URL = "http://127.0.0.1:8787"
+
+# Generous: a first query at a new threshold over a large tenant still has to build its answer.
+TIMEOUT_SECONDS = 120
+
+
+class DaemonError(Exception):
+    pass
+
+
+def _params(params):
+    # None / False: leave the parameter out; True: a flag ("1").
+    return {name: "1" if value is True else value for name, value in params.items() if value is not None and value is not False}
+
+
+def query(url, path, method="GET", **params):
+    """Ask the daemon at `url` (e.g. http://127.0.0.1:8787) for `path`; returns the decoded JSON answer."""
+    params = _params(params)
+    full_url = f"{url.rstrip('/')}/{path.lstrip('/')}" + (f"?{urlencode(params)}" if params else "")
+    try:
+        with urlopen(Request(full_url, method=method), timeout=TIMEOUT_SECONDS) as response:
+            return json.load(response)
+    except HTTPError as e:
+        # The daemon says what's wrong in the body (bad parameter, first sync still running...).
+        try:
+            message = json.load(e).get("error")
+        except ValueError:
+            message = None
+        raise DaemonError(f"HTTP {e.code} from {full_url}: {message or e.reason}") from None
+    except URLError as e:
+        raise DaemonError(f"Audit daemon not reachable at {url} ({e.reason}). Is audit_daemon.py running?") from None
+
+
+def records(answer, record_type, dates=()):
+    """
+    The answer's rows as records of record_type. Fields listed in `dates` are parsed back
+    into datetimes (JSON carries them as strings).
+    """
+    items = [record_type.from_row(row) for row in answer["items"]]
+    for item in items:
+        for name in dates:
+            value = getattr(item, name)
+            if value:
+                setattr(item, name, datetime.fromisoformat(value))
+    return items
+
+
+def taken_at(answer):
+    value = answer.get("taken_at")
+    return datetime.fromisoformat(value) if value else None
@@ -1,20 +1,156 @@
 import asyncio
 import argparse
 import json
-import csv
 import os
-from datetime import datetime, timezone, timedelta
-from azure.identity import DefaultAzureCredential
-from azure.mgmt.resourcegraph import ResourceGraphClient
-from azure.mgmt.resourcegraph.models import QueryRequest
+from azure.identity.aio import DefaultAzureCredential
+from azure.mgmt.resourcegraph.aio import ResourceGraphClient
+from defender_snapshot import diff_defender_items
+from export_sinks import export_rows
+from audit_records import DefenderItem
+from columnar_snapshot import write_defender_items
+from resource_graph import (
+    MAX_PARALLEL_SHARDS, SUBSCRIPTION_BATCH_SIZE, list_subscriptions, run_query, run_sharded_query,
+)
+from tenant_auth import default_credential
+
+
+def build_queries(days):
+    """Return the (recommendations, attack paths) Resource Graph queries for a look-back of `days`."""
+    # KQL uses ago(), but we can insert the specific date string or just use ago(Xd)
+    # Using string interpolation for safety and control.
+
+    # Query 1: Recommendations (Assessments) that are currently 'Unhealthy' and whose status changed recently
+    query_recommendations = f"""
+    securityresources
+    | where type == "microsoft.security/assessments"
+    | where properties.status.code == "Unhealthy"
+    | where properties.status.statusChangeDate > ago({days}d)
+    | project
+        id,
+        Type="Recommendation",
+        Name=properties.displayName,
+        Severity=properties.metadata.severity,
+        Status=properties.status.code,
+        ChangeDate=todatetime(properties.status.statusChangeDate),
+        Resource=id
+    | order by ChangeDate desc
+    """
+
+    # Query 2: Attack Paths (Preview/New Feature data structure)
+    # Attack paths might not have a clean 'creationDate' in all API versions exposed via ARG yet.
+    # If no timestamp, we just list them as "Active Attack Path".
+    # Note: AttackPath properties schema can vary. 'riskLevel' and 'creationTime' are best guesses based on common schema.
+    query_attack_paths = f"""
+    securityresources
+    | where type == "microsoft.security/attackpaths"
+    | project
+        id,
+        Type="AttackPath",
+        Name=properties.displayName,
+        Severity=properties.riskLevel,
+        Status=properties.status,
+        ChangeDate=todatetime(properties.creationTime),
+        Resource=id
+    | where ChangeDate > ago({days}d) or isnull(ChangeDate)
+    | order by ChangeDate desc
+    """
+    return query_recommendations, query_attack_paths
+
+
+# Export columns (see DefenderItem); Change is only filled in diff mode.
+FIELDNAMES = [name for name in DefenderItem.FIELDNAMES if name != "Change"]
+DIFF_FIELDNAMES = ["Change"] + FIELDNAMES
+COLUMN_TYPES = DefenderItem.column_types()
+
+
+def _by_change_date(rows):
+    # Each shard is ordered on its own: restore the newest-first order over the merged rows.
+    return sorted(rows, key=lambda row: str(row.get("ChangeDate") or ""), reverse=True)
+
+
+async def fetch_new_items(arg_client, days, subscriptions=None, management_group=None,
+                          batch_size=SUBSCRIPTION_BATCH_SIZE, max_parallel=MAX_PARALLEL_SHARDS):
+    """
+    Run the recommendations and attack path queries concurrently, each paged to
+    completion. Returns (recommendations, attack_paths, attack_path_error); attack
+    paths are optional (not enabled everywhere), so their failure doesn't fail the report.
+
+    With a management group or a subscription list, each query is split across
+    subscription batches run in parallel and the rows are merged by Resource id.
+    Without either, the query runs once over everything the identity can see.
+    """
+    query_recommendations, query_attack_paths = build_queries(days)
+
+    if management_group and not subscriptions:
+        subscriptions = await list_subscriptions(arg_client, management_group)
+        print(f"Management group {management_group}: {len(subscriptions)} subscriptions.")
+        if not subscriptions:
+            # Nothing in scope: without subscriptions the queries would run tenant-wide.
+            return [], [], None
+
+    # Rows are turned into DefenderItem records as soon as a query completes.
+    if subscriptions:
+        async def query(q):
+            rows = _by_change_date(await run_sharded_query(arg_client, q, subscriptions, batch_size, max_parallel))
+            return [DefenderItem.from_row(row) for row in rows]
+    else:
+        async def query(q):
+            return [DefenderItem.from_row(row) for row in await run_query(arg_client, q)]
+
+    recos, paths = await asyncio.gather(
+        query(query_recommendations),
+        query(query_attack_paths),
+        return_exceptions=True,
+    )
+    if isinstance(recos, Exception):
+        raise recos
+    if isinstance(paths, Exception):
+        return recos, [], paths
+    return recos, paths, None
+
+
+def print_items(results):
+    print(f"{'Type':<20} | {'Severity':<10} | {'Change Date':<25} | {'Name'}")
+    print("-" * 100)
+    for item in results:
+        # Handle potentially missing values safely
+        itype = item.item_type or 'Unknown'
+        isev = item.severity or 'Unknown'
+        idate = item.change_date or 'N/A'
+        iname = item.name or 'Unknown'
+
+        print(f"{itype:<20} | {isev:<10} | {str(idate):<25} | {iname}")
+
+
+def print_diff(diff):
+    if diff.baseline:
+        print(f"\nNo previous snapshot: recorded a baseline of {len(diff.added)} items.")
+    else:
+        print(f"\nChanges since {diff.previous_run.isoformat()}: "
+              f"{len(diff.added)} added, {len(diff.changed)} changed, {len(diff.resolved)} resolved.")
+    for title, rows in (("Added", diff.added), ("Changed", diff.changed), ("Resolved", diff.resolved)):
+        if rows and not (diff.baseline and title == "Added"):
+            print(f"\n{title}:\n")
+            print_items(rows)
+
 
 async def main():
     parser = argparse.ArgumentParser(description="Report new Defender for Cloud recommendations and Attack Paths.")
     parser.add_argument("--days", type=int, default=7, help="Look back period in days (default: 7)")
-    parser.add_argument("--output", help="Path to export results as CSV (e.g., defender_report.csv)")
+    parser.add_argument("--output", help="Export results to a file: .csv, .jsonl or .parquet (add .gz to compress csv/jsonl)")
+    scope = parser.add_mutually_exclusive_group()
+    scope.add_argument("--management-group", help="Only report on subscriptions under this management group")
+    scope.add_argument("--subscriptions", nargs="+", metavar="ID", help="Only report on these subscription ids")
+    parser.add_argument("--batch-size", type=int, default=SUBSCRIPTION_BATCH_SIZE, help=f"Subscriptions per query shard (default: {SUBSCRIPTION_BATCH_SIZE})")
+    parser.add_argument("--max-parallel", type=int, default=MAX_PARALLEL_SHARDS, help=f"Query shards run at the same time (default: {MAX_PARALLEL_SHARDS})")
+    parser.add_argument("--diff-db", metavar="PATH", help="SQLite snapshot file: report items added/changed/resolved since the previous run instead of using --days")
+    parser.add_argument("--save-snapshot", metavar="DIR", help="Also save the reported items as a columnar table in DIR (e.g. next to a tenant snapshot)")
     args = parser.parse_args()
 
-    print(f"Starting Defender for Cloud audit for items new in the last {args.days} days...")
+    if args.diff_db:
+        print(f"Starting Defender for Cloud audit: changes since the snapshot in {args.diff_db}...")
+    else:
+        print(f"Starting Defender for Cloud audit for items new in the last {args.days} days...")
 
     # Load config (optional tenant/subscription context)
     tenant_id = None
@@ -29,117 +165,72 @@ async def main():
         except Exception:
             pass
 
-    print("Using default credential from environment/CLI context.")
-    credential = DefaultAzureCredential()
+    if tenant_id:
+        print(f"Using tenant {tenant_id} from {config_path}.")
+    else:
+        print("Using default credential from environment/CLI context.")
+    credential = default_credential(DefaultAzureCredential, tenant_id)
 
     try:
-        # Initialize Resource Graph Client
-        # Note: ResourceGraphClient is synchronous in current azure-mgmt-resourcegraph versions usually, 
-        # but we can wrap it or use it directly.
-        arg_client = ResourceGraphClient(credential)
-
-        # Calculate time threshold
-        # KQL uses ago(), but we can insert the specific date string or just use ago(Xd)
-        # Using string interpolation for safety and control.
-        days = args.days
-        
-        # Query 1: Recommendations (Assessments) that changed status recently
-        # We look for assessments that are currently 'Unhealthy' and whose status changed recently?
-        # Or just any status change? Usually we care about new 'Unhealthy'.
-        
-        query_recommendations = f"""
-        securityresources
-        | where type == "microsoft.security/assessments"
-        | where properties.status.code == "Unhealthy"
-        | where properties.status.statusChangeDate > ago({days}d)
-        | project 
-            Type="Recommendation", 
-            Name=properties.displayName, 
-            Severity=properties.metadata.severity, 
-            Status=properties.status.code, 
-            ChangeDate=todatetime(properties.status.statusChangeDate), 
-            Resource=id
-        | order by ChangeDate desc
-        """
-        
-        # Query 2: Attack Paths (Preview/New Feature data structure)
-        # Attack paths might not have a clean 'creationDate' in all API versions exposed via ARG yet.
-        # But let's try to find them or Alerts as a proxy for "Threats".
-        # Let's query 'microsoft.security/attackpaths' if available.
-        # If no timestamp, we just list them as "Active Attack Path".
-        
-        query_attack_paths = f"""
-        securityresources
-        | where type == "microsoft.security/attackpaths"
-        | project 
-            Type="AttackPath", 
-            Name=properties.displayName, 
-            Severity=properties.riskLevel, 
-            Status=properties.status, 
-            ChangeDate=todatetime(properties.creationTime), 
-            Resource=id
-        | where ChangeDate > ago({days}d) or isnull(ChangeDate)
-        | order by ChangeDate desc
-        """
-        # Note: AttackPath properties schema can vary. 'riskLevel' and 'creationTime' are best guesses based on common schema.
-        # If creationTime is null, it might be old, but let's include for visibility if desired. 
-        # Actually logic says "new ... like last week", so maybe filter strict?
-        # Let's try strict filter first.
-        
-        print("Querying Azure Resource Graph for Recommendations...")
-        
-        # combine queries or run separate? Separate is safer for schema differences.
-        
+        # Async Resource Graph client: the queries page through $skipToken (1000 rows per page)
+        # and run concurrently without blocking the event loop.
+        async with credential, ResourceGraphClient(credential) as arg_client:
+            if args.diff_db:
+                subscriptions = args.subscriptions
+                if args.management_group:
+                    subscriptions = await list_subscriptions(arg_client, args.management_group)
+                    print(f"Management group {args.management_group}: {len(subscriptions)} subscriptions.")
+                    if not subscriptions:
+                        # Don't diff a tenant-wide result (or an empty one) against the stored snapshot.
+                        print("Nothing to report: the management group has no subscriptions.")
+                        return
+                print("Querying Azure Resource Graph for current Recommendation / Attack Path fingerprints...")
+                diff = await diff_defender_items(
+                    arg_client, args.diff_db,
+                    subscriptions=subscriptions,
+                    batch_size=args.batch_size,
+                    max_parallel=args.max_parallel,
+                )
+                print_diff(diff)
+                if args.output:
+                    export_rows(diff.rows(), args.output, DIFF_FIELDNAMES, COLUMN_TYPES)
+                if args.save_snapshot:
+                    write_defender_items(args.save_snapshot, diff.rows())
+                    print(f"Saved {len(diff.rows())} items to {args.save_snapshot}.")
+                return
+
+            print("Querying Azure Resource Graph for Recommendations and Attack Paths...")
+            recos, paths, paths_error = await fetch_new_items(
+                arg_client, args.days,
+                subscriptions=args.subscriptions,
+                management_group=args.management_group,
+                batch_size=args.batch_size,
+                max_parallel=args.max_parallel,
+            )
+
         results = []
-        
-        # Run Reco Query
-        request_reco = QueryRequest(query=query_recommendations)
-        response_reco = arg_client.resources(request_reco)
-        
-        if response_reco.data:
-            results.extend(response_reco.data)
-            print(f"Found {len(response_reco.data)} new/changed recommendations.")
-
-        print("Querying Azure Resource Graph for Attack Paths...")
-        try:
-            request_paths = QueryRequest(query=query_attack_paths)
-            response_paths = arg_client.resources(request_paths)
-            if response_paths.data:
-                results.extend(response_paths.data)
-                print(f"Found {len(response_paths.data)} new attack paths.")
-        except Exception as e:
-            print(f"Warning: Failed to query Attack Paths (might not be enabled or supported in this tenant): {e}")
+        results.extend(recos)
+        print(f"Found {len(recos)} new/changed recommendations.")
+
+        if paths_error:
+            print(f"Warning: Failed to query Attack Paths (might not be enabled or supported in this tenant): {paths_error}")
+        else:
+            results.extend(paths)
+            print(f"Found {len(paths)} new attack paths.")
 
         # Report
         if not results:
             print(f"No new Defender items found in the last {args.days} days.")
         else:
             print(f"\nFound {len(results)} items:\n")
-            print(f"{'Type':<20} | {'Severity':<10} | {'Change Date':<25} | {'Name'}")
-            print("-" * 100)
-            for item in results:
-                # Handle potentially missing keys safely
-                itype = item.get('Type', 'Unknown')
-                isev = item.get('Severity', 'Unknown')
-                idate = item.get('ChangeDate', 'N/A')
-                iname = item.get('Name', 'Unknown')
-                
-                print(f"{itype:<20} | {isev:<10} | {str(idate):<25} | {iname}")
+            print_items(results)
 
         # Export
         if args.output:
-            print(f"\nExporting to {args.output}...")
-            try:
-                with open(args.output, mode='w', newline='', encoding='utf-8') as f:
-                    # Determine all potential keys from results for header
-                    if results:
-                        keys = list(results[0].keys())
-                        writer = csv.DictWriter(f, fieldnames=keys)
-                        writer.writeheader()
-                        writer.writerows(results)
-                print("Export complete.")
-            except Exception as e:
-                print(f"Failed to export CSV: {e}")
+            export_rows(results, args.output, FIELDNAMES, COLUMN_TYPES)
+        if args.save_snapshot:
+            write_defender_items(args.save_snapshot, results)
+            print(f"Saved {len(results)} items to {args.save_snapshot}.")
 
     except Exception as e:
         print(f"An error occurred: {e}")
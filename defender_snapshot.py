@@ -0,0 +1,179 @@
+import asyncio
+import hashlib
+import os
+import sqlite3
+from datetime import datetime, timezone
+from audit_records import DefenderItem
+from resource_graph import (
+    MAX_PARALLEL_SHARDS, SUBSCRIPTION_BATCH_SIZE, run_query, run_sharded_query,
+)
+
+# Instead of guessing "new" from statusChangeDate (attack paths often have no usable
+# timestamp), each run stores what it saw: id -> hash(status, severity). The next run
+# lists the current ids/hashes only and diffs against the stored ones, so full details
+# are fetched for added and changed items only.
+
+ASSESSMENT_TYPE = "microsoft.security/assessments"
+ATTACK_PATH_TYPE = "microsoft.security/attackpaths"
+
+# Ids are full resource ids (~200 chars): keep each detail query well under ARG's query size limit.
+DETAIL_IDS_PER_QUERY = 200
+
+# Unhealthy assessments and all attack paths: an item that drops out of this set is resolved.
+# Only the short fields that make up the fingerprint are projected, plus id: without it
+# ARG returns no $skipToken, and everything past the first 1000 rows would look resolved.
+FINGERPRINT_QUERY = f"""
+securityresources
+| where type in~ ("{ASSESSMENT_TYPE}", "{ATTACK_PATH_TYPE}")
+| where type =~ "{ATTACK_PATH_TYPE}" or properties.status.code == "Unhealthy"
+| project
+    id,
+    Resource=id,
+    Type=iff(type =~ "{ATTACK_PATH_TYPE}", "AttackPath", "Recommendation"),
+    Status=iff(type =~ "{ATTACK_PATH_TYPE}", tostring(properties.status), tostring(properties.status.code)),
+    Severity=iff(type =~ "{ATTACK_PATH_TYPE}", tostring(properties.riskLevel), tostring(properties.metadata.severity))
+"""
+
+
+def build_detail_query(ids):
+    """Full details (same columns as the time-window report) for a list of resource ids."""
+    id_list = ", ".join(f"'{resource_id}'" for resource_id in ids)
+    return f"""
+    securityresources
+    | where id in~ ({id_list})
+    | extend IsAttackPath = type =~ "{ATTACK_PATH_TYPE}"
+    | project
+        id,
+        Type=iff(IsAttackPath, "AttackPath", "Recommendation"),
+        Name=tostring(properties.displayName),
+        Severity=iff(IsAttackPath, tostring(properties.riskLevel), tostring(properties.metadata.severity)),
+        Status=iff(IsAttackPath, tostring(properties.status), tostring(properties.status.code)),
+        ChangeDate=iff(IsAttackPath, todatetime(properties.creationTime), todatetime(properties.status.statusChangeDate)),
+        Resource=id
+    """
+
+
+def fingerprint(row):
+    # ARG's KQL subset has no reliable hash function, so the (short) fields are hashed here.
+    value = f"{row.get('Status') or ''}|{row.get('Severity') or ''}"
+    return hashlib.sha1(value.encode("utf-8")).hexdigest()[:16]
+
+
+class DefenderSnapshotStore:
+    """
+    SQLite file holding the Defender items seen by the last run:
+    resource id (lower-cased), type, fingerprint, name and when it was first seen.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS items (
+                id TEXT PRIMARY KEY,
+                type TEXT NOT NULL,
+                hash TEXT NOT NULL,
+                name TEXT,
+                first_seen TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+        """)
+
+    def close(self):
+        self.conn.close()
+
+    def last_run(self):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'last_run'").fetchone()
+        return datetime.fromisoformat(row[0]) if row else None
+
+    def items(self):
+        """{id: (type, hash, name, first_seen)} of the previous run."""
+        return {row[0]: row[1:] for row in self.conn.execute("SELECT id, type, hash, name, first_seen FROM items")}
+
+    def replace(self, current, names, run_at):
+        """
+        Store the current run. current: {id: (type, hash)}; names: {id: name} for the
+        items whose details were fetched this run (others keep their stored name).
+        """
+        previous = self.items()
+        rows = []
+        for item_id, (item_type, item_hash) in current.items():
+            _, _, old_name, first_seen = previous.get(item_id, (None, None, None, run_at.isoformat()))
+            rows.append((item_id, item_type, item_hash, names.get(item_id, old_name), first_seen))
+        with self.conn:
+            self.conn.execute("DELETE FROM items")
+            self.conn.executemany("INSERT INTO items VALUES (?, ?, ?, ?, ?)", rows)
+            self.conn.execute("INSERT OR REPLACE INTO meta VALUES ('last_run', ?)", (run_at.isoformat(),))
+
+
+class DefenderDiff:
+    """Result of one diff run: lists of DefenderItem records, with their change set."""
+
+    def __init__(self, previous_run):
+        self.previous_run = previous_run
+        self.added = []
+        self.changed = []
+        self.resolved = []
+
+    @property
+    def baseline(self):
+        # No earlier snapshot: everything shows up as added.
+        return self.previous_run is None
+
+    def rows(self):
+        return self.added + self.changed + self.resolved
+
+
+async def _fetch_details(arg_client, ids):
+    chunks = [ids[i:i + DETAIL_IDS_PER_QUERY] for i in range(0, len(ids), DETAIL_IDS_PER_QUERY)]
+    results = await asyncio.gather(*[run_query(arg_client, build_detail_query(chunk)) for chunk in chunks])
+    return {row["Resource"].lower(): row for rows in results for row in rows}
+
+
+async def diff_defender_items(arg_client, db_path, subscriptions=None,
+                              batch_size=SUBSCRIPTION_BATCH_SIZE, max_parallel=MAX_PARALLEL_SHARDS):
+    """
+    List the current Defender item fingerprints, diff them against the snapshot in
+    db_path, fetch details for added/changed items, and store the new snapshot.
+    Returns a DefenderDiff.
+    """
+    if subscriptions:
+        rows = await run_sharded_query(arg_client, FINGERPRINT_QUERY, subscriptions, batch_size, max_parallel)
+    else:
+        rows = await run_query(arg_client, FINGERPRINT_QUERY)
+    current = {row["Resource"].lower(): (row["Type"], fingerprint(row)) for row in rows}
+
+    store = DefenderSnapshotStore(db_path)
+    try:
+        previous = store.items()
+        diff = DefenderDiff(store.last_run())
+
+        added = [item_id for item_id in current if item_id not in previous]
+        changed = [item_id for item_id in current if item_id in previous and previous[item_id][1] != current[item_id][1]]
+        details = await _fetch_details(arg_client, added + changed)
+
+        def detail_item(item_id, change):
+            row = details.get(item_id)
+            if row is None:
+                # Gone between the fingerprint and the detail query: report what we know.
+                name = previous[item_id][2] if item_id in previous else None
+                return DefenderItem(current[item_id][0], name or "Unknown", None, None, None, item_id, change)
+            item = DefenderItem.from_row(row)
+            item.change = change
+            return item
+
+        diff.added = [detail_item(item_id, "Added") for item_id in added]
+        diff.changed = [detail_item(item_id, "Changed") for item_id in changed]
+        diff.resolved = [
+            DefenderItem(item_type, name or "Unknown", None, "Resolved", None, item_id, "Resolved")
+            for item_id, (item_type, _, name, _) in previous.items() if item_id not in current
+        ]
+
+        names = {item_id: row.get("Name") for item_id, row in details.items()}
+        store.replace(current, names, datetime.now(timezone.utc))
+    finally:
+        store.close()
+    return diff
@@ -0,0 +1,289 @@
+import asyncio
+import json
+import os
+from datetime import datetime, timezone
+from graph_paging import PAGE_SIZE, iter_applications, iter_delta_pages, iter_objects, iter_raw_pages, iter_service_principals
+from owner_resolution import OwnerResolver
+from audit_records import OrphanedApp
+from tenant_snapshot import (
+    APPLICATION_EXPAND, APPLICATION_SELECT, SERVICE_PRINCIPAL_SELECT,
+    TenantSnapshot, parse_graph_datetime, project_application, project_service_principal, _project_owner,
+)
+
+# Delta can't $expand owners or return signInActivity, so:
+# - the first round is a normal full crawl plus a '$deltatoken=latest' call to get a starting deltaLink;
+# - later rounds re-read owners of changed apps, and the sign-in activity of every service
+#   principal (one paged read of id + signInActivity: a sign-in isn't a change for delta).
+# The deltaLink keeps the $select of the call that started it: selecting 'owners' there makes
+# owner additions/removals show up as a change on the app.
+APPLICATION_DELTA_SELECT = ["id", "appId", "displayName", "passwordCredentials", "keyCredentials", "owners"]
+SERVICE_PRINCIPAL_DELTA_SELECT = ["id", "appId", "displayName"]
+SIGN_IN_SELECT = "id,signInActivity"
+
+# How many per-object follow-up reads (owners of changed apps) run at once.
+FOLLOW_UP_CONCURRENCY = 8
+
+# Record type of each cached rule, to rebuild findings.json rows into records on load.
+FINDING_TYPES = {"orphaned": OrphanedApp}
+
+
+class DeltaStore:
+    """
+    On-disk state for incremental audits: the projected tenant snapshot, the
+    deltaLinks of the last round, and cached results of rules that only depend on
+    the object itself (so they are re-evaluated only when the object changes).
+    """
+
+    STATE_FILE = "delta_state.json"
+    FINDINGS_FILE = "findings.json"
+
+    def __init__(self, path):
+        self.path = path
+        self.snapshot = TenantSnapshot()
+        self.delta_links = {}
+        self.findings = {}
+
+    @classmethod
+    def load(cls, path):
+        store = cls(path)
+        state_path = os.path.join(path, cls.STATE_FILE)
+        if not os.path.exists(state_path):
+            return store
+        with open(state_path, "r", encoding="utf-8") as f:
+            store.delta_links = json.load(f)
+        store.snapshot = TenantSnapshot.load(path)
+        findings_path = os.path.join(path, cls.FINDINGS_FILE)
+        if os.path.exists(findings_path):
+            with open(findings_path, "r", encoding="utf-8") as f:
+                for rule_name, cached in json.load(f).items():
+                    record_type = FINDING_TYPES.get(rule_name)
+                    store.findings[rule_name] = {
+                        object_id: record_type.from_row(row) if row and record_type else row
+                        for object_id, row in cached.items()
+                    }
+        return store
+
+    def save(self):
+        self.snapshot.save(self.path)
+        with open(os.path.join(self.path, self.STATE_FILE), "w", encoding="utf-8") as f:
+            json.dump(self.delta_links, f, indent=2)
+        with open(os.path.join(self.path, self.FINDINGS_FILE), "w", encoding="utf-8") as f:
+            json.dump({
+                rule_name: {object_id: item.as_row() if item else None for object_id, item in cached.items()}
+                for rule_name, cached in self.findings.items()
+            }, f, default=str)
+
+    def cached_findings(self, rule_name, records, rule):
+        """
+        Evaluate a rule that only depends on the object itself (e.g. orphan status)
+        over `records`, reusing the stored result of every object that hasn't changed
+        since it was last evaluated. Returns the list of findings.
+        """
+        previous = self.findings.get(rule_name, {})
+        current = {}
+        for object_id, record in records.items():
+            current[object_id] = previous[object_id] if object_id in previous else rule(record)
+        self.findings[rule_name] = current
+        return [item for item in current.values() if item]
+
+    def invalidate(self, object_ids):
+        """Drop cached rule results for objects that changed."""
+        for cached in self.findings.values():
+            for object_id in object_ids:
+                cached.pop(object_id, None)
+
+    def reset(self, collection):
+        """Forget a collection so the next sync does a full crawl again."""
+        self.delta_links.pop(collection, None)
+        if collection == "applications":
+            self.snapshot.applications.clear()
+        else:
+            self.snapshot.service_principals.clear()
+
+
+class DeltaChanges:
+    """Object ids touched by one incremental round."""
+
+    def __init__(self):
+        self.applications = set()
+        self.removed_applications = set()
+        self.service_principals = set()
+        self.removed_service_principals = set()
+        self.full_sync = set()  # collections that had no (valid) deltaLink and were read in full
+
+
+def _is_removed(obj):
+    return "@removed" in (getattr(obj, "additional_data", None) or {})
+
+
+def _merge(record, old, obj, fields):
+    # Delta pages may only carry the properties that changed: keep the stored
+    # value of anything Graph didn't send back.
+    for key, attr in fields:
+        if getattr(obj, attr, None) is None and key in old:
+            record[key] = old[key]
+    return record
+
+
+async def _latest_delta_link(delta_builder, base_url, resource, select):
+    # '$deltatoken=latest' returns no objects, just a deltaLink starting from now.
+    url = f"{base_url}/{resource}/delta?$select={','.join(select)}&$deltatoken=latest"
+    async for _, delta_link in iter_delta_pages(delta_builder.with_url(url)):
+        if delta_link:
+            return delta_link
+    return None
+
+
+async def _fetch_owners(graph_client, app_id, semaphore):
+    async with semaphore:
+        # Only the ids matter here: owner state is resolved afterwards with OwnerResolver.
+        builder = graph_client.applications.by_application_id(app_id).owners
+        return [_project_owner(owner) async for owner in iter_objects(builder)]
+
+
+async def _refresh_sign_ins(graph_client, sps, changes):
+    # Raw JSON pages: two fields per principal don't need the SDK models built for them.
+    url = f"{graph_client.request_adapter.base_url}/servicePrincipals?$select={SIGN_IN_SELECT}&$top={PAGE_SIZE}"
+    async for page in iter_raw_pages(graph_client, url):
+        for obj in page.get("value", []):
+            record = sps.get(obj["id"])
+            if record is None:
+                continue  # created after the delta round: picked up by the next one
+            last_sign_in = parse_graph_datetime((obj.get("signInActivity") or {}).get("lastSignInDateTime"))
+            if record["last_sign_in"] != last_sign_in:
+                record["last_sign_in"] = last_sign_in
+                changes.service_principals.add(obj["id"])
+
+
+async def _sync_applications(graph_client, store, changes):
+    apps = store.snapshot.applications
+    delta_link = store.delta_links.get("applications")
+
+    if not delta_link:
+        # Take the token before crawling so nothing changed during the crawl is missed next round.
+        changes.full_sync.add("applications")
+        base_url = graph_client.request_adapter.base_url
+        store.delta_links["applications"] = await _latest_delta_link(graph_client.applications.delta, base_url, "applications",
+                                                                     APPLICATION_DELTA_SELECT)
+        apps.clear()
+        async for app in iter_applications(graph_client, APPLICATION_SELECT, expand=APPLICATION_EXPAND):
+            record = project_application(app)
+            apps[record["id"]] = record
+            changes.applications.add(record["id"])
+        return
+
+    async for page, new_delta_link in iter_delta_pages(graph_client.applications.delta.with_url(delta_link)):
+        for app in page:
+            if _is_removed(app):
+                apps.pop(app.id, None)
+                changes.removed_applications.add(app.id)
+                continue
+            record = project_application(app)
+            old = apps.get(app.id)
+            if old:
+                _merge(record, old, app, [
+                    ("app_id", "app_id"), ("display_name", "display_name"),
+                    ("password_credentials", "password_credentials"), ("key_credentials", "key_credentials"),
+                ])
+            apps[app.id] = record
+            changes.applications.add(app.id)
+        if new_delta_link:
+            store.delta_links["applications"] = new_delta_link
+
+    # Owners aren't expandable on delta: re-read them for the changed apps only.
+    semaphore = asyncio.Semaphore(FOLLOW_UP_CONCURRENCY)
+    changed = list(changes.applications)
+    owners = await asyncio.gather(*[_fetch_owners(graph_client, app_id, semaphore) for app_id in changed])
+    for app_id, app_owners in zip(changed, owners):
+        apps[app_id]["owners"] = app_owners
+
+
+async def _sync_service_principals(graph_client, store, changes):
+    sps = store.snapshot.service_principals
+    delta_link = store.delta_links.get("service_principals")
+
+    if not delta_link:
+        changes.full_sync.add("service_principals")
+        base_url = graph_client.request_adapter.base_url
+        store.delta_links["service_principals"] = await _latest_delta_link(graph_client.service_principals.delta, base_url,
+                                                                           "servicePrincipals", SERVICE_PRINCIPAL_DELTA_SELECT)
+        sps.clear()
+        async for sp in iter_service_principals(graph_client, SERVICE_PRINCIPAL_SELECT):
+            record = project_service_principal(sp)
+            sps[record["id"]] = record
+            changes.service_principals.add(record["id"])
+        return
+
+    async for page, new_delta_link in iter_delta_pages(graph_client.service_principals.delta.with_url(delta_link)):
+        for sp in page:
+            if _is_removed(sp):
+                sps.pop(sp.id, None)
+                changes.removed_service_principals.add(sp.id)
+                continue
+            record = project_service_principal(sp)
+            old = sps.get(sp.id)
+            if old:
+                _merge(record, old, sp, [("app_id", "app_id"), ("display_name", "display_name")])
+                record["last_sign_in"] = old["last_sign_in"]
+            sps[sp.id] = record
+            changes.service_principals.add(sp.id)
+        if new_delta_link:
+            store.delta_links["service_principals"] = new_delta_link
+
+    # Sign-ins don't register as a change for delta: re-read every principal's sign-in
+    # date, so one that signed in since the last round stops being reported as unused
+    # (and new ones aren't reported as 'Never' signed in).
+    await _refresh_sign_ins(graph_client, sps, changes)
+
+
+async def _sync_with_resync(sync, graph_client, store, collection, changes):
+    try:
+        await sync(graph_client, store, changes)
+    except Exception as e:
+        # An expired/invalid deltaLink comes back as 410 Gone (or a 'resync' error):
+        # start over with a full round rather than failing the run.
+        if not store.delta_links.get(collection) or ("410" not in str(e) and "resync" not in str(e).lower()):
+            raise
+        print(f"Delta token for {collection} is no longer valid, doing a full sync...")
+        store.reset(collection)
+        await sync(graph_client, store, changes)
+
+
+async def sync_tenant(graph_client, path, collections=("applications", "service_principals"), full=False, object_cache=None,
+                      store=None):
+    """
+    Bring the DeltaStore in `path` up to date with Graph.
+
+    The first call (or full=True) crawls every object; later calls only fetch what
+    changed since the stored deltaLink. Returns (store, DeltaChanges); call
+    store.save() once the results have been evaluated. Owner state comes from
+    object_cache when it is fresh there (full=True looks every owner up again).
+    A store already in memory (audit_daemon keeps one) is synced in place instead of
+    loading it from `path`.
+    """
+    if store is None:
+        store = DeltaStore.load(path)
+    changes = DeltaChanges()
+    if full:
+        for collection in collections:
+            store.reset(collection)
+    syncs = {
+        "applications": _sync_applications,
+        "service_principals": _sync_service_principals,
+    }
+    await asyncio.gather(*[
+        _sync_with_resync(syncs[collection], graph_client, store, collection, changes)
+        for collection in collections
+    ])
+    if "applications" in collections:
+        # An owner being disabled or deleted doesn't change the app itself, so owner
+        # state is re-resolved for every app ($batch, ~20k owners per round-trip) and
+        # apps whose owners changed state are re-evaluated like changed apps. With an
+        # object cache, only owners whose cached state has expired are looked up.
+        resolver = OwnerResolver(graph_client, object_cache, refresh=full)
+        owners_changed = await resolver.resolve_applications(list(store.snapshot.applications.values()))
+        store.invalidate([app["id"] for app in owners_changed])
+    store.invalidate(changes.applications | changes.removed_applications
+                     | changes.service_principals | changes.removed_service_principals)
+    store.snapshot.taken_at = datetime.now(timezone.utc)
+    return store, changes
@@ -1,19 +1,170 @@
 import asyncio
 import argparse
 import json
-import csv
 import os
 from datetime import datetime, timezone, timedelta
 from azure.identity import DefaultAzureCredential
 from msgraph import GraphServiceClient
-from msgraph.generated.models.application import Application
+from graph_paging import iter_applications
+from tenant_snapshot import project_application
+from delta_sync import sync_tenant
+from object_cache import DEFAULT_CACHE_PATH, DEFAULT_TTL_HOURS, open_cache
+from expiry_index import ExpiryIndex, entry_to_item
+from rotation_risk import CredentialTable, RotationAnalysis
+from export_sinks import export_rows, output_sink
+from audit_records import ExpiringCredential, RotationRisk
+import daemon_client
+from daemon_client import DEFAULT_DAEMON_URL
+from tenant_auth import default_credential
+from request_scheduler import attach_graph_client
+
+FIELDNAMES = ExpiringCredential.FIELDNAMES
+COLUMN_TYPES = ExpiringCredential.column_types()
+
+
+def find_expiring_credentials(app, today, threshold_date):
+    """
+    Return the secrets and certificates of a projected application (see tenant_snapshot)
+    that expire on or before threshold_date.
+    """
+    found = []
+    # Check Secrets (PasswordCredentials) and Certificates (KeyCredentials)
+    for cred_type, creds in (("Secret", app["password_credentials"]), ("Certificate", app["key_credentials"])):
+        for cred in creds:
+            end_date = cred["end_date_time"]
+            if end_date and end_date <= threshold_date:
+                found.append(ExpiringCredential(
+                    app=app["display_name"],
+                    app_id=app["app_id"],
+                    cred_type=cred_type,
+                    key_id=cred["key_id"], # useful to identify which secret
+                    expires=end_date,
+                    days_left=(end_date - today).days,
+                ))
+    return found
+
+
+def print_header():
+    print(f"\n{'App Name':<30} | {'Type':<12} | {'Days Left':<10} | {'Expires':<30} | {'App ID'}")
+    print("-" * 110)
+
+
+def print_item(item):
+    print(f"{item.app[:28]:<30} | {item.cred_type:<12} | {item.days_left:<10} | {str(item.expires):<30} | {item.app_id}")
+
+
+def print_rotation_header():
+    print(f"\n{'App Name':<30} | {'Risk':<8} | {'Status':<8} | {'Days Left':<10} | {'Covered Until':<26} | {'Valid/Total':<11} | {'App ID'}")
+    print("-" * 140)
+
+
+def print_rotation_item(item):
+    print(f"{item.app[:28]:<30} | {item.risk:<8} | {item.status:<8} | {item.days_left:<10} | {str(item.covered_until):<26} | "
+          f"{f'{item.valid_now}/{item.credentials}':<11} | {item.app_id}")
+
+
+def print_rotation(analysis, days):
+    print(f"\n{analysis.expiring_credentials} credentials expire (or expired) within {days} days; "
+          f"{analysis.covered_credentials} of them are covered by a newer credential of the same app.")
+    print(f"{analysis.overlapping_apps} apps have more than one valid credential, {analysis.duplicate_apps} have duplicates.")
+    if analysis.risks:
+        print_rotation_header()
+        for item in analysis.risks:
+            print_rotation_item(item)
+
+
+def export_columns(args):
+    """Export column names and types: one row per app at risk with --rotation."""
+    if args.rotation:
+        return RotationRisk.FIELDNAMES, RotationRisk.column_types()
+    return FIELDNAMES, COLUMN_TYPES
+
+
+def query_index(args):
+    """Answer from a saved expiry index (no Graph calls)."""
+    index = ExpiryIndex.load(args.from_index)
+    today = datetime.now(timezone.utc)
+    print(f"Expiry index of {len(index)} credentials, taken at {index.taken_at}.")
+
+    if args.histogram:
+        print(f"\n{'Expires In':<15} | {'Count'}")
+        print("-" * 25)
+        for label, count in index.histogram(today):
+            print(f"{label:<15} | {count}")
+
+    if args.next:
+        items = [entry_to_item(entry, today) for entry in index.next_expirations(today, args.next)]
+        print(f"\nNext {len(items)} expirations:")
+    else:
+        items = [entry_to_item(entry, today) for entry in index.expiring(today + timedelta(days=args.days))]
+        print(f"\n{len(items)} items expiring within {args.days} days (including already expired).")
+    if items:
+        print_header()
+        for item in items:
+            print_item(item)
+
+    if args.output:
+        export_rows(items, args.output, FIELDNAMES, COLUMN_TYPES)
+
+
+def query_daemon(args):
+    """Answer from a running audit_daemon.py (no Graph calls here)."""
+    if args.rotation:
+        answer = daemon_client.query(args.daemon, "rotation", days=args.days)
+        analysis = RotationAnalysis()
+        analysis.risks = daemon_client.records(answer, RotationRisk, dates=("covered_until",))
+        for name in ("expiring_credentials", "covered_credentials", "overlapping_apps", "duplicate_apps"):
+            setattr(analysis, name, answer[name])
+        items = analysis.risks
+    else:
+        answer = daemon_client.query(args.daemon, "secrets", days=args.days)
+        items = daemon_client.records(answer, ExpiringCredential, dates=("expires",))
+    print(f"Answered by the audit daemon from tenant state taken at {daemon_client.taken_at(answer)}.")
+
+    if args.rotation:
+        print_rotation(analysis, args.days)
+        print(f"\nFound {len(items)} apps at risk of an outage." if items
+              else f"\nNo app runs out of valid credentials within {args.days} days.")
+    else:
+        if items:
+            print_header()
+            for item in items:
+                print_item(item)
+        print(f"\n{len(items)} items expiring within {args.days} days (including already expired).")
+
+    if args.output:
+        export_rows(items, args.output, *export_columns(args))
+
 
 async def main():
     parser = argparse.ArgumentParser(description="Audit Entra ID App Registrations for expiring secrets and certificates.")
     parser.add_argument("--days", type=int, default=30, help="Number of days to look ahead for expiration (default: 30)")
-    parser.add_argument("--output", help="Path to export results as CSV (e.g., results.csv)")
+    parser.add_argument("--output", help="Export results to a file, written as they are found: .csv, .jsonl or .parquet (add .gz to compress csv/jsonl)")
+    parser.add_argument("--incremental", metavar="DIR", help="Keep application state in DIR and only fetch changes (Graph delta) on later runs")
+    parser.add_argument("--full-sync", action="store_true", help="With --incremental: ignore the stored delta token and crawl everything again")
+    parser.add_argument("--cache", metavar="FILE", default=DEFAULT_CACHE_PATH, help=f"With --incremental: local cache of owner lookups, shared by the audit scripts (default: {DEFAULT_CACHE_PATH})")
+    parser.add_argument("--cache-ttl", type=float, default=DEFAULT_TTL_HOURS, metavar="HOURS", help=f"Look owners up again once their cached state is older than this; 0 disables the cache (default: {DEFAULT_TTL_HOURS})")
+    parser.add_argument("--rotation", action="store_true", help="Report apps left without any valid credential within --days (newer secrets/certificates cover expiring ones), ranked by urgency, instead of every expiring credential")
+    parser.add_argument("--from-index", metavar="DIR", help="Answer from the expiry index saved with a snapshot / incremental state in DIR, without calling Graph")
+    parser.add_argument("--histogram", action="store_true", help="With --from-index: also print how many credentials expire per bucket of days")
+    parser.add_argument("--next", type=int, metavar="N", help="With --from-index: list the next N credentials to expire instead of using --days")
+    parser.add_argument("--daemon", metavar="URL", nargs="?", const=DEFAULT_DAEMON_URL, help=f"Ask a running audit_daemon.py instead of calling Graph (default URL: {DEFAULT_DAEMON_URL})")
     args = parser.parse_args()
 
+    if args.from_index and args.rotation:
+        parser.error("--rotation needs the full credential list: use it with a live crawl or --incremental, not --from-index")
+    if args.daemon and (args.from_index or args.incremental):
+        parser.error("--daemon answers from the daemon's own tenant state: don't combine it with --from-index or --incremental")
+    if args.from_index:
+        query_index(args)
+        return
+    if args.daemon:
+        try:
+            query_daemon(args)
+        except Exception as e:
+            print(f"An error occurred: {e}")
+        return
+
     print(f"Starting audit for secrets expiring within {args.days} days...")
 
     # Load config
@@ -29,113 +180,92 @@ async def main():
         except Exception as e:
             print(f"Warning: Failed to read {config_path}: {e}")
 
-    print("Using default tenant from environment/CLI context.")
-    credential = DefaultAzureCredential()
+    if tenant_id:
+        print(f"Using tenant {tenant_id} from {config_path}.")
+    else:
+        print("Using default tenant from environment/CLI context.")
+    credential = default_credential(DefaultAzureCredential, tenant_id)
 
-    # Scopes are not strictly required for client credentials flow via DefaultAzureCredential 
+    # Scopes are not strictly required for client credentials flow via DefaultAzureCredential
     # if the env vars are set, but helpful if using interactive auth to prompt correctly.
-    # However, GraphServiceClient handles this internally often. 
+    # However, GraphServiceClient handles this internally often.
     # For interactive, we might need 'Application.Read.All'.
     try:
-        graph_client = GraphServiceClient(credentials=credential, scopes=['https://graph.microsoft.com/.default'])
+        graph_client = attach_graph_client(GraphServiceClient(credentials=credential, scopes=['https://graph.microsoft.com/.default']))
     except Exception as e:
         print(f"Failed to initialize GraphServiceClient: {e}")
         return
 
     try:
-        # Get all applications
-        # Note: Pagination is handled automatically by the SDK in many cases, but let's be explicit if needed.
-        # Actually, the Python SDK's get() method returns a collection page. We need to iterate.
-        
         # We specifically select fields to optimize the query
-        query_params = {
-            "$select": ["id", "appId", "displayName", "passwordCredentials", "keyCredentials"]
-        }
-        
-        result = await graph_client.applications.get()
-        
-        apps_with_expiring_creds = []
-        
-        print("Fetching applications...")
-        # SDK pagination handling - strictly speaking we might need a robust iterator if there are many apps.
-        # The V1.0 Python SDK return object often has a .value list.
-        # If there are many apps, we would need to follow odata.nextLink. 
-        # For this MVP, let's assume we can fetch pages. 
-        # To strictly do it right, we should use a page iterator if available or loop manually.
-        
-        # Checking if result is not None
-        if result and result.value:
-            all_apps = result.value
-            
-            # Simple manual pagination handling for MVP if needed, 
-            # though the msgraph-sdk-python usually requires using a PageIterator.
-            # Let's verify we have applications.
-            
-            # To keep MVP simple and robust, we'll iterate what we have. 
-            # (In a full production tool, we'd implement the PageIterator to fetch ALL apps)
-            
-            today = datetime.now(timezone.utc)
-            threshold_date = today + timedelta(days=args.days)
-            
-            for app in all_apps:
-                app_name = app.display_name or "Unknown"
-                app_id = app.app_id
-                
-                # Check Secrets (PasswordCredentials)
-                if app.password_credentials:
-                    for secret in app.password_credentials:
-                        if secret.end_date_time:
-                            # Verify timezones compatibility
-                            end_date = secret.end_date_time
-                            if end_date <= threshold_date:
-                                days_left = (end_date - today).days
-                                apps_with_expiring_creds.append({
-                                    "App": app_name,
-                                    "AppId": app_id,
-                                    "Type": "Secret",
-                                    "KeyId": secret.key_id, # useful to identify which secret
-                                    "Expires": end_date,
-                                    "DaysLeft": days_left
-                                })
-
-                # Check Certificates (KeyCredentials)
-                if app.key_credentials:
-                    for key in app.key_credentials:
-                        if key.end_date_time:
-                            end_date = key.end_date_time
-                            if end_date <= threshold_date:
-                                days_left = (end_date - today).days
-                                apps_with_expiring_creds.append({
-                                    "App": app_name,
-                                    "AppId": app_id,
-                                    "Type": "Certificate",
-                                    "KeyId": key.key_id,
-                                    "Expires": end_date,
-                                    "DaysLeft": days_left
-                                })
-        
+        select = ["id", "appId", "displayName", "passwordCredentials", "keyCredentials"]
+
+        today = datetime.now(timezone.utc)
+        threshold_date = today + timedelta(days=args.days)
+
+        store = None
+        if args.incremental:
+            # Only changed apps are fetched; expiry is re-checked over the stored credential dates.
+            print(f"Syncing application state in {args.incremental}...")
+            object_cache = open_cache(args.cache, args.cache_ttl)
+            try:
+                store, changes = await sync_tenant(graph_client, args.incremental, collections=("applications",),
+                                                   full=args.full_sync, object_cache=object_cache)
+            finally:
+                if object_cache is not None:
+                    object_cache.close()
+            print(f"{len(changes.applications)} changed, {len(changes.removed_applications)} removed.")
+
+        async def iter_app_records():
+            if store is not None:
+                for record in store.snapshot.applications.values():
+                    yield record
+            else:
+                # Applications are streamed page by page (following @odata.nextLink), so findings
+                # are printed as soon as they are found instead of after the whole tenant is read.
+                print("Fetching applications...")
+                async for app in iter_applications(graph_client, select):
+                    yield project_application(app)
+
+        header_printed = False
+        app_count = 0
+        # With --rotation the credentials are only collected here and analysed once every app is in.
+        table = CredentialTable() if args.rotation else None
+        # Findings go straight to the --output file (if any) instead of being collected in a list.
+        with output_sink(args.output, *export_columns(args)) as sink:
+            async for app in iter_app_records():
+                app_count += 1
+                if table is not None:
+                    table.add_application(app)
+                    continue
+                found = find_expiring_credentials(app, today, threshold_date)
+
+                if found and not header_printed:
+                    print_header()
+                    header_printed = True
+                for item in found:
+                    print_item(item)
+                sink.write_many(found)
+
+            if table is not None:
+                analysis = table.analyze(today, threshold_date)
+                print_rotation(analysis, args.days)
+                sink.write_many(analysis.risks)
+
         # Report
-        if not apps_with_expiring_creds:
+        print(f"\nScanned {app_count} applications.")
+        if args.rotation:
+            print(f"Found {sink.count} apps at risk of an outage." if sink.count
+                  else f"No app runs out of valid credentials within {args.days} days.")
+        elif not sink.count:
             print(f"No secrets found expiring within {args.days} days.")
         else:
-            print(f"\nFound {len(apps_with_expiring_creds)} items expiring soon:\n")
-            print(f"{'App Name':<30} | {'Type':<12} | {'Days Left':<10} | {'Expires':<30} | {'App ID'}")
-            print("-" * 110)
-            for item in apps_with_expiring_creds:
-                print(f"{item['App'][:28]:<30} | {item['Type']:<12} | {item['DaysLeft']:<10} | {str(item['Expires']):<30} | {item['AppId']}")
-
-        # Export to CSV if requested
+            print(f"Found {sink.count} items expiring soon.")
         if args.output:
-            csv_file = args.output
-            print(f"\nExporting results to {csv_file}...")
-            try:
-                with open(csv_file, mode='w', newline='', encoding='utf-8') as file:
-                    writer = csv.DictWriter(file, fieldnames=["App", "AppId", "Type", "KeyId", "Expires", "DaysLeft"])
-                    writer.writeheader()
-                    writer.writerows(apps_with_expiring_creds)
-                print("Export complete.")
-            except Exception as e:
-                print(f"Failed to export to CSV: {e}")
+            print(f"Results written to {args.output}.")
+
+        if store is not None:
+            store.save()
 
     except Exception as e:
         print(f"An error occurred: {e}")
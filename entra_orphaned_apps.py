@@ -1,18 +1,99 @@
 import asyncio
 import argparse
 import json
-import csv
 import os
+from contextlib import nullcontext
 from azure.identity import DefaultAzureCredential
 from msgraph import GraphServiceClient
-from msgraph.generated.models.user import User
-from msgraph.generated.models.service_principal import ServicePrincipal
+from graph_paging import iter_application_pages
+from tenant_snapshot import APPLICATION_EXPAND, project_application
+from owner_resolution import OwnerResolver
+from owner_graph import OwnerGraph
+from delta_sync import sync_tenant
+from object_cache import DEFAULT_CACHE_PATH, DEFAULT_TTL_HOURS, open_cache
+from export_sinks import export_rows, output_sink
+from audit_records import OrphanedApp
+import daemon_client
+from daemon_client import DEFAULT_DAEMON_URL
+from tenant_auth import default_credential
+from request_scheduler import attach_graph_client
+
+FIELDNAMES = OrphanedApp.FIELDNAMES
+COLUMN_TYPES = OrphanedApp.column_types()
+
+
+def check_orphaned(app):
+    """
+    Return a finding if the projected application (see tenant_snapshot) has no owners
+    or only disabled owners, otherwise None.
+    """
+    owners = app["owners"]
+
+    if not owners:
+        orphan_reason = "No Owners"
+    else:
+        # Owners can be Users or ServicePrincipals (resolved by OwnerResolver; deleted
+        # owners come back disabled). account_enabled is None when Graph didn't tell us
+        # (e.g. permission issue): count those as enabled to avoid false positives.
+        has_active_owner = any(owner.account_enabled is not False for owner in owners)
+        if has_active_owner:
+            return None
+        orphan_reason = "All Owners Disabled/Deleted"
+
+    return OrphanedApp(
+        app=app["display_name"],
+        app_id=app["app_id"],
+        reason=orphan_reason,
+        owner_count=len(owners),
+        owners="; ".join(owner.display_name for owner in owners),
+    )
+
+
+def print_header():
+    print(f"\n{'App Name':<30} | {'Type':<25} | {'App ID'}")
+    print("-" * 80)
+
+
+def print_item(item):
+    print(f"{item.app[:28]:<30} | {item.reason:<25} | {item.app_id}")
+
+
+def query_daemon(args):
+    """Answer from a running audit_daemon.py (no Graph calls here)."""
+    answer = daemon_client.query(args.daemon, "orphaned", direct_only=args.direct_only)
+    items = daemon_client.records(answer, OrphanedApp)
+    print(f"Answered by the audit daemon from tenant state taken at {daemon_client.taken_at(answer)}.")
+    if items:
+        print_header()
+        for item in items:
+            print_item(item)
+        print(f"\nFound {len(items)} orphaned applications.")
+    else:
+        print("\nNo orphaned applications found.")
+    if args.output:
+        export_rows(items, args.output, FIELDNAMES, COLUMN_TYPES)
+
 
 async def main():
     parser = argparse.ArgumentParser(description="Find Orphaned Entra ID App Registrations (No owners or disabled owners).")
-    parser.add_argument("--output", help="Path to export results as CSV (e.g., orphaned.csv)")
+    parser.add_argument("--output", help="Export results to a file, written as they are found: .csv, .jsonl or .parquet (add .gz to compress csv/jsonl)")
+    parser.add_argument("--incremental", metavar="DIR", help="Keep application state in DIR and only fetch changes (Graph delta) on later runs")
+    parser.add_argument("--direct-only", action="store_true", help="Don't follow owners that are service principals of other apps (only report apps without any enabled owner)")
+    parser.add_argument("--full-sync", action="store_true", help="With --incremental: ignore the stored delta token and crawl everything again")
+    parser.add_argument("--cache", metavar="FILE", default=DEFAULT_CACHE_PATH, help=f"Local cache of owner lookups, shared by the audit scripts (default: {DEFAULT_CACHE_PATH})")
+    parser.add_argument("--cache-ttl", type=float, default=DEFAULT_TTL_HOURS, metavar="HOURS", help=f"Look owners up again once their cached state is older than this; 0 disables the cache (default: {DEFAULT_TTL_HOURS})")
+    parser.add_argument("--daemon", metavar="URL", nargs="?", const=DEFAULT_DAEMON_URL, help=f"Ask a running audit_daemon.py instead of calling Graph (default URL: {DEFAULT_DAEMON_URL})")
     args = parser.parse_args()
 
+    if args.daemon and args.incremental:
+        parser.error("--daemon answers from the daemon's own tenant state: don't combine it with --incremental")
+    if args.daemon:
+        try:
+            query_daemon(args)
+        except Exception as e:
+            print(f"An error occurred: {e}")
+        return
+
     print("Starting audit for orphaned applications...")
 
     # Load config
@@ -28,132 +109,88 @@ async def main():
         except Exception as e:
             pass
 
-    print("Using default tenant from environment/CLI context.")
-    credential = DefaultAzureCredential()
+    if tenant_id:
+        print(f"Using tenant {tenant_id} from {config_path}.")
+    else:
+        print("Using default tenant from environment/CLI context.")
+    credential = default_credential(DefaultAzureCredential, tenant_id)
 
     try:
         # We need Application.Read.All (for apps) and User.Read.All (to check accountEnabled)
-        graph_client = GraphServiceClient(credentials=credential, scopes=['https://graph.microsoft.com/.default'])
+        graph_client = attach_graph_client(GraphServiceClient(credentials=credential, scopes=['https://graph.microsoft.com/.default']))
 
         print("Fetching Applications with Owners... (This may take a while)")
 
-        # Select relevant fields and expand owners
-        # Note: We need to specify $select for the app, AND $select for the owners if possible to be efficient.
-        # However, Python SDK expand usage can be tricky.
-        # Let's try basic expand first.
-        
-        # In OData: /applications?$expand=owners($select=id,displayName,userPrincipalName,accountEnabled)
-        # The python SDK builder pattern:
-        # request_configuration = ApplicationsRequestBuilder.ApplicationsRequestBuilderGetRequestConfiguration(
-        #     query_parameters = ApplicationsRequestBuilder.ApplicationsRequestBuilderGetQueryParameters(
-        #         select = ["id", "appId", "displayName"],
-        #         expand = ["owners"]
-        #     )
-        # )
-        
-        from msgraph.generated.applications.applications_request_builder import ApplicationsRequestBuilder
-
-        request_config = ApplicationsRequestBuilder.ApplicationsRequestBuilderGetRequestConfiguration(
-            query_parameters = ApplicationsRequestBuilder.ApplicationsRequestBuilderGetQueryParameters(
-                select = ["id", "appId", "displayName"],
-                expand = ["owners"]
-            )
-        )
-
-        result = await graph_client.applications.get(request_configuration=request_config)
-
-        orphaned_apps = []
-
-        if result and result.value:
-            for app in result.value:
-                owners = app.owners
-                
-                is_orphaned = False
-                orphan_reason = ""
-                owner_names = []
-
-                if not owners:
-                    is_orphaned = True
-                    orphan_reason = "No Owners"
-                else:
-                    # Check if all owners are disabled
-                    # owners is a list of DirectoryObject. We need to check if they are Users and if they are enabled.
-                    # Note: Owners can be ServicePrincipals too.
-                    
-                    all_disabled = True
-                    has_active_owner = False
-                    
-                    for owner in owners:
-                        # Collect name for report
-                        d_name = getattr(owner, 'display_name', 'Unknown')
-                        owner_names.append(d_name)
-
-                        # Check status
-                        # account_enabled is a property of User (and ServicePrincipal). 
-                        # DirectoryObject doesn't have it by default unless casted/typed?
-                        # The SDK uses OData inheritance.
-                        
-                        is_enabled = False
-                        
-                        # Use attribute check for safety
-                        if hasattr(owner, 'account_enabled'):
-                             # Explicit check: account_enabled is boolean
-                             if owner.account_enabled is True:
-                                 is_enabled = True
-                        else:
-                            # If we can't read account_enabled (e.g. permission issue or not a property on this object type), 
-                            # we have to assume valid or at least NOT definitively disabled.
-                            # However, 'owners' endpoint returns DirectoryObject. 
-                            # If we didn't $select/expand correctly, we might miss data.
-                            # Let's assume safely: if we can't tell, count as enabled to avoid false positive.
-                             is_enabled = True
-                        
-                        if is_enabled:
-                            has_active_owner = True
-                            all_disabled = False
-                            # Optimization: If we found one active owner, it's not orphaned.
-                            # But we continue to list all owners? No, we can break if we just care about "Is this orphaned?"
-                            # but for "all owners list" we might want to continue.
-                    
-                    if not has_active_owner:
-                        is_orphaned = True
-                        orphan_reason = "All Owners Disabled/Deleted"
-
-                if is_orphaned:
-                    orphaned_apps.append({
-                        "App": app.display_name or "Unknown",
-                        "AppId": app.app_id,
-                        "Type": orphan_reason,
-                        "OwnerCount": len(owners) if owners else 0,
-                        "Owners": "; ".join(owner_names)
-                    })
+        # Select relevant fields and expand owner ids
+        # In OData: /applications?$select=id,appId,displayName&$expand=owners($select=id)&$top=999
+        # Expanded owners are bare DirectoryObjects without accountEnabled, so the owners of
+        # each page are resolved with directoryObjects/getByIds in $batch calls (cached by id,
+        # and in the local object cache across runs).
+        # Applications are streamed across all pages; each orphan is printed as it is found.
+        header_printed = False
+        app_count = 0
+        # Apps owned only through other orphaned apps are found once every app is known.
+        graph = None if args.direct_only else OwnerGraph()
+
+        with output_sink(args.output, FIELDNAMES, COLUMN_TYPES) as sink, open_cache(args.cache, args.cache_ttl) or nullcontext() as object_cache:
+            if args.incremental:
+                # Only apps that changed since the last run are fetched and re-evaluated.
+                print(f"Syncing application state in {args.incremental}...")
+                store, changes = await sync_tenant(graph_client, args.incremental, collections=("applications",),
+                                                   full=args.full_sync, object_cache=object_cache)
+                print(f"{len(changes.applications)} changed, {len(changes.removed_applications)} removed.")
+                app_count = len(store.snapshot.applications)
+                orphaned_apps = store.cached_findings("orphaned", store.snapshot.applications, check_orphaned)
+                store.save()
+                if graph is not None:
+                    for app in store.snapshot.applications.values():
+                        graph.add_application(app)
+                if orphaned_apps:
+                    print_header()
+                    for item in orphaned_apps:
+                        print_item(item)
+                sink.write_many(orphaned_apps)
+            else:
+                resolver = OwnerResolver(graph_client, object_cache)
+                async for page in iter_application_pages(graph_client, select=["id", "appId", "displayName"], expand=APPLICATION_EXPAND):
+                    records = [project_application(app) for app in page]
+                    await resolver.resolve_applications(records)
+
+                    for app in records:
+                        app_count += 1
+                        if graph is not None:
+                            graph.add_application(app)
+                        item = check_orphaned(app)
+
+                        if item:
+                            if not header_printed:
+                                print_header()
+                                header_printed = True
+                            print_item(item)
+                            sink.write(item)
+
+            if graph is not None:
+                chained = graph.transitive_orphans()
+                if chained:
+                    print(f"\nOwned only through orphaned apps or ownership cycles: {len(chained)}")
+                    print_header()
+                    for item in chained:
+                        print_item(item)
+                sink.write_many(chained)
 
         # Report
-        if not orphaned_apps:
+        print(f"\nScanned {app_count} applications.")
+        if not sink.count:
             print("No orphaned applications found.")
         else:
-            print(f"\nFound {len(orphaned_apps)} orphaned applications:\n")
-            print(f"{'App Name':<30} | {'Type':<25} | {'App ID'}")
-            print("-" * 80)
-            for item in orphaned_apps:
-                print(f"{item['App'][:28]:<30} | {item['Type']:<25} | {item['AppId']}")
-
-        # Export
+            print(f"Found {sink.count} orphaned applications.")
         if args.output:
-            print(f"\nExporting list to {args.output}...")
-            try:
-                with open(args.output, mode='w', newline='', encoding='utf-8') as f:
-                    writer = csv.DictWriter(f, fieldnames=["App", "AppId", "Type", "OwnerCount", "Owners"])
-                    writer.writeheader()
-                    writer.writerows(orphaned_apps)
-                print("Export complete.")
-            except Exception as e:
-                print(f"Failed to export CSV: {e}")
+            print(f"Results written to {args.output}.")
 
     except Exception as e:
         print(f"An error occurred: {e}")
         if "403" in str(e):
-             print("\n[!] PERMISSION ERROR: Inspecting owners may require 'User.Read.All' and 'Application.Read.All'.")
+             print("\n[!] PERMISSION ERROR: Inspecting owners may require 'Application.Read.All' and 'Directory.Read.All' (for directoryObjects/getByIds).")
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -1,18 +1,161 @@
 import asyncio
 import argparse
 import json
-import csv
 import os
+import re
 from datetime import datetime, timezone, timedelta
 from azure.identity import DefaultAzureCredential
+from urllib.parse import quote, urlencode
+from kiota_abstractions.api_error import APIError
 from msgraph import GraphServiceClient
+from graph_paging import PAGE_SIZE, iter_raw_pages, iter_service_principals
+from tenant_snapshot import project_service_principal, project_service_principal_json
+from delta_sync import sync_tenant
+from export_sinks import export_rows, output_sink
+from audit_records import InactiveServicePrincipal
+import daemon_client
+from daemon_client import DEFAULT_DAEMON_URL
+from tenant_auth import default_credential
+from request_scheduler import attach_graph_client
+
+FIELDNAMES = InactiveServicePrincipal.FIELDNAMES
+COLUMN_TYPES = InactiveServicePrincipal.column_types()
+
+# signInActivity on servicePrincipals (and filtering on it) is only exposed by the beta API.
+SIGN_IN_FILTER_API = "beta"
+SIGN_IN_SELECT = "id,appId,displayName,signInActivity"
+# Graph answers these when the tenant/cloud doesn't support the filter: fall back to a full scan.
+FILTER_UNSUPPORTED_STATUS = (400, 404, 501)
+
+
+def check_unused(sp, today, threshold_date):
+    """
+    Return a finding if the projected service principal (see tenant_snapshot) hasn't
+    signed in since threshold_date, otherwise None.
+    """
+    last_sign_in = sp["last_sign_in"]
+
+    # Logic:
+    # 1. If never signed in (last_sign_in is None) -> It's unused (technically unused forever)
+    # 2. If signed in, but before threshold -> Unused for X days
+    if last_sign_in is None:
+        last_sign_in_str = "Never"
+        days_inactive_str = "Forever"
+    elif last_sign_in <= threshold_date:
+        last_sign_in_str = str(last_sign_in)
+        days_inactive_str = str((today - last_sign_in).days)
+    else:
+        return None
+
+    return InactiveServicePrincipal(
+        app=sp["display_name"],
+        app_id=sp["app_id"],
+        last_sign_in=last_sign_in_str,
+        days_inactive=days_inactive_str,
+        object_id=sp["id"],
+    )
+
+
+def sign_in_filter_urls(graph_client, threshold_date):
+    """
+    The two filtered service principal queries that together return exactly the inactive
+    ones: last sign-in on or before threshold_date, and never signed in.
+    """
+    base_url = re.sub(r"/v1\.0/?$", f"/{SIGN_IN_FILTER_API}", graph_client.request_adapter.base_url.rstrip("/"))
+    threshold = threshold_date.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    urls = []
+    for condition in (f"le {threshold}", "eq null"):
+        query = {
+            "$filter": f"signInActivity/lastSignInDateTime {condition}",
+            "$select": SIGN_IN_SELECT,
+            "$count": "true",
+            "$top": str(PAGE_SIZE),
+        }
+        urls.append(f"{base_url}/servicePrincipals?{urlencode(query, quote_via=quote)}")
+    return urls
+
+
+async def fetch_inactive_service_principals(graph_client, threshold_date):
+    """
+    Let Graph do the inactivity filtering ($filter on signInActivity/lastSignInDateTime, an
+    advanced query: ConsistencyLevel: eventual + $count), so active principals are never
+    downloaded. Returns (records, count): an async iterator of projected service principals
+    and Graph's @odata.count for them, or (None, None) if Graph rejects the filter.
+
+    The first page of each query is fetched up front, so a rejection shows up here
+    rather than halfway through the results.
+    """
+    headers = {"ConsistencyLevel": "eventual"}
+    streams = [iter_raw_pages(graph_client, url, headers) for url in sign_in_filter_urls(graph_client, threshold_date)]
+    try:
+        first_pages = [await stream.__anext__() for stream in streams]
+    except APIError as e:
+        for stream in streams:
+            await stream.aclose()
+        if e.response_status_code in FILTER_UNSUPPORTED_STATUS:
+            print(f"Server-side sign-in filter not available (HTTP {e.response_status_code}), falling back to a full scan.")
+            return None, None
+        raise
+
+    count = None
+    if all("@odata.count" in page for page in first_pages):
+        count = sum(page["@odata.count"] for page in first_pages)
+
+    async def records():
+        for first_page, stream in zip(first_pages, streams):
+            for obj in first_page.get("value", []):
+                yield project_service_principal_json(obj)
+            async for page in stream:
+                for obj in page.get("value", []):
+                    yield project_service_principal_json(obj)
+
+    return records(), count
+
+
+def print_header():
+    print(f"\n{'App Name':<30} | {'Days Inactive':<15} | {'Last Sign In':<30} | {'App ID'}")
+    print("-" * 110)
+
+
+def print_item(item):
+    print(f"{item.app[:28]:<30} | {item.days_inactive:<15} | {item.last_sign_in:<30} | {item.app_id}")
+
+
+def query_daemon(args):
+    """Answer from a running audit_daemon.py (no Graph calls here)."""
+    answer = daemon_client.query(args.daemon, "unused", days=args.days)
+    items = daemon_client.records(answer, InactiveServicePrincipal)
+    print(f"Answered by the audit daemon from tenant state taken at {daemon_client.taken_at(answer)}.")
+    if items:
+        print_header()
+        for item in items:
+            print_item(item)
+        print(f"\nFound {len(items)} unused applications.")
+    else:
+        print(f"\nNo apps found unused for over {args.days} days.")
+    if args.output:
+        export_rows(items, args.output, FIELDNAMES, COLUMN_TYPES)
+
 
 async def main():
     parser = argparse.ArgumentParser(description="Find Entra ID Service Principals that haven't signed in for a long time.")
     parser.add_argument("--days", type=int, default=365, help="Number of days of inactivity to look for (default: 365)")
-    parser.add_argument("--output", help="Path to export results as CSV (e.g., unused.csv)")
+    parser.add_argument("--output", help="Export results to a file, written as they are found: .csv, .jsonl or .parquet (add .gz to compress csv/jsonl)")
+    parser.add_argument("--incremental", metavar="DIR", help="Keep service principal state in DIR and only fetch changes (Graph delta) on later runs")
+    parser.add_argument("--full-sync", action="store_true", help="With --incremental: ignore the stored delta token and crawl everything again")
+    parser.add_argument("--client-side-filter", action="store_true", help="Download every service principal and filter locally instead of filtering on sign-in date in Graph")
+    parser.add_argument("--daemon", metavar="URL", nargs="?", const=DEFAULT_DAEMON_URL, help=f"Ask a running audit_daemon.py instead of calling Graph (default URL: {DEFAULT_DAEMON_URL})")
     args = parser.parse_args()
 
+    if args.daemon and args.incremental:
+        parser.error("--daemon answers from the daemon's own tenant state: don't combine it with --incremental")
+    if args.daemon:
+        try:
+            query_daemon(args)
+        except Exception as e:
+            print(f"An error occurred: {e}")
+        return
+
     print(f"Starting audit for apps unused for over {args.days} days...")
 
     # Load config
@@ -28,93 +171,79 @@ async def main():
         except Exception as e:
             print(f"Warning: Failed to read {config_path}: {e}")
 
-    print("Using default tenant from environment/CLI context.")
-    credential = DefaultAzureCredential()
+    if tenant_id:
+        print(f"Using tenant {tenant_id} from {config_path}.")
+    else:
+        print("Using default tenant from environment/CLI context.")
+    credential = default_credential(DefaultAzureCredential, tenant_id)
 
     try:
         # User needs AuditLog.Read.All or Directory.Read.All to read signInActivity
-        graph_client = GraphServiceClient(credentials=credential, scopes=['https://graph.microsoft.com/.default'])
+        graph_client = attach_graph_client(GraphServiceClient(credentials=credential, scopes=['https://graph.microsoft.com/.default']))
 
         print("Fetching Service Principals with signInActivity... (This may take a moment)")
-        
-        # We need to select signInActivity. 
-        # Note: signInActivity requires specific permissions. Use $select to be efficient.
-        # We need to select signInActivity. 
+
+        # We need to select signInActivity.
         # Note: signInActivity requires specific permissions. Use $select to be efficient.
-        from msgraph.generated.service_principals.service_principals_request_builder import ServicePrincipalsRequestBuilder
-        
-        request_config = ServicePrincipalsRequestBuilder.ServicePrincipalsRequestBuilderGetRequestConfiguration(
-            query_parameters = ServicePrincipalsRequestBuilder.ServicePrincipalsRequestBuilderGetQueryParameters(
-                select = ["appId", "displayName", "signInActivity", "id"]
-            )
-        )
-
-        # Iterating service principals
-        # Using a simple list fetch for MVP. Pagination should be handled for large tenants.
-        result = await graph_client.service_principals.get(request_configuration=request_config)
-
-        unused_apps = []
+        select = ["appId", "displayName", "signInActivity", "id"]
+
         today = datetime.now(timezone.utc)
         threshold_date = today - timedelta(days=args.days)
 
-        if result and result.value:
-            for sp in result.value:
-                last_sign_in = None
-                
-                # Check signInActivity safely
-                sign_in_activity = getattr(sp, "sign_in_activity", None)
-                
-                if sign_in_activity and hasattr(sign_in_activity, 'last_sign_in_date_time'):
-                    last_sign_in = sign_in_activity.last_sign_in_date_time
-                
-                # Logic:
-                # 1. If never signed in (last_sign_in is None) -> It's unused (technically unused forever)
-                # 2. If signed in, but before threshold -> Unused for X days
-                
-                is_unused = False
-                days_inactive = -1 # -1 denotes 'Never' in our context logic mostly, but let's handle gracefully
-
-                if last_sign_in is None:
-                    is_unused = True
-                    last_sign_in_str = "Never"
-                    days_inactive_str = "Forever"
-                else:
-                    if last_sign_in <= threshold_date:
-                        is_unused = True
-                        last_sign_in_str = str(last_sign_in)
-                        days_inactive = (today - last_sign_in).days
-                        days_inactive_str = str(days_inactive)
-                
-                if is_unused:
-                    unused_apps.append({
-                        "App": sp.display_name or "Unknown",
-                        "AppId": sp.app_id,
-                        "LastSignIn": last_sign_in_str,
-                        "DaysInactive": days_inactive_str,
-                        "ObjectId": sp.id
-                    })
+        store = None
+        if args.incremental:
+            # Only changed principals are fetched, plus every principal's sign-in date (id + signInActivity).
+            print(f"Syncing service principal state in {args.incremental}...")
+            store, changes = await sync_tenant(graph_client, args.incremental, collections=("service_principals",), full=args.full_sync)
+            print(f"{len(changes.service_principals)} changed, {len(changes.removed_service_principals)} removed.")
+
+        # Without a local store, Graph filters on the sign-in date so active principals aren't downloaded at all.
+        filtered = None
+        if store is None and not args.client_side_filter:
+            filtered, filtered_count = await fetch_inactive_service_principals(graph_client, threshold_date)
+            if filtered is not None and filtered_count is not None:
+                print(f"Graph reports {filtered_count} service principals inactive since {threshold_date.date()}.")
+
+        async def iter_sp_records():
+            if store is not None:
+                for record in store.snapshot.service_principals.values():
+                    yield record
+            elif filtered is not None:
+                async for record in filtered:
+                    yield record
+            else:
+                # Service principals are streamed across all pages; each finding is printed as it is found.
+                async for sp in iter_service_principals(graph_client, select):
+                    yield project_service_principal(sp)
+
+        header_printed = False
+        sp_count = 0
+        with output_sink(args.output, FIELDNAMES, COLUMN_TYPES) as sink:
+            async for sp in iter_sp_records():
+                sp_count += 1
+                item = check_unused(sp, today, threshold_date)
+
+                if item:
+                    if not header_printed:
+                        print_header()
+                        header_printed = True
+                    print_item(item)
+                    sink.write(item)
 
         # Report
-        if not unused_apps:
+        if filtered is not None:
+            print(f"\nGraph returned {sp_count} service principals matching the sign-in filter.")
+        else:
+            print(f"\nScanned {sp_count} service principals.")
+        if not sink.count:
             print(f"No apps found unused for over {args.days} days.")
         else:
-            print(f"\nFound {len(unused_apps)} unused applications:\n")
-            print(f"{'App Name':<30} | {'Days Inactive':<15} | {'Last Sign In':<30} | {'App ID'}")
-            print("-" * 110)
-            for item in unused_apps:
-                print(f"{item['App'][:28]:<30} | {item['DaysInactive']:<15} | {item['LastSignIn']:<30} | {item['AppId']}")
-
-        # Export
+            print(f"Found {sink.count} unused applications.")
         if args.output:
-            print(f"\nExporting to {args.output}...")
-            try:
-                with open(args.output, mode='w', newline='', encoding='utf-8') as f:
-                    writer = csv.DictWriter(f, fieldnames=["App", "AppId", "LastSignIn", "DaysInactive", "ObjectId"])
-                    writer.writeheader()
-                    writer.writerows(unused_apps)
-                print("Export complete.")
-            except Exception as e:
-                print(f"Failed to export CSV: {e}")
+            print(f"Results written to {args.output}.")
+
+        if store is not None:
+            store.save()
 
     except Exception as e:
         print(f"An error occurred: {e}")
@@ -0,0 +1,129 @@
+import bisect
+import gzip
+import json
+import os
+from datetime import datetime, timedelta
+from audit_records import ExpiringCredential
+import columnar_snapshot
+from columnar_snapshot import APPLICATIONS, CREDENTIAL_LABELS, CREDENTIALS, EXPIRY_INDEX, ColumnarSnapshot
+
+# Histogram bucket edges, in days from today. Anything past the last edge is counted as "later".
+HISTOGRAM_EDGES = [0, 7, 30, 60, 90]
+
+
+class ExpiryIndex:
+    """
+    Every secret/certificate of a tenant as (end_date, app_id, key_id, type, app name),
+    sorted by end date. "What expires within N days" is a prefix of the list, found with
+    a binary search, so any threshold can be answered without re-scanning the apps.
+
+    Written next to a TenantSnapshot (see TenantSnapshot.save), as an Arrow table already
+    in that order. Loading it reads the end dates only; the entries a query returns are
+    decoded from the memory-mapped file when asked for. Indexes saved before that, as
+    gzipped JSON, still load.
+    """
+
+    FILE = "expiry_index.arrow"
+    JSON_FILE = "expiry_index.json.gz"
+
+    def __init__(self, entries=None, taken_at=None):
+        self.taken_at = taken_at
+        self.entries = sorted(entries or [], key=lambda e: (e[0], e[1] or "", e[2] or ""))
+        # Kept separately so bisect works on plain datetimes.
+        self.end_dates = [entry[0] for entry in self.entries]
+        self._columns = None  # ColumnarSnapshot holding the entries, when loaded from one
+
+    @classmethod
+    def _from_file(cls, path):
+        columns = ColumnarSnapshot(path)
+        index = cls(taken_at=parse_datetime((columns.schema(EXPIRY_INDEX).metadata or {}).get(b"taken_at", b"").decode()))
+        index.end_dates = columns.columns(EXPIRY_INDEX, ["end_date_time"])["end_date_time"]
+        index.entries = None
+        index._columns = columns
+        return index
+
+    def _slice(self, start, stop):
+        if self._columns is None:
+            return self.entries[start:stop]
+        rows = columnar_snapshot.to_pydict(self._columns.rows(EXPIRY_INDEX, start, min(stop, len(self))))
+        return list(zip(rows["end_date_time"], rows["app_id"], rows["key_id"], rows["type"], rows["display_name"]))
+
+    @classmethod
+    def from_applications(cls, apps, taken_at=None):
+        """Build the index from projected applications (see tenant_snapshot.project_application)."""
+        entries = []
+        for app in apps:
+            for cred_type, creds in (("Secret", app["password_credentials"]), ("Certificate", app["key_credentials"])):
+                for cred in creds:
+                    if cred["end_date_time"]:
+                        entries.append((cred["end_date_time"], app["app_id"], cred["key_id"], cred_type, app["display_name"]))
+        return cls(entries, taken_at)
+
+    def save(self, path):
+        entries = self._slice(0, len(self))
+        columns = {name: [entry[i] for entry in entries]
+                   for i, name in enumerate(("end_date_time", "app_id", "key_id", "type", "display_name"))}
+        columnar_snapshot.write_expiry_index(path, columns, self.taken_at)
+        if os.path.exists(os.path.join(path, self.JSON_FILE)):
+            os.remove(os.path.join(path, self.JSON_FILE))
+
+    @classmethod
+    def from_columns(cls, columns, taken_at=None):
+        """Build the index from a ColumnarSnapshot, reading only the columns it needs."""
+        creds = columns.columns(CREDENTIALS, ["application", "type", "key_id", "end_date_time"])
+        apps = columns.columns(APPLICATIONS, ["app_id", "display_name"])
+        app_ids, names = apps["app_id"], apps["display_name"]
+        entries = [(end, app_ids[row], key_id, CREDENTIAL_LABELS[cred_type], names[row])
+                   for row, cred_type, key_id, end in zip(creds["application"], creds["type"], creds["key_id"], creds["end_date_time"])
+                   if end]
+        return cls(entries, taken_at)
+
+    @classmethod
+    def load(cls, path):
+        if os.path.exists(os.path.join(path, cls.FILE)):
+            return cls._from_file(path)
+        if not os.path.exists(os.path.join(path, cls.JSON_FILE)):
+            # A columnar snapshot saved without its index: build it from the credential columns.
+            with open(os.path.join(path, "snapshot.json"), "r", encoding="utf-8") as f:
+                taken_at = datetime.fromisoformat(json.load(f)["taken_at"])
+            return cls.from_columns(ColumnarSnapshot(path), taken_at)
+        with gzip.open(os.path.join(path, cls.JSON_FILE), "rt", encoding="utf-8") as f:
+            data = json.load(f)
+        entries = [(datetime.fromisoformat(end), app_id, key_id, cred_type, name)
+                   for end, app_id, key_id, cred_type, name in data["entries"]]
+        return cls(entries, parse_datetime(data["taken_at"]))
+
+    def __len__(self):
+        return len(self.end_dates)
+
+    def expiring(self, threshold_date):
+        """Entries that expire on or before threshold_date (already expired ones included)."""
+        return self._slice(0, bisect.bisect_right(self.end_dates, threshold_date))
+
+    def next_expirations(self, today, count):
+        """The next `count` entries that haven't expired yet."""
+        start = bisect.bisect_right(self.end_dates, today)
+        return self._slice(start, start + count)
+
+    def histogram(self, today, edges=HISTOGRAM_EDGES):
+        """
+        [(label, count)] of entries per bucket of days left: "expired" (before today),
+        then one bucket per pair of edges, then "later".
+        """
+        positions = [bisect.bisect_right(self.end_dates, today + timedelta(days=days)) for days in edges]
+        buckets = [("expired", bisect.bisect_right(self.end_dates, today))]
+        for (low, high), start, end in zip(zip(edges, edges[1:]), positions, positions[1:]):
+            buckets.append((f"{low}-{high} days", end - start))
+        buckets.append((f"> {edges[-1]} days", len(self) - positions[-1]))
+        return buckets
+
+
+def parse_datetime(value):
+    """An ISO date as stored in the snapshot files (None stays None)."""
+    return datetime.fromisoformat(value) if value else None
+
+
+def entry_to_item(entry, today):
+    """Same record as entra_app_secret_audit.find_expiring_credentials."""
+    end_date, app_id, key_id, cred_type, name = entry
+    return ExpiringCredential(name, app_id, cred_type, key_id, end_date, (end_date - today).days)
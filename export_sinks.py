@@ -0,0 +1,233 @@
+import abc
+import csv
+import gzip
+import json
+import typing
+from datetime import datetime
+import telemetry
+
+# Streaming writers behind --output: rows are written as the audits produce them,
+# so an export never needs the full result list in memory.
+# The format comes from the file extension; ".gz" on CSV/JSONL compresses on the fly.
+#
+#   .csv / .csv.gz           one row per finding, header from the script's FIELDNAMES
+#   .jsonl / .jsonl.gz       one JSON object per line (.ndjson works too)
+#   .parquet                 columnar, one row group per ROW_GROUP_SIZE rows (needs pyarrow)
+#   .arrow / .feather        Arrow IPC stream, one record batch per ROW_GROUP_SIZE rows (needs pyarrow)
+#
+# Parquet/Arrow column types come from `types` (column name -> Python type, see
+# Record.column_types) where the caller has them, so a column that happens to be empty
+# in the first row group still gets its real type.
+
+ROW_GROUP_SIZE = 10000
+
+
+def _format_of(path):
+    name = path.lower()
+    compressed = name.endswith(".gz")
+    if compressed:
+        name = name[:-3]
+    for extension, fmt in ((".csv", "csv"), (".jsonl", "jsonl"), (".ndjson", "jsonl"),
+                           (".parquet", "parquet"), (".arrow", "arrow"), (".feather", "arrow")):
+        if name.endswith(extension):
+            if compressed and fmt in ("parquet", "arrow"):
+                raise ValueError(f"{path}: Parquet/Arrow files are compressed internally, drop the .gz")
+            return fmt, compressed
+    raise ValueError(f"{path}: unknown export format (use .csv, .jsonl, .parquet or .arrow, optionally .gz for csv/jsonl)")
+
+
+def _open_text(path, compressed):
+    if compressed:
+        return gzip.open(path, "wt", newline="", encoding="utf-8")
+    return open(path, "w", newline="", encoding="utf-8")
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def _as_dict(row):
+    # Finding records (see audit_records) or plain dicts.
+    return row.as_row() if hasattr(row, "as_row") else row
+
+
+class Sink(abc.ABC):
+    """Base for the writers: a context manager with write(row) and a row count."""
+
+    def __init__(self, path, fieldnames):
+        self.path = path
+        self.fieldnames = list(fieldnames)
+        self.count = 0
+
+    @abc.abstractmethod
+    def write(self, row):
+        """Write one row (a dict or a finding record)."""
+
+    def write_many(self, rows):
+        for row in rows:
+            self.write(row)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class CsvSink(Sink):
+    def __init__(self, path, fieldnames, compressed=False):
+        super().__init__(path, fieldnames)
+        self.file = _open_text(path, compressed)
+        # Fixed header: rows missing a column get an empty cell, extra keys are dropped.
+        self.writer = csv.DictWriter(self.file, fieldnames=self.fieldnames, restval="", extrasaction="ignore")
+        self.writer.writeheader()
+
+    def write(self, row):
+        self.writer.writerow(_as_dict(row))
+        self.count += 1
+
+    def close(self):
+        self.file.close()
+
+
+class JsonlSink(Sink):
+    def __init__(self, path, fieldnames, compressed=False):
+        super().__init__(path, fieldnames)
+        self.file = _open_text(path, compressed)
+
+    def write(self, row):
+        row = _as_dict(row)
+        self.file.write(json.dumps({key: row.get(key) for key in self.fieldnames}, default=_json_default))
+        self.file.write("\n")
+        self.count += 1
+
+    def close(self):
+        self.file.close()
+
+
+def _arrow_type(pa, python_type):
+    # Optional[X] -> X; anything that isn't a date or a number is written as a string.
+    args = [arg for arg in typing.get_args(python_type) if arg is not type(None)]
+    if args:
+        python_type = args[0]
+    arrow_types = {datetime: pa.timestamp("us", tz="UTC"), bool: pa.bool_(), int: pa.int64(), float: pa.float64()}
+    return arrow_types.get(python_type, pa.string())
+
+
+class _ArrowSink(Sink):
+    """Buffers up to ROW_GROUP_SIZE rows and writes them as one row group / record batch."""
+
+    def __init__(self, path, fieldnames, types=None, row_group_size=ROW_GROUP_SIZE):
+        super().__init__(path, fieldnames)
+        try:
+            import pyarrow
+        except ImportError:
+            raise RuntimeError("Parquet/Arrow export needs pyarrow: pip install pyarrow")
+        self.pa = pyarrow
+        self.types = {key: _arrow_type(pyarrow, value) for key, value in (types or {}).items()}
+        self.row_group_size = row_group_size
+        self.buffer = []
+        self.schema = None
+        self.writer = None
+
+    def _schema(self, table=None):
+        # Declared types win. Undeclared columns are typed from the first batch, and the
+        # ones that are empty there (or with no rows at all) are stored as strings.
+        inferred = {field.name: field.type for field in table.schema} if table is not None else {}
+        fields = []
+        for key in self.fieldnames:
+            arrow_type = self.types[key] if key in self.types else inferred.get(key)
+            if arrow_type is None or self.pa.types.is_null(arrow_type):
+                arrow_type = self.pa.string()
+            fields.append(self.pa.field(key, arrow_type))
+        return self.pa.schema(fields)
+
+    @abc.abstractmethod
+    def _open_writer(self):
+        """The format's writer for self.path and self.schema."""
+
+    def _flush(self):
+        if not self.buffer:
+            return
+        columns = {key: [row.get(key) for row in self.buffer] for key in self.fieldnames}
+        if self.schema is None:
+            declared = all(key in self.types for key in self.fieldnames)
+            self.schema = self._schema(None if declared else self.pa.table(columns))
+            self.writer = self._open_writer()
+        self.writer.write_table(self.pa.table(columns, schema=self.schema))
+        self.buffer = []
+
+    def write(self, row):
+        self.buffer.append(_as_dict(row))
+        self.count += 1
+        if len(self.buffer) >= self.row_group_size:
+            self._flush()
+
+    def close(self):
+        self._flush()
+        if self.writer is None:
+            # No rows: still write a valid (empty) file, with the declared column types.
+            self.schema = self._schema()
+            self.writer = self._open_writer()
+        self.writer.close()
+
+
+class ParquetSink(_ArrowSink):
+    def _open_writer(self):
+        import pyarrow.parquet
+        return pyarrow.parquet.ParquetWriter(self.path, self.schema)
+
+
+class ArrowSink(_ArrowSink):
+    def _open_writer(self):
+        return self.pa.ipc.new_stream(self.path, self.schema)
+
+
+def open_sink(path, fieldnames, types=None):
+    """
+    Open a streaming writer for `path`, picking the format from its extension. `types`
+    (column name -> Python type) sets the Parquet/Arrow column types.
+    """
+    fmt, compressed = _format_of(path)
+    if fmt == "csv":
+        return CsvSink(path, fieldnames, compressed)
+    if fmt == "jsonl":
+        return JsonlSink(path, fieldnames, compressed)
+    if fmt == "parquet":
+        return ParquetSink(path, fieldnames, types)
+    return ArrowSink(path, fieldnames, types)
+
+
+class NullSink(Sink):
+    """Used when there is no --output, so the scripts can write unconditionally."""
+
+    def __init__(self):
+        super().__init__(None, [])
+
+    def write(self, row):
+        self.count += 1
+
+
+def output_sink(path, fieldnames, types=None):
+    """The sink for an optional --output: a NullSink (just counts) when path is None."""
+    if path is None:
+        return NullSink()
+    print(f"Writing results to {path} as they are found...")
+    return open_sink(path, fieldnames, types)
+
+
+def export_rows(rows, path, fieldnames, types=None):
+    """Write an already-computed list (or any iterable) of rows to path."""
+    print(f"\nExporting results to {path}...")
+    try:
+        with telemetry.span("export"), open_sink(path, fieldnames, types) as sink:
+            sink.write_many(rows)
+        telemetry.count("export.rows", sink.count)
+        print(f"Export complete ({sink.count} rows).")
+    except Exception as e:
+        print(f"Failed to export: {e}")
@@ -1,231 +1,186 @@
+import time
+
+_module_start = time.perf_counter()
+
+import asyncio
+import json
 import logging
-import azure.functions as func
 import os
-import csv
-import io
-from datetime import datetime, timezone, timedelta
-from azure.identity import DefaultAzureCredential
-from msgraph import GraphServiceClient
-from msgraph.generated.applications.applications_request_builder import ApplicationsRequestBuilder
-from azure.mgmt.resourcegraph import ResourceGraphClient
-from azure.mgmt.resourcegraph.models import QueryRequest
+from contextlib import contextmanager
+import azure.functions as func
+from request_scheduler import attach_graph_client, get_scheduler
+import telemetry
 
 app = func.FunctionApp()
 
+# The host imports this file on every cold start just to index the functions, so the
+# SDKs (msgraph alone is thousands of generated modules, plus azure-identity and
+# azure-mgmt-resourcegraph) are imported on first use, by the audit that needs them.
+# Import times and the time to the first request are logged once per worker process.
+_startup = {
+    "module_import_seconds": round(time.perf_counter() - _module_start, 3),
+    "imports": {},
+    "logged": False,
+}
+
+
+@contextmanager
+def timed_import(name):
+    """Record how long the first import of `name` took (later imports are free)."""
+    start = time.perf_counter()
+    yield
+    _startup["imports"].setdefault(name, round(time.perf_counter() - start, 3))
+
+
+def log_startup_metrics():
+    """One StartupMetrics trace per worker process, after its first run."""
+    if _startup["logged"]:
+        return
+    _startup["logged"] = True
+    metrics = {"module_import_seconds": _startup["module_import_seconds"], "imports": _startup["imports"]}
+    for service in ("graph", "arg"):
+        first_request_at = get_scheduler(service).first_request_at
+        if first_request_at is not None:
+            metrics[f"{service}_first_request_seconds"] = round(first_request_at - _module_start, 3)
+    logging.info(f"StartupMetrics {json.dumps(metrics)}")
+
+# Clients are created once per worker process and reused by every invocation, so the
+# credential's token cache and the HTTP connection pools survive between runs. The
+# timer is an async function: it runs on the worker's own event loop, which is what
+# makes it safe to keep the async clients (and their connection pools) around.
+# One async credential serves both Graph and Resource Graph.
+_clients = {}
+
+def get_credential():
+    if "credential" not in _clients:
+        with timed_import("azure.identity.aio"):
+            from azure.identity.aio import DefaultAzureCredential
+        _clients["credential"] = telemetry.TimedCredential(DefaultAzureCredential())
+    return _clients["credential"]
+
 # Helper to get Graph Client
 def get_graph_client():
-    credential = DefaultAzureCredential()
-    return GraphServiceClient(credentials=credential, scopes=['https://graph.microsoft.com/.default'])
-
-# Helper to log results
+    if "graph" not in _clients:
+        with timed_import("msgraph"):
+            from msgraph import GraphServiceClient
+        _clients["graph"] = attach_graph_client(GraphServiceClient(credentials=get_credential(), scopes=['https://graph.microsoft.com/.default']))
+        telemetry.instrument_graph_client(_clients["graph"])
+    return _clients["graph"]
+
+# Helper to get Resource Graph Client
+def get_arg_client():
+    if "arg" not in _clients:
+        with timed_import("azure.mgmt.resourcegraph"):
+            from azure.mgmt.resourcegraph.aio import ResourceGraphClient
+        _clients["arg"] = ResourceGraphClient(get_credential())
+    return _clients["arg"]
+
+# Helper to log results: one line per result list. Individual findings are only logged
+# at DEBUG level, so a large tenant doesn't flood Application Insights (sampling is on).
 def log_results(title, results):
     if not results:
         logging.info(f"[{title}] No items found.")
         return
 
-    logging.info(f"[{title}] Found {len(results)} items:")
+    logging.info(f"[{title}] Found {len(results)} items.")
     for item in results:
-        logging.info(item)
-
-@app.schedule(schedule="0 0 9 * * 1", arg_name="myTimer", run_on_startup=False,
-              use_monitor=False) 
-def timer_audit_secrets(myTimer: func.TimerRequest) -> None:
-    if myTimer.past_due:
-        logging.info('The timer is past due!')
-
-    logging.info('Starting audit for secrets expiring soon...')
-    
-    # Logic from entra_app_secret_audit.py
-    days = 30 # Default
-    threshold_date = datetime.now(timezone.utc) + timedelta(days=days)
-    
-    async def run_audit():
+        logging.debug(item)
+
+
+def log_audit_metrics(run_telemetry, findings, error=None):
+    """One AuditMetrics trace per audit run: timings, counters and finding counts (see telemetry)."""
+    summary = run_telemetry.summary(findings=findings, failed=error is not None)
+    logging.info(f"AuditMetrics {json.dumps(summary)}")
+
+
+async def audit_entra_apps():
+    # Secrets, unused and orphaned apps all come from the same applications /
+    # service principals crawl, so they run as one audit over one pass of the tenant.
+    logging.info('Starting audit for expiring secrets, unused apps and orphaned apps...')
+    with timed_import("audit_all"):
+        from audit_all import AUDITS, run_all_audits, run_incremental_audits
+
+    # Set AUDIT_STATE_DIR (e.g. a path under /home on a dedicated/premium plan) to only
+    # fetch changes since the previous run via Graph delta queries.
+    state_dir = os.environ.get("AUDIT_STATE_DIR")
+    # Set AUDIT_CHECKPOINT_DIR to save the full crawl's progress after every page: if an
+    # invocation hits the execution timeout, the next one continues from the last page.
+    checkpoint_dir = os.environ.get("AUDIT_CHECKPOINT_DIR")
+    # Set OBJECT_CACHE_PATH (a file on persistent storage) to keep app owner lookups
+    # between invocations; OBJECT_CACHE_TTL_HOURS defaults to 24.
+    cache_path = os.environ.get("OBJECT_CACHE_PATH")
+
+    with telemetry.collect("entra_apps") as run_telemetry:
+        findings, error = {}, None
         graph_client = get_graph_client()
-        query_params = {
-            "$select": ["id", "appId", "displayName", "passwordCredentials", "keyCredentials"]
-        }
-        
-        # Note: Pagination should be handled properly in production.
-        result = await graph_client.applications.get(request_configuration={'query_parameters': query_params})
-        
-        apps_with_expiring_creds = []
-        if result and result.value:
-            for app in result.value:
-                app_name = app.display_name or "Unknown"
-                
-                # Check Secrets
-                if app.password_credentials:
-                    for secret in app.password_credentials:
-                        if secret.end_date_time and secret.end_date_time <= threshold_date:
-                            apps_with_expiring_creds.append({
-                                "App": app_name,
-                                "Type": "Secret",
-                                "Expires": str(secret.end_date_time)
-                            })
-
-                # Check Certificates
-                if app.key_credentials:
-                    for key in app.key_credentials:
-                        if key.end_date_time and key.end_date_time <= threshold_date:
-                            apps_with_expiring_creds.append({
-                                "App": app_name,
-                                "Type": "Certificate",
-                                "Expires": str(key.end_date_time)
-                            })
-                            
-        log_results("Secrets Expiring", apps_with_expiring_creds)
-
-    import asyncio
-    asyncio.run(run_audit())
-
-@app.schedule(schedule="0 0 9 * * 1", arg_name="myTimer", run_on_startup=False,
-              use_monitor=False) 
-def timer_audit_unused_apps(myTimer: func.TimerRequest) -> None:
-    logging.info('Starting audit for unused apps...')
-    
-    days = 365
-    threshold_date = datetime.now(timezone.utc) - timedelta(days=days)
-
-    async def run_audit():
-        graph_client = get_graph_client()
-        query_params = {
-            "$select": ["appId", "displayName", "signInActivity", "id"]
-        }
-        
+        object_cache = None
         try:
-            from msgraph.generated.service_principals.service_principals_request_builder import ServicePrincipalsRequestBuilder
-            request_config = ServicePrincipalsRequestBuilder.ServicePrincipalsRequestBuilderGetRequestConfiguration(
-                query_parameters = ServicePrincipalsRequestBuilder.ServicePrincipalsRequestBuilderGetQueryParameters(
-                    select = ["appId", "displayName", "signInActivity", "id"]
-                )
-            )
-
-            result = await graph_client.service_principals.get(request_configuration=request_config)
-            unused_apps = []
-            if result and result.value:
-                for sp in result.value:
-                    last_sign_in = None
-                    sign_in_activity = getattr(sp, "sign_in_activity", None)
-                    if sign_in_activity and hasattr(sign_in_activity, 'last_sign_in_date_time'):
-                        last_sign_in = sign_in_activity.last_sign_in_date_time
-                    
-                    if last_sign_in is None or last_sign_in <= threshold_date:
-                        unused_apps.append({
-                            "App": sp.display_name or "Unknown",
-                            "LastSignIn": str(last_sign_in) if last_sign_in else "Never"
-                        })
-            
-            log_results("Unused Apps", unused_apps)
+            if cache_path:
+                from object_cache import DEFAULT_TTL_HOURS, open_cache
+                object_cache = open_cache(cache_path, float(os.environ.get("OBJECT_CACHE_TTL_HOURS", DEFAULT_TTL_HOURS)))
+            if state_dir:
+                run, changes = await run_incremental_audits(graph_client, state_dir, secret_days=30, unused_days=365,
+                                                            object_cache=object_cache)
+                logging.info(f"Delta sync: {len(changes.applications)} applications and {len(changes.service_principals)} service principals changed.")
+            else:
+                run = await run_all_audits(graph_client, secret_days=30, unused_days=365,
+                                           checkpoint_dir=checkpoint_dir, resume=True, object_cache=object_cache)
+            logging.info(f"Scanned {run.application_count} applications and {run.service_principal_count} service principals.")
+            for key, title, _ in AUDITS:
+                log_results(title, run.findings[key])
+                findings[key] = len(run.findings[key])
+            findings["applications_scanned"] = run.application_count
+            findings["service_principals_scanned"] = run.service_principal_count
         except Exception as e:
-            logging.error(f"Error checking unused apps: {e}")
+            error = e
+            logging.error(f"Error running Entra app audits: {e}")
+        finally:
+            if object_cache is not None:
+                object_cache.close()
+        log_audit_metrics(run_telemetry, findings, error)
 
-    import asyncio
-    asyncio.run(run_audit())
 
-@app.schedule(schedule="0 0 9 * * 1", arg_name="myTimer", run_on_startup=False,
-              use_monitor=False) 
-def timer_audit_orphaned_apps(myTimer: func.TimerRequest) -> None:
-    logging.info('Starting audit for orphaned apps...')
+async def defender_report():
+    logging.info('Starting Defender for Cloud new items report...')
+    with timed_import("defender_new_items"):
+        from defender_new_items import fetch_new_items
+        from defender_snapshot import diff_defender_items
 
-    async def run_audit():
-        graph_client = get_graph_client()
-        
-        request_config = ApplicationsRequestBuilder.ApplicationsRequestBuilderGetRequestConfiguration(
-            query_parameters = ApplicationsRequestBuilder.ApplicationsRequestBuilderGetQueryParameters(
-                select = ["id", "appId", "displayName"],
-                expand = ["owners"]
-            )
-        )
-        
+    # With AUDIT_STATE_DIR set, report the exact changes since last week's run instead.
+    state_dir = os.environ.get("AUDIT_STATE_DIR")
+
+    with telemetry.collect("defender") as run_telemetry:
+        findings, error = {}, None
         try:
-            result = await graph_client.applications.get(request_configuration=request_config)
-            orphaned_apps = []
-            if result and result.value:
-                for app in result.value:
-                    owners = app.owners
-                    is_orphaned = False
-                    reason = ""
-                    
-                    if not owners:
-                        is_orphaned = True
-                        reason = "No Owners"
-                    else:
-                        # Check disabled owners
-                        all_disabled = True
-                        for owner in owners:
-                             # Default true if property missing/unreadable to avoid false positives
-                            is_enabled = True 
-                            if hasattr(owner, 'account_enabled'):
-                                if owner.account_enabled is True:
-                                    is_enabled = True
-                                else:
-                                    is_enabled = False
-                            
-                            if is_enabled:
-                                all_disabled = False
-                                break
-                        
-                        if all_disabled:
-                            is_orphaned = True
-                            reason = "All Owners Disabled"
-                    
-                    if is_orphaned:
-                        orphaned_apps.append({
-                            "App": app.display_name or "Unknown",
-                            "Reason": reason
-                        })
-            
-            log_results("Orphaned Apps", orphaned_apps)
+            if state_dir:
+                diff = await diff_defender_items(get_arg_client(), os.path.join(state_dir, "defender_snapshot.db"))
+                log_results("Added Defender Items", diff.added)
+                log_results("Changed Defender Items", diff.changed)
+                log_results("Resolved Defender Items", diff.resolved)
+                findings = {"added": len(diff.added), "changed": len(diff.changed), "resolved": len(diff.resolved)}
+            else:
+                recos, paths, paths_error = await fetch_new_items(get_arg_client(), days=7)
+                log_results("New Defender Recommendations", recos)
+                findings["recommendations"] = len(recos)
+                if paths_error:
+                    logging.warning(f"Failed to query attack paths: {paths_error}")
+                else:
+                    log_results("New Attack Paths", paths)
+                    findings["attack_paths"] = len(paths)
         except Exception as e:
-            logging.error(f"Error checking orphaned apps: {e}")
+            error = e
+            logging.error(f"Error checking Defender items: {e}")
+        log_audit_metrics(run_telemetry, findings, error)
 
-    import asyncio
-    asyncio.run(run_audit())
 
 @app.schedule(schedule="0 0 9 * * 1", arg_name="myTimer", run_on_startup=False,
-              use_monitor=False) 
-def timer_defender_report(myTimer: func.TimerRequest) -> None:
-    logging.info('Starting Defender for Cloud new items report...')
-    
-    try:
-        credential = DefaultAzureCredential()
-        arg_client = ResourceGraphClient(credential)
-        days = 7
-        
-        query_recommendations = f"""
-        securityresources
-        | where type == "microsoft.security/assessments"
-        | where properties.status.code == "Unhealthy"
-        | where properties.status.statusChangeDate > ago({days}d)
-        | project Name=properties.displayName, Severity=properties.metadata.severity, Status=properties.status.code
-        """
-        
-        query_attack_paths = f"""
-        securityresources
-        | where type == "microsoft.security/attackpaths"
-        | project Name=properties.displayName, Severity=properties.riskLevel, Status=properties.status
-        | where properties.creationTime > ago({days}d) or isnull(properties.creationTime)
-        """
-        
-        request_reco = QueryRequest(query=query_recommendations)
-        response_reco = arg_client.resources(request_reco)
-        
-        recos = []
-        if response_reco.data:
-            recos = response_reco.data
-        
-        log_results("New Defender Recommendations", recos)
-        
-        # Try Attack Paths
-        try:
-            request_paths = QueryRequest(query=query_attack_paths)
-            response_paths = arg_client.resources(request_paths)
-            paths = []
-            if response_paths.data:
-                paths = response_paths.data
-            log_results("New Attack Paths", paths)
-        except Exception as e:
-             logging.warning(f"Failed to query attack paths: {e}")
+              use_monitor=False)
+async def timer_weekly_audit(myTimer: func.TimerRequest) -> None:
+    if myTimer.past_due:
+        logging.info('The timer is past due!')
 
-    except Exception as e:
-        logging.error(f"Error checking Defender items: {e}")
+    # The Entra audits (Graph) and the Defender report (Resource Graph) don't depend on
+    # each other: run them concurrently so the whole audit takes as long as the slowest one.
+    # Each one logs its own errors, so a failure in one doesn't stop the other.
+    await asyncio.gather(audit_entra_apps(), defender_report())
+    log_startup_metrics()
@@ -0,0 +1,162 @@
+import asyncio
+import json
+from kiota_abstractions.method import Method
+from kiota_abstractions.request_information import RequestInformation
+from request_scheduler import get_scheduler
+import telemetry
+from msgraph.generated.applications.applications_request_builder import ApplicationsRequestBuilder
+from msgraph.generated.service_principals.service_principals_request_builder import ServicePrincipalsRequestBuilder
+
+# Largest page size Graph accepts for directory objects.
+PAGE_SIZE = 999
+
+
+async def iter_pages(request_builder, request_configuration=None):
+    """
+    Yield every page of a Graph collection, following @odata.nextLink until it runs out.
+
+    The next page is requested before the current one is handed out, so the caller
+    can evaluate a page while the following one is still in flight. At most two pages
+    are held in memory at any time, whatever the size of the tenant. Every request goes
+    through the shared Graph scheduler (concurrency limit, Retry-After, backoff).
+    """
+    pages = iter_linked_pages(request_builder, request_configuration)
+    try:
+        async for page, _ in pages:
+            yield page
+    finally:
+        await pages.aclose()
+
+
+async def _fetch_page(scheduler, request_factory, span_name="graph.page"):
+    with telemetry.span(span_name):
+        return await scheduler.run(request_factory)
+
+
+async def iter_linked_pages(request_builder, request_configuration=None, start_link=None):
+    """
+    iter_pages, yielding (objects, next_link) per page: next_link is where the crawl
+    continues once this page has been processed (None after the last page), which is
+    what a checkpoint needs to store (see crawl_checkpoint). With start_link (such a
+    stored link) the crawl continues from there instead of the first page.
+    """
+    scheduler = get_scheduler("graph")
+    if start_link:
+        result = await _fetch_page(scheduler, request_builder.with_url(start_link).get)
+    else:
+        result = await _fetch_page(scheduler, lambda: request_builder.get(request_configuration=request_configuration))
+    pending = None
+    try:
+        while result is not None:
+            next_link = result.odata_next_link
+            if next_link:
+                # The nextLink already carries $select/$expand/$top and the skip token.
+                next_builder = request_builder.with_url(next_link)
+                pending = asyncio.ensure_future(_fetch_page(scheduler, next_builder.get))
+
+            page = result.value or []
+            telemetry.count("graph.objects", len(page))
+            yield page, next_link
+
+            if pending is None:
+                break
+            result = await pending
+            pending = None
+    finally:
+        # Consumer stopped early (break/exception): don't leave a request dangling.
+        if pending is not None:
+            pending.cancel()
+
+
+async def iter_objects(request_builder, request_configuration=None):
+    """Yield the objects of a Graph collection one at a time, across all pages."""
+    async for page in iter_pages(request_builder, request_configuration):
+        for item in page:
+            yield item
+
+
+def _applications_request_config(select, expand):
+    return ApplicationsRequestBuilder.ApplicationsRequestBuilderGetRequestConfiguration(
+        query_parameters = ApplicationsRequestBuilder.ApplicationsRequestBuilderGetQueryParameters(
+            select = select,
+            expand = expand,
+            top = PAGE_SIZE
+        )
+    )
+
+
+def iter_applications(graph_client, select, expand=None):
+    """Stream all App Registrations in the tenant."""
+    return iter_objects(graph_client.applications, _applications_request_config(select, expand))
+
+
+def iter_application_pages(graph_client, select, expand=None):
+    """Stream all App Registrations in the tenant, one page (list) at a time."""
+    return iter_pages(graph_client.applications, _applications_request_config(select, expand))
+
+
+def iter_linked_application_pages(graph_client, select, expand=None, start_link=None):
+    """App Registrations one page at a time, with next links (see iter_linked_pages)."""
+    return iter_linked_pages(graph_client.applications, _applications_request_config(select, expand), start_link)
+
+
+def _service_principals_request_config(select):
+    return ServicePrincipalsRequestBuilder.ServicePrincipalsRequestBuilderGetRequestConfiguration(
+        query_parameters = ServicePrincipalsRequestBuilder.ServicePrincipalsRequestBuilderGetQueryParameters(
+            select = select,
+            top = PAGE_SIZE
+        )
+    )
+
+
+def iter_service_principals(graph_client, select):
+    """Stream all Service Principals (Enterprise Applications) in the tenant."""
+    return iter_objects(graph_client.service_principals, _service_principals_request_config(select))
+
+
+def iter_linked_service_principal_pages(graph_client, select, start_link=None):
+    """Service Principals one page at a time, with next links (see iter_linked_pages)."""
+    return iter_linked_pages(graph_client.service_principals, _service_principals_request_config(select), start_link)
+
+
+async def iter_delta_pages(request_builder, request_configuration=None):
+    """
+    Walk a Graph delta query to the end, yielding (objects, delta_link) per page.
+
+    delta_link is None on every page except the last one, which carries the
+    @odata.deltaLink to store for the next incremental round. request_builder may
+    already point at a saved deltaLink (via with_url), in which case only the
+    changes since that round are returned.
+    """
+    scheduler = get_scheduler("graph")
+    result = await _fetch_page(scheduler, lambda: request_builder.get(request_configuration=request_configuration), "graph.delta_page")
+    while result is not None:
+        next_link = result.odata_next_link
+        telemetry.count("graph.objects", len(result.value or []))
+        yield result.value or [], None if next_link else result.odata_delta_link
+        if not next_link:
+            break
+        result = await _fetch_page(scheduler, request_builder.with_url(next_link).get, "graph.delta_page")
+
+
+async def iter_raw_pages(graph_client, url, headers=None):
+    """
+    Yield each page of a Graph collection as parsed JSON (the '@odata.*' keys included),
+    following @odata.nextLink. Goes through the request adapter directly, for queries
+    the typed request builders can't express (extra headers, beta-only properties);
+    it also skips building SDK models for every object.
+    """
+    adapter = graph_client.request_adapter
+    scheduler = get_scheduler("graph")
+    while url:
+        request_info = RequestInformation()
+        request_info.http_method = Method.GET
+        request_info.url = url
+        request_info.headers.try_add("Accept", "application/json")
+        for name, value in (headers or {}).items():
+            request_info.headers.try_add(name, value)
+        raw = await _fetch_page(scheduler, lambda: adapter.send_primitive_async(request_info, "bytes", None))
+        page = json.loads(raw)
+        telemetry.count("graph.objects", len(page.get("value", [])))
+        yield page
+        url = page.get("@odata.nextLink")
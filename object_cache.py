@@ -0,0 +1,122 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+import telemetry
+
+# Local cache of directory objects looked up by id (e.g. app owners), shared by every
+# script and run on the same machine, so repeat runs don't ask Graph about objects it
+# told us about a few hours ago:
+#
+#   objects(kind, id)  data       the object as JSON (e.g. DirectoryObject.as_dict())
+#                      marker     fingerprint of data, to tell which objects changed on a refresh
+#                      fetched_at when Graph last returned it: older than the TTL is stale
+#                      used_at    last lookup, for LRU eviction once max_entries is reached
+#
+# getByIds has no ETags or lastModified for users/service principals, so freshness is
+# time-based: a disabled or deleted owner shows up once its entry is older than the TTL
+# (or straight away with a refresh, e.g. --full-sync).
+
+DEFAULT_CACHE_PATH = os.path.join(".cache", "objects.sqlite")
+DEFAULT_TTL_HOURS = 24
+DEFAULT_MAX_ENTRIES = 500_000
+
+# SQLite allows 999 bound parameters per statement.
+IDS_PER_QUERY = 500
+
+
+def fingerprint(data):
+    return hashlib.sha1(json.dumps(data, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+class ObjectCache:
+    """SQLite file of objects by (kind, id), with a TTL and a size-bounded LRU."""
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, ttl_hours=DEFAULT_TTL_HOURS, max_entries=DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl_hours * 3600
+        self.max_entries = max_entries
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Several scripts / tenant workers may use the same file at once.
+        self.conn = sqlite3.connect(path, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS objects (
+                kind TEXT NOT NULL,
+                id TEXT NOT NULL,
+                marker TEXT NOT NULL,
+                data TEXT NOT NULL,
+                fetched_at REAL NOT NULL,
+                used_at REAL NOT NULL,
+                PRIMARY KEY (kind, id)
+            );
+            CREATE INDEX IF NOT EXISTS objects_used_at ON objects (used_at);
+        """)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def get_many(self, kind, ids):
+        """{id: data} of the ids that have an entry younger than the TTL; the rest have to be fetched."""
+        now = time.time()
+        ids = list(ids)
+        found = {}
+        for start in range(0, len(ids), IDS_PER_QUERY):
+            chunk = ids[start:start + IDS_PER_QUERY]
+            rows = self.conn.execute(
+                f"SELECT id, data FROM objects WHERE kind = ? AND fetched_at >= ? AND id IN ({','.join('?' * len(chunk))})",
+                [kind, now - self.ttl] + chunk)
+            found.update((object_id, json.loads(data)) for object_id, data in rows)
+        if found:
+            with self.conn:
+                self.conn.executemany("UPDATE objects SET used_at = ? WHERE kind = ? AND id = ?",
+                                      [(now, kind, object_id) for object_id in found])
+        telemetry.count("cache.hits", len(found))
+        telemetry.count("cache.misses", len(ids) - len(found))
+        return found
+
+    def put_many(self, kind, objects):
+        """
+        Store freshly fetched objects ({id: data}), then evict whatever is over the limits.
+        Returns the ids that were cached before with different data.
+        """
+        now = time.time()
+        markers = {object_id: fingerprint(data) for object_id, data in objects.items()}
+        ids = list(objects)
+        changed = []
+        for start in range(0, len(ids), IDS_PER_QUERY):
+            chunk = ids[start:start + IDS_PER_QUERY]
+            rows = self.conn.execute(
+                f"SELECT id, marker FROM objects WHERE kind = ? AND id IN ({','.join('?' * len(chunk))})", [kind] + chunk)
+            changed.extend(object_id for object_id, marker in rows if marker != markers[object_id])
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO objects VALUES (?, ?, ?, ?, ?, ?)", [
+                (kind, object_id, markers[object_id], json.dumps(data), now, now) for object_id, data in objects.items()
+            ])
+        self.evict()
+        return changed
+
+    def evict(self):
+        """Drop expired entries, then the least recently used ones beyond max_entries."""
+        with self.conn:
+            expired = self.conn.execute("DELETE FROM objects WHERE fetched_at < ?", (time.time() - self.ttl,)).rowcount
+            over = self.conn.execute("SELECT COUNT(*) FROM objects").fetchone()[0] - self.max_entries
+            if over > 0:
+                self.conn.execute("DELETE FROM objects WHERE rowid IN (SELECT rowid FROM objects ORDER BY used_at LIMIT ?)", (over,))
+        telemetry.count("cache.evicted", expired + max(over, 0))
+
+
+def open_cache(path, ttl_hours):
+    """The ObjectCache for the --cache / --cache-ttl options: None when caching is off (TTL 0)."""
+    if not path or ttl_hours <= 0:
+        return None
+    return ObjectCache(path, ttl_hours)
@@ -0,0 +1,92 @@
+from collections import defaultdict, deque
+from audit_records import OrphanedApp
+
+# check_orphaned counts an app as owned when any owner is enabled, but an enabled owner
+# can be a service principal, i.e. another app, which may itself be orphaned:
+#
+#   user (disabled) -> App A -> SP of A -> App B -> SP of B -> App C
+#
+# A is orphaned, so B and C have no one responsible for them either. OwnerGraph links
+# each app to the apps owning it (an owning service principal's appId) and finds every
+# app that can't reach a real owner, in one traversal over the whole tenant:
+#
+# - roots: apps with an enabled owner that isn't one of the tenant's apps (a user, or the
+#   service principal of another tenant's / Microsoft's app, which we can't look into);
+# - owned: everything reachable from a root along "owns" edges (breadth-first, each app
+#   once);
+# - what's left has owners, but only apps that end up without a real owner. Peeling
+#   those whose owners are all settled separates chains that end in an orphaned app
+#   from ownership cycles (A owned by B's SP, B by A's; or an app owning itself).
+
+CHAIN_REASON = "Owners Are Orphaned Apps"
+CYCLE_REASON = "Ownership Cycle"
+
+
+class OwnerGraph:
+    """Ownership edges between the applications of a tenant, keyed by appId."""
+
+    def __init__(self):
+        self.apps = {}  # appId -> (display name, owners)
+
+    def add_application(self, app):
+        """Add a projected application with resolved owners (see owner_resolution)."""
+        if app["app_id"]:
+            self.apps[app["app_id"]] = (app["display_name"], app["owners"])
+
+    def __len__(self):
+        return len(self.apps)
+
+    def transitive_orphans(self):
+        """
+        OrphanedApp records for the apps that have enabled owners, but none that leads to
+        a real owner. Apps without any enabled owner are left out: check_orphaned reports those.
+        """
+        owned = set()
+        queue = deque()
+        owned_by = {}  # appId -> appIds of the tenant's apps among its enabled owners
+        owns = defaultdict(list)  # appId -> apps its service principal (co-)owns
+        for app_id, (_, owners) in self.apps.items():
+            active = [owner for owner in owners if owner.account_enabled is not False]
+            if not active:
+                continue
+            chained = {owner.app_id for owner in active if owner.type == "servicePrincipal" and owner.app_id in self.apps}
+            if any(owner.type != "servicePrincipal" or owner.app_id not in self.apps for owner in active):
+                owned.add(app_id)
+                queue.append(app_id)
+            owned_by[app_id] = chained
+            for owner_app_id in chained:
+                owns[owner_app_id].append(app_id)
+
+        while queue:
+            for app_id in owns[queue.popleft()]:
+                if app_id not in owned:
+                    owned.add(app_id)
+                    queue.append(app_id)
+
+        unowned = [app_id for app_id in owned_by if app_id not in owned]
+        # Peel apps whose owning apps are all settled (directly orphaned or peeled):
+        # what can't be peeled is on, or owned through, an ownership cycle.
+        pending = {app_id: sum(1 for owner_app_id in owned_by[app_id] if owner_app_id in owned_by and owner_app_id not in owned)
+                   for app_id in unowned}
+        queue.extend(app_id for app_id, count in pending.items() if count == 0)
+        chained_to_orphan = set()
+        while queue:
+            app_id = queue.popleft()
+            chained_to_orphan.add(app_id)
+            for dependent in owns[app_id]:
+                if dependent in pending:
+                    pending[dependent] -= 1
+                    if pending[dependent] == 0:
+                        queue.append(dependent)
+
+        found = []
+        for app_id in unowned:
+            name, owners = self.apps[app_id]
+            found.append(OrphanedApp(
+                app=name,
+                app_id=app_id,
+                reason=CHAIN_REASON if app_id in chained_to_orphan else CYCLE_REASON,
+                owner_count=len(owners),
+                owners="; ".join(owner.display_name for owner in owners),
+            ))
+        return found
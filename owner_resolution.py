@@ -0,0 +1,132 @@
+import asyncio
+import json
+from kiota_abstractions.method import Method
+from kiota_abstractions.request_information import RequestInformation
+from request_scheduler import get_scheduler, RETRYABLE_STATUS, retry_after_seconds
+from audit_records import DirectoryObject
+import telemetry
+
+# Graph limits: 20 requests per $batch, 1000 ids per directoryObjects/getByIds call.
+BATCH_SIZE = 20
+IDS_PER_REQUEST = 1000
+OWNER_TYPES = ["user", "servicePrincipal"]
+# Owners expanded with $expand=owners come back as bare DirectoryObjects (no accountEnabled),
+# so only their ids are fetched with the apps and the state is resolved here. appId (service
+# principals only) links an owning service principal to its own app, see owner_graph.
+OWNER_SELECT = "id,displayName,accountEnabled,appId"
+MAX_ROUNDS = 5
+
+
+def _owner_state(obj):
+    return DirectoryObject(
+        id=obj["id"],
+        display_name=obj.get("displayName") or "Unknown",
+        type=(obj.get("@odata.type") or "").replace("#microsoft.graph.", "") or "directoryObject",
+        account_enabled=obj.get("accountEnabled"),
+        app_id=obj.get("appId"),
+    )
+
+
+def _deleted_owner(owner_id):
+    # getByIds silently skips ids that no longer exist: the owner was deleted.
+    return DirectoryObject(id=owner_id, display_name="Deleted object", type="deleted", account_enabled=False)
+
+
+class OwnerResolver:
+    """
+    Resolves app owners to their real state (user/servicePrincipal, accountEnabled) with
+    directoryObjects/getByIds calls packed into JSON $batch requests: up to 20 x 1000 ids
+    per round-trip. Results are cached by object id for the lifetime of the resolver, and
+    every app owned by the same object shares its one DirectoryObject.
+
+    With an ObjectCache, owners looked up by an earlier run (within its TTL) are taken
+    from there instead of Graph, and what Graph returns is stored for the next run.
+    refresh=True still stores the results but doesn't read cached ones.
+    """
+
+    # Versioned: entries cached before appId was selected are left to expire.
+    OWNER_KIND = "owner.v2"
+
+    def __init__(self, graph_client, object_cache=None, refresh=False):
+        self.graph_client = graph_client
+        self.cache = {}
+        self.object_cache = object_cache
+        self.refresh = refresh
+        self.batches = 0
+
+    async def _post_batch(self, requests):
+        adapter = self.graph_client.request_adapter
+        request_info = RequestInformation()
+        request_info.http_method = Method.POST
+        request_info.url = f"{adapter.base_url}/$batch"
+        request_info.headers.try_add("Content-Type", "application/json")
+        request_info.headers.try_add("Accept", "application/json")
+        request_info.content = json.dumps({"requests": requests}).encode("utf-8")
+        self.batches += 1
+        with telemetry.span("graph.batch"):
+            raw = await get_scheduler("graph").run(lambda: adapter.send_primitive_async(request_info, "bytes", None))
+        return json.loads(raw)["responses"]
+
+    async def _resolve_chunks(self, chunks):
+        """Resolve id chunks, retrying sub-requests that were throttled inside the batch."""
+        for _ in range(MAX_ROUNDS):
+            if not chunks:
+                return
+            requests = [{
+                "id": str(i),
+                "method": "POST",
+                "url": f"/directoryObjects/getByIds?$select={OWNER_SELECT}",
+                "headers": {"Content-Type": "application/json"},
+                "body": {"ids": chunk, "types": OWNER_TYPES},
+            } for i, chunk in enumerate(chunks)]
+
+            retry, delay = [], 0.0
+            for start in range(0, len(requests), BATCH_SIZE):
+                for response in await self._post_batch(requests[start:start + BATCH_SIZE]):
+                    chunk = chunks[int(response["id"])]
+                    status = response.get("status")
+                    if status == 200:
+                        for obj in response.get("body", {}).get("value", []):
+                            self.cache[obj["id"]] = _owner_state(obj)
+                        for owner_id in chunk:
+                            if owner_id not in self.cache:
+                                self.cache[owner_id] = _deleted_owner(owner_id)
+                    elif status in RETRYABLE_STATUS:
+                        retry.append(chunk)
+                        headers = {k.lower(): v for k, v in (response.get("headers") or {}).items()}
+                        delay = max(delay, retry_after_seconds(headers) or 1.0)
+                    else:
+                        error = response.get("body", {}).get("error", {})
+                        raise RuntimeError(f"getByIds failed ({status}): {error.get('message', error)}")
+            chunks = retry
+            if chunks:
+                await asyncio.sleep(delay)
+        raise RuntimeError(f"getByIds still throttled after {MAX_ROUNDS} attempts")
+
+    async def resolve(self, owner_ids):
+        """Make sure every id in owner_ids is in the cache."""
+        missing = sorted({owner_id for owner_id in owner_ids if owner_id and owner_id not in self.cache})
+        if self.object_cache is not None and missing and not self.refresh:
+            for owner_id, data in self.object_cache.get_many(self.OWNER_KIND, missing).items():
+                self.cache[owner_id] = DirectoryObject.from_dict(data)
+            missing = [owner_id for owner_id in missing if owner_id not in self.cache]
+        chunks = [missing[i:i + IDS_PER_REQUEST] for i in range(0, len(missing), IDS_PER_REQUEST)]
+        await self._resolve_chunks(chunks)
+        if self.object_cache is not None and missing:
+            changed = self.object_cache.put_many(self.OWNER_KIND, {owner_id: self.cache[owner_id].as_dict() for owner_id in missing})
+            telemetry.count("owners.changed", len(changed))
+
+    def apply(self, app):
+        """
+        Replace the owners of a projected application with their resolved state.
+        Returns True if any owner's state differs from what the record held before.
+        """
+        resolved = [self.cache.get(owner.id, owner) for owner in app["owners"]]
+        changed = resolved != app["owners"]
+        app["owners"] = resolved
+        return changed
+
+    async def resolve_applications(self, apps):
+        """Resolve and apply the owners of a batch of projected applications (e.g. one page)."""
+        await self.resolve(owner.id for app in apps for owner in app["owners"])
+        return [app for app in apps if self.apply(app)]
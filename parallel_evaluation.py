@@ -0,0 +1,125 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from audit_records import DirectoryObject, ExpiringCredential, InactiveServicePrincipal, OrphanedApp
+import entra_app_secret_audit
+import entra_orphaned_apps
+import entra_unused_apps
+
+# Evaluating the rules over a large snapshot (credential dates, owner states, building
+# the finding records) is pure CPU work, so after the crawl it can be split over worker
+# processes. Moving data between processes easily costs more than the rules themselves,
+# so as little as possible is moved:
+# - where processes are forked (Linux), workers inherit the records and only get an
+#   index range to evaluate;
+# - elsewhere (spawn), records are sent as flat tuples, much cheaper to pickle than the
+#   projected dicts with their repeated keys, and turned back into dicts by the worker;
+# - findings come back as tuples of their fields and are rebuilt into records here.
+# Findings are collected in input order, so the reports match a serial evaluation.
+
+# Objects per task: large enough that scheduling overhead doesn't dominate.
+CHUNK_SIZE = 20000
+
+# Records inherited by forked workers: (applications, service_principals) lists.
+_shared = None
+
+
+def default_workers():
+    return os.cpu_count() or 1
+
+
+def pack_application(app):
+    return (
+        app["id"], app["app_id"], app["display_name"],
+        tuple((cred["key_id"], cred["end_date_time"]) for cred in app["password_credentials"]),
+        tuple((cred["key_id"], cred["end_date_time"]) for cred in app["key_credentials"]),
+        tuple((owner.id, owner.display_name, owner.type, owner.account_enabled, owner.app_id) for owner in app["owners"]),
+    )
+
+
+def unpack_application(row):
+    object_id, app_id, display_name, password_credentials, key_credentials, owners = row
+    return {
+        "id": object_id,
+        "app_id": app_id,
+        "display_name": display_name,
+        "password_credentials": [{"key_id": key_id, "end_date_time": end} for key_id, end in password_credentials],
+        "key_credentials": [{"key_id": key_id, "end_date_time": end} for key_id, end in key_credentials],
+        "owners": [DirectoryObject(*owner) for owner in owners],
+    }
+
+
+def pack_service_principal(sp):
+    return (sp["id"], sp["app_id"], sp["display_name"], sp["last_sign_in"])
+
+
+def unpack_service_principal(row):
+    object_id, app_id, display_name, last_sign_in = row
+    return {"id": object_id, "app_id": app_id, "display_name": display_name, "last_sign_in": last_sign_in}
+
+
+def _fields(item):
+    return tuple(getattr(item, name) for name in item.__slots__)
+
+
+def _records(task, collection, unpack):
+    # An index range into the inherited records, or a chunk of packed tuples.
+    if isinstance(task, range):
+        records = _shared[collection]
+        return (records[i] for i in task)
+    return map(unpack, task)
+
+
+def _evaluate_applications(task, today, expiry_threshold, orphaned):
+    secrets, orphans = [], []
+    for app in _records(task, 0, unpack_application):
+        for item in entra_app_secret_audit.find_expiring_credentials(app, today, expiry_threshold):
+            secrets.append(_fields(item))
+        if orphaned:
+            item = entra_orphaned_apps.check_orphaned(app)
+            if item:
+                orphans.append(_fields(item))
+    return secrets, orphans
+
+
+def _evaluate_service_principals(task, today, inactivity_threshold):
+    found = []
+    for sp in _records(task, 1, unpack_service_principal):
+        item = entra_unused_apps.check_unused(sp, today, inactivity_threshold)
+        if item:
+            found.append(_fields(item))
+    return found
+
+
+def _tasks(records, pack, fork):
+    for start in range(0, len(records), CHUNK_SIZE):
+        stop = min(start + CHUNK_SIZE, len(records))
+        yield range(start, stop) if fork else [pack(record) for record in records[start:stop]]
+
+
+def evaluate_parallel(run, applications, service_principals, workers, orphaned=True):
+    """
+    Evaluate projected applications and service principals into the AuditRun's findings
+    with `workers` processes. orphaned=False leaves the orphaned audit to the caller
+    (e.g. DeltaStore.cached_findings).
+    """
+    global _shared
+    applications, service_principals = list(applications), list(service_principals)
+    fork = "fork" in multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context("fork" if fork else None)
+    # Set before the pool starts its workers, so forked workers see it.
+    _shared = (applications, service_principals)
+    try:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+            app_tasks = [pool.submit(_evaluate_applications, task, run.today, run.expiry_threshold, orphaned)
+                         for task in _tasks(applications, pack_application, fork)]
+            sp_tasks = [pool.submit(_evaluate_service_principals, task, run.today, run.inactivity_threshold)
+                        for task in _tasks(service_principals, pack_service_principal, fork)]
+            for task in app_tasks:
+                secrets, orphans = task.result()
+                run.findings["secrets"].extend(ExpiringCredential(*fields) for fields in secrets)
+                run.findings["orphaned"].extend(OrphanedApp(*fields) for fields in orphans)
+            for task in sp_tasks:
+                run.findings["unused"].extend(InactiveServicePrincipal(*fields) for fields in task.result())
+    finally:
+        _shared = None
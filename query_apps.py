@@ -0,0 +1,83 @@
+import argparse
+from datetime import datetime, timezone
+import app_index
+from app_index import AppIndex
+from tenant_snapshot import TenantSnapshot
+from export_sinks import export_rows
+from audit_records import AppCorrelation
+import daemon_client
+from daemon_client import DEFAULT_DAEMON_URL
+
+FIELDNAMES = AppCorrelation.FIELDNAMES
+COLUMN_TYPES = AppCorrelation.column_types()
+
+
+def print_header():
+    print(f"\n{'App Name':<30} | {'Last Sign-In':<26} | {'Owners':<6} | {'Live Creds':<10} | {'Orphaned':<28} | {'App ID'}")
+    print("-" * 150)
+
+
+def print_item(item):
+    owners = "-" if item.owner_count is None else item.owner_count
+    print(f"{item.app[:28]:<30} | {item.last_sign_in[:25]:<26} | {owners:<6} | {item.live_credentials:<10} | "
+          f"{item.orphan_reason or '':<28} | {item.app_id}")
+
+
+def load_index(path):
+    if AppIndex.exists(path):
+        return AppIndex.load(path)
+    # Snapshots saved before the index existed: build it (and keep it for next time).
+    print(f"No app index in {path}, building it from the snapshot...")
+    index = AppIndex.from_snapshot(TenantSnapshot.load(path))
+    index.save(path)
+    return index
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cross-audit queries over a saved snapshot: apps and service principals joined on appId, all filters combined (AND).")
+    parser.add_argument("--from", dest="path", metavar="DIR", help="Snapshot (audit_all.py --save-snapshot) or incremental state directory (--incremental)")
+    parser.add_argument("--daemon", metavar="URL", nargs="?", const=DEFAULT_DAEMON_URL, help=f"Ask a running audit_daemon.py instead of reading --from (default URL: {DEFAULT_DAEMON_URL})")
+    parser.add_argument("--unused", type=int, metavar="DAYS", help="Service principal hasn't signed in for DAYS days (or never)")
+    parser.add_argument("--orphaned", action="store_true", help="App registration has no owners, or only disabled/deleted ones")
+    parser.add_argument("--live-credentials", action="store_true", help="App registration still holds a valid secret or certificate")
+    parser.add_argument("--expiring", type=int, metavar="DAYS", help="A secret or certificate expires within DAYS days (already expired included)")
+    parser.add_argument("--no-service-principal", action="store_true", help="App registration without a service principal in the tenant")
+    parser.add_argument("--no-application", action="store_true", help="Service principal without an app registration in the tenant (e.g. another tenant's app)")
+    parser.add_argument("--output", help="Export the matches to a file: .csv, .jsonl or .parquet (add .gz to compress csv/jsonl)")
+    args = parser.parse_args()
+
+    if bool(args.path) == bool(args.daemon):
+        parser.error("give either --from DIR or --daemon [URL]")
+    today = datetime.now(timezone.utc)
+    filters = app_index.build_filters(today, args.unused, args.orphaned, args.live_credentials, args.expiring,
+                                      args.no_service_principal, args.no_application)
+    if not filters:
+        parser.error("give at least one filter (e.g. --unused 90 --orphaned --live-credentials)")
+
+    try:
+        if args.daemon:
+            answer = daemon_client.query(args.daemon, "apps", unused=args.unused, orphaned=args.orphaned,
+                                         live_credentials=args.live_credentials, expiring=args.expiring,
+                                         no_service_principal=args.no_service_principal, no_application=args.no_application)
+            print(f"Answered by the audit daemon from tenant state taken at {daemon_client.taken_at(answer)}.")
+            items = daemon_client.records(answer, AppCorrelation, dates=("next_expiry",))
+        else:
+            index = load_index(args.path)
+            print(f"App index of {len(index)} appIds, taken at {index.taken_at}.")
+            items = [app_index.to_record(entry, today) for entry in index.query(filters)]
+        items.sort(key=lambda item: item.app.lower())
+
+        if items:
+            print_header()
+            for item in items:
+                print_item(item)
+        print(f"\n{len(items)} apps match.")
+
+        if args.output:
+            export_rows(items, args.output, FIELDNAMES, COLUMN_TYPES)
+
+    except Exception as e:
+        print(f"An error occurred: {e}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+import asyncio
+import os
+import random
+import time
+from email.utils import parsedate_to_datetime
+import telemetry
+
+# Status codes worth retrying: throttling and transient server-side failures.
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+# Defaults per service, overridable with <PREFIX>_MAX_CONCURRENCY, <PREFIX>_REQUESTS_PER_SECOND,
+# <PREFIX>_BURST and <PREFIX>_MAX_RETRIES environment variables (e.g. GRAPH_MAX_CONCURRENCY=8).
+#
+# graph: identity & access limits are per app per tenant, 3,500 resource units per 10s for
+#        the smallest tenant size (8,000 for large ones); a list request costs 2-3 units.
+# arg:   Resource Graph allows 15 queries per 5s window per user.
+SERVICE_LIMITS = {
+    "graph": {"max_concurrency": 16, "requests_per_second": 100.0, "burst": 100, "max_retries": 6},
+    "arg": {"max_concurrency": 4, "requests_per_second": 3.0, "burst": 15, "max_retries": 6},
+}
+
+# Remaining-quota headers of Resource Graph (x-ms-user-quota-*), ARM and Graph.
+QUOTA_REMAINING_HEADERS = ("x-ms-user-quota-remaining", "x-ms-ratelimit-remaining-tenant-reads", "ratelimit-remaining")
+
+BASE_DELAY = 1.0   # first backoff, in seconds
+MAX_DELAY = 60.0   # cap for computed backoff (a server-sent Retry-After is always honored)
+
+
+def _env_number(name, default, cast):
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    try:
+        return cast(value)
+    except ValueError:
+        return default
+
+
+def _status_code(exc):
+    # msgraph/kiota APIError, azure-core HttpResponseError and httpx errors all expose the status differently.
+    for attr in ("response_status_code", "status_code"):
+        status = getattr(exc, attr, None)
+        if isinstance(status, int):
+            return status
+    response = getattr(exc, "response", None)
+    status = getattr(response, "status_code", None)
+    return status if isinstance(status, int) else None
+
+
+def _headers(exc):
+    headers = getattr(exc, "response_headers", None)
+    if headers is None:
+        headers = getattr(getattr(exc, "response", None), "headers", None)
+    if not headers:
+        return {}
+    return {str(k).lower(): (v[0] if isinstance(v, (list, tuple, set)) and v else v) for k, v in dict(headers).items()}
+
+
+def retry_after_seconds(headers):
+    """Delay requested by the server, from Retry-After (seconds or HTTP date) or ARG's quota reset header."""
+    value = headers.get("retry-after") or headers.get("x-ms-user-quota-resets-after")
+    if not value:
+        return None
+    value = str(value).strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    if ":" in value and value.count(":") == 2 and "," not in value:
+        # x-ms-user-quota-resets-after is hh:mm:ss
+        h, m, s = value.split(":")
+        return int(h) * 3600 + int(m) * 60 + float(s)
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second, holding at most `capacity`."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def pause(self, seconds):
+        """Stop handing out tokens for `seconds` (server told us to back off)."""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            if now < self.paused_until:
+                await asyncio.sleep(self.paused_until - now)
+                continue
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class RequestScheduler:
+    """
+    Runs requests to one service under a concurrency limit and a token bucket, retrying
+    throttled (429) and transient failures with the server's Retry-After, or exponential
+    backoff with full jitter when it doesn't send one. A 429 pauses the whole bucket, so
+    concurrent requests back off together instead of each hitting the limit again.
+    """
+
+    def __init__(self, name, max_concurrency, requests_per_second, burst, max_retries):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.bucket = TokenBucket(requests_per_second, burst)
+        self._semaphore = None
+        self._loop = None
+        self.requests = 0
+        self.retries = 0
+        self.throttled = 0
+        self.first_request_at = None  # time.perf_counter() of the first request (cold start metrics)
+
+    def _get_semaphore(self):
+        # asyncio primitives are bound to one event loop; scripts and timers may run several.
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    def _backoff(self, attempt):
+        return random.uniform(0, min(MAX_DELAY, BASE_DELAY * (2 ** attempt)))
+
+    def observe_headers(self, headers):
+        """Slow down before hitting the limit when a response says the quota is exhausted."""
+        headers = {str(k).lower(): v for k, v in dict(headers or {}).items()}
+        for header in QUOTA_REMAINING_HEADERS:
+            remaining = headers.get(header)
+            if remaining is not None and str(remaining).isdigit() and int(remaining) <= 1:
+                self.bucket.pause(retry_after_seconds(headers) or BASE_DELAY)
+        # Graph identity & access: share of the app's limit used, sent from 80% on.
+        percentage = headers.get("x-ms-throttle-limit-percentage")
+        try:
+            if percentage is not None and float(percentage) >= 1:
+                self.bucket.pause(retry_after_seconds(headers) or BASE_DELAY)
+        except ValueError:
+            pass
+
+    async def run(self, request_factory):
+        """
+        Await request_factory() (a callable returning a fresh awaitable for each attempt)
+        and return its result, retrying throttled/transient failures.
+        """
+        semaphore = self._get_semaphore()
+        attempt = 0
+        while True:
+            await self.bucket.acquire()
+            async with semaphore:
+                if self.first_request_at is None:
+                    self.first_request_at = time.perf_counter()
+                self.requests += 1
+                telemetry.count(f"{self.name}.requests")
+                try:
+                    return await request_factory()
+                except Exception as e:
+                    status = _status_code(e)
+                    transient = status in RETRYABLE_STATUS or (status is None and isinstance(e, (OSError, asyncio.TimeoutError)))
+                    if not transient or attempt >= self.max_retries:
+                        raise
+                    delay = retry_after_seconds(_headers(e))
+                    if status == 429:
+                        self.throttled += 1
+                        telemetry.count(f"{self.name}.throttled")
+                        self.bucket.pause(delay if delay is not None else self._backoff(attempt))
+                    if delay is None:
+                        delay = self._backoff(attempt)
+            self.retries += 1
+            telemetry.count(f"{self.name}.retries")
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    def stats(self):
+        return {"requests": self.requests, "retries": self.retries, "throttled": self.throttled}
+
+
+_schedulers = {}
+
+
+def get_scheduler(service):
+    """Shared scheduler for a service ('graph' or 'arg'), so all audits in a process share one budget."""
+    if service not in _schedulers:
+        limits = SERVICE_LIMITS[service]
+        prefix = service.upper()
+        _schedulers[service] = RequestScheduler(
+            service,
+            max_concurrency=_env_number(f"{prefix}_MAX_CONCURRENCY", limits["max_concurrency"], int),
+            requests_per_second=_env_number(f"{prefix}_REQUESTS_PER_SECOND", limits["requests_per_second"], float),
+            burst=_env_number(f"{prefix}_BURST", limits["burst"], int),
+            max_retries=_env_number(f"{prefix}_MAX_RETRIES", limits["max_retries"], int),
+        )
+    return _schedulers[service]
+
+
+def reset_schedulers():
+    """Start over with fresh schedulers (counters, token buckets), e.g. for the next tenant in a reused worker."""
+    _schedulers.clear()
+
+
+def attach_graph_client(graph_client):
+    """
+    Route a GraphServiceClient's throttling through the shared 'graph' scheduler: every
+    response's quota headers go to observe_headers, and kiota's own RetryHandler is told
+    not to retry, so a 429 is retried once by scheduler.run rather than by both layers.
+    """
+    # Imported here: the Function App loads the Graph SDK lazily (cold start).
+    from kiota_http.middleware import RetryHandler
+    from kiota_http.middleware.options import RetryHandlerOption
+
+    async def observe(response):
+        get_scheduler("graph").observe_headers(response.headers)
+
+    http_client = getattr(graph_client.request_adapter, "_http_client", None)
+    if http_client is None:
+        return graph_client
+    hooks = http_client.event_hooks
+    hooks["response"].append(observe)
+    http_client.event_hooks = hooks
+    pipeline = getattr(http_client._transport, "pipeline", None)
+    middleware = getattr(pipeline, "_first_middleware", None)
+    while middleware is not None:
+        if isinstance(middleware, RetryHandler):
+            middleware.options = RetryHandlerOption(max_retries=0, should_retry=False)
+        middleware = getattr(middleware, "next", None)
+    return graph_client
@@ -0,0 +1,93 @@
+import asyncio
+from azure.mgmt.resourcegraph.models import QueryRequest, QueryRequestOptions
+from request_scheduler import get_scheduler
+import telemetry
+
+# Largest page Resource Graph returns; anything beyond comes back with a $skipToken.
+PAGE_SIZE = 1000
+
+
+async def iter_query(arg_client, query, subscriptions=None, management_groups=None):
+    """
+    Yield every row of a Resource Graph query, following $skipToken page by page.
+
+    arg_client is an azure.mgmt.resourcegraph.aio.ResourceGraphClient. Without
+    paging, ARG silently truncates the result at the first 1000 rows. The query must
+    keep the `id` column in its `project`: ARG only returns a $skipToken when it does.
+    """
+    scheduler = get_scheduler("arg")
+
+    def hook(response):
+        headers = response.http_response.headers
+        scheduler.observe_headers(headers)
+        telemetry.count("arg.bytes", int(headers.get("content-length") or 0))
+
+    skip_token = None
+    while True:
+        request = QueryRequest(
+            query=query,
+            subscriptions=subscriptions,
+            management_groups=management_groups,
+            options=QueryRequestOptions(top=PAGE_SIZE, skip_token=skip_token, result_format="objectArray"),
+        )
+        with telemetry.span("arg.page"):
+            response = await scheduler.run(lambda: arg_client.resources(request, raw_response_hook=hook))
+        telemetry.count("arg.rows", len(response.data or []))
+        for row in response.data or []:
+            yield row
+        skip_token = response.skip_token
+        if not skip_token:
+            break
+
+
+async def run_query(arg_client, query, subscriptions=None, management_groups=None):
+    """Run a Resource Graph query to completion and return all rows as a list."""
+    return [row async for row in iter_query(arg_client, query, subscriptions, management_groups)]
+
+
+# --- Sharding ----------------------------------------------------------------
+# A single query over hundreds of subscriptions hits ARG's result-size and timeout limits.
+# Splitting the subscriptions into batches and running the batches in parallel scales
+# with the estate instead (the ARG scheduler still caps the overall request rate).
+
+SUBSCRIPTION_BATCH_SIZE = 100
+MAX_PARALLEL_SHARDS = 4
+
+
+async def list_subscriptions(arg_client, management_group):
+    """Subscription ids under a management group (including nested groups)."""
+    query = """
+    resourcecontainers
+    | where type == "microsoft.resources/subscriptions"
+    | project id, subscriptionId
+    """
+    rows = await run_query(arg_client, query, management_groups=[management_group])
+    return sorted({row["subscriptionId"] for row in rows})
+
+
+async def run_sharded_query(arg_client, query, subscriptions, batch_size=SUBSCRIPTION_BATCH_SIZE,
+                            max_parallel=MAX_PARALLEL_SHARDS, key="Resource"):
+    """
+    Run `query` over `subscriptions` split into batches of batch_size, at most
+    max_parallel batches at a time. Rows are merged and de-duplicated on `key`
+    (rows without it are kept as-is).
+    """
+    semaphore = asyncio.Semaphore(max_parallel)
+
+    async def run_batch(batch):
+        async with semaphore:
+            return await run_query(arg_client, query, subscriptions=batch)
+
+    batches = [subscriptions[i:i + batch_size] for i in range(0, len(subscriptions), batch_size)]
+    results = await asyncio.gather(*[run_batch(batch) for batch in batches])
+
+    rows, seen = [], set()
+    for batch_rows in results:
+        for row in batch_rows:
+            row_key = row.get(key)
+            if row_key is not None:
+                if row_key in seen:
+                    continue
+                seen.add(row_key)
+            rows.append(row)
+    return rows
@@ -0,0 +1,148 @@
+from datetime import datetime, timezone
+import numpy as np
+from audit_records import RotationRisk
+
+# "Expires within N days" per secret mostly flags apps that already rotated: the old
+# secret runs out, but a newer one is valid well past it. What breaks a client is an
+# app left with no valid credential at all, so credentials are grouped by app and
+# their validity windows merged into coverage segments:
+#
+#   secret A  |=========|                 A and B overlap (rotated in time): one segment
+#   secret B        |==============|      up to B's end
+#   secret C                          |== gap after B: C doesn't cover it
+#
+# Any credential of the app counts (a certificate covers an expiring secret, like the
+# per-credential report can't tell either which one clients use).
+# An app is a risk if the segment covering today ends within the horizon ("Expiring"),
+# or no segment covers today and the last one ended within the horizon ("Expired";
+# apps whose credentials lapsed long before are abandoned rather than at risk).
+#
+# Everything runs on one columnar table of credentials (numpy arrays, sorted by app and
+# start date) so 100k+ credentials are analysed in a few vectorized passes.
+
+# Credentials without an end date never expire.
+NO_END = int(datetime(9999, 12, 31, tzinfo=timezone.utc).timestamp())
+# Offsets per app row so one cumulative max runs over every app at once (app * SPAN + end).
+SPAN = NO_END + 1
+SECONDS_PER_DAY = 86400
+
+# Days left (at most) for each risk level; anything else within the horizon is "Medium".
+RISK_LEVELS = [(7, "Critical"), (30, "High")]
+
+
+def _timestamp(value, default):
+    return int(value.timestamp()) if value else default
+
+
+class RotationAnalysis:
+    """Outcome of CredentialTable.analyze."""
+
+    def __init__(self):
+        self.risks = []  # RotationRisk records, most urgent first
+        self.expiring_credentials = 0  # credentials ending within the horizon
+        self.covered_credentials = 0  # ...of which the app has a newer credential covering the expiry
+        self.overlapping_apps = 0  # apps with more than one credential valid right now
+        self.duplicate_apps = 0  # apps with credentials of the same type and validity window
+
+
+class CredentialTable:
+    """
+    The secrets and certificates of every application as columns: app row, type,
+    start and end (epoch seconds). Fill it with add_application while streaming the
+    apps, then call analyze.
+    """
+
+    def __init__(self):
+        self.app_ids = []
+        self.names = []
+        self._app, self._type, self._start, self._end = [], [], [], []
+
+    def add_application(self, app):
+        """Add the credentials of a projected application (see tenant_snapshot.project_application)."""
+        row = len(self.app_ids)
+        self.app_ids.append(app["app_id"])
+        self.names.append(app["display_name"])
+        for cred_type, creds in enumerate((app["password_credentials"], app["key_credentials"])):
+            for cred in creds:
+                self._app.append(row)
+                self._type.append(cred_type)
+                self._start.append(_timestamp(cred.get("start_date_time"), 0))
+                self._end.append(_timestamp(cred["end_date_time"], NO_END))
+
+    def __len__(self):
+        return len(self._app)
+
+    def analyze(self, today, threshold_date):
+        """RotationAnalysis of the apps whose credentials stop covering them before threshold_date."""
+        analysis = RotationAnalysis()
+        if not self._app:
+            return analysis
+        now = int(today.timestamp())
+        horizon = int(threshold_date.timestamp())
+        lookback = now - (horizon - now)
+        apps = len(self.app_ids)
+
+        app = np.array(self._app, dtype=np.int64)
+        cred_type = np.array(self._type, dtype=np.int8)
+        start = np.array(self._start, dtype=np.int64)
+        end = np.clip(np.array(self._end, dtype=np.int64), 0, NO_END)
+
+        # Per app, by start date: the furthest end seen so far. A credential starting after
+        # that begins a new coverage segment (a gap with no valid credential).
+        order = np.lexsort((start, app))
+        app, cred_type, start, end = app[order], cred_type[order], start[order], end[order]
+        covered_to = np.maximum.accumulate(app * SPAN + end) - app * SPAN
+        new_segment = np.ones(len(app), dtype=bool)
+        new_segment[1:] = (app[1:] != app[:-1]) | (start[1:] > covered_to[:-1])
+        first = np.flatnonzero(new_segment)
+        last = np.append(first[1:], len(app)) - 1
+        segment_app, segment_start, segment_end = app[first], start[first], covered_to[last]
+
+        # End of the segment covering today (-1: nothing valid now), and the end of the last
+        # segment that has already ended (-1: none).
+        covered_until = np.full(apps, -1, dtype=np.int64)
+        current = (segment_start <= now) & (segment_end > now)
+        covered_until[segment_app[current]] = segment_end[current]
+        ended = np.full(apps, -1, dtype=np.int64)
+        past = segment_end <= now
+        np.maximum.at(ended, segment_app[past], segment_end[past])
+
+        has_credentials = np.bincount(app, minlength=apps) > 0
+        expiring = (covered_until >= 0) & (covered_until <= horizon)
+        expired = has_credentials & (covered_until < 0) & (ended >= lookback)
+        at_risk = expiring | expired
+        risk_end = np.where(expiring, covered_until, ended)
+
+        valid_now = (start <= now) & (end > now)
+        valid_count = np.bincount(app[valid_now], minlength=apps)
+        # Same app, type and validity window as the previous row once sorted on all four.
+        dup_order = np.lexsort((end, start, cred_type, app))
+        columns = [column[dup_order] for column in (app, cred_type, start, end)]
+        duplicate = np.logical_and.reduce([column[1:] == column[:-1] for column in columns])
+        duplicate_count = np.bincount(columns[0][1:][duplicate], minlength=apps)
+        credential_count = np.bincount(app, minlength=apps)
+
+        expiring_credential = (end >= lookback) & (end <= horizon)
+        analysis.expiring_credentials = int(expiring_credential.sum())
+        analysis.covered_credentials = int((expiring_credential & ~at_risk[app]).sum())
+        analysis.overlapping_apps = int((valid_count > 1).sum())
+        analysis.duplicate_apps = int((duplicate_count > 0).sum())
+
+        rows = np.flatnonzero(at_risk)
+        days_left = (risk_end[rows] - now) // SECONDS_PER_DAY
+        # Most urgent first: soonest (or longest broken) outage, then name.
+        for i in sorted(range(len(rows)), key=lambda i: (days_left[i], self.names[rows[i]])):
+            row = rows[i]
+            days = int(days_left[i])
+            analysis.risks.append(RotationRisk(
+                app=self.names[row],
+                app_id=self.app_ids[row],
+                risk=next((level for limit, level in RISK_LEVELS if days <= limit), "Medium"),
+                status="Expiring" if expiring[row] else "Expired",
+                covered_until=datetime.fromtimestamp(int(risk_end[row]), timezone.utc),
+                days_left=days,
+                credentials=int(credential_count[row]),
+                valid_now=int(valid_count[row]),
+                duplicates=int(duplicate_count[row]),
+            ))
+        return analysis
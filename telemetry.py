@@ -0,0 +1,175 @@
+import contextvars
+import inspect
+import time
+from contextlib import contextmanager
+
+# Lightweight instrumentation for the audits: named spans (how often, how long) and
+# counters, aggregated in memory and reported once per run as a single summary record,
+# so nothing is logged per request or per finding.
+#
+#   with telemetry.collect("entra_apps") as run:    # one collector per audit run
+#       with telemetry.span("graph.page"): ...       # timed section
+#       telemetry.count("graph.objects", len(page))
+#   logging.info(f"AuditMetrics {json.dumps(run.summary())}")
+#
+# The collector follows the asyncio context: tasks started inside collect() report to
+# it, so two audits running concurrently (asyncio.gather) keep separate numbers.
+#
+# Span names used by the audits:
+#   credential.get_token, graph.page, graph.delta_page, graph.batch, arg.page,
+#   owners.resolve, evaluate.<collection>, export
+# Counters: <service>.requests / .retries / .throttled (request_scheduler),
+#   graph.bytes / arg.bytes (response Content-Length), graph.objects, arg.rows, export.rows
+# Graph bytes need instrument_graph_client; Resource Graph bytes are counted in resource_graph.
+
+# Counters reported as a per-second rate over the run as well.
+RATE_COUNTERS = ("graph.objects", "arg.rows", "graph.bytes", "arg.bytes")
+
+
+class Telemetry:
+    """Span timings and counters of one run."""
+
+    def __init__(self, name):
+        self.name = name
+        self.started = time.perf_counter()
+        self.spans = {}  # name -> [count, total seconds, max seconds]
+        self.counters = {}
+
+    def add_span(self, name, seconds):
+        stats = self.spans.get(name)
+        if stats is None:
+            stats = self.spans[name] = [0, 0.0, 0.0]
+        stats[0] += 1
+        stats[1] += seconds
+        stats[2] = max(stats[2], seconds)
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def summary(self, **extra):
+        """The run as one JSON-serializable record; extra keys (e.g. finding counts) are added as-is."""
+        elapsed = self.elapsed()
+        record = {
+            "audit": self.name,
+            "elapsed_seconds": round(elapsed, 3),
+            "spans": {name: {"count": count, "total_seconds": round(total, 3), "max_seconds": round(longest, 3)}
+                      for name, (count, total, longest) in sorted(self.spans.items())},
+            "counters": dict(sorted(self.counters.items())),
+            "rates": {f"{name}_per_second": round(self.counters[name] / elapsed, 1)
+                      for name in RATE_COUNTERS if name in self.counters and elapsed > 0},
+        }
+        record.update(extra)
+        return record
+
+
+# Collects whatever runs outside collect() (so instrumented code never has to check).
+_default = Telemetry("default")
+_current = contextvars.ContextVar("telemetry", default=None)
+
+
+def current():
+    return _current.get() or _default
+
+
+@contextmanager
+def collect(name):
+    """Start a new collector for everything run inside the block (and the tasks it starts)."""
+    telemetry = Telemetry(name)
+    token = _current.set(telemetry)
+    try:
+        yield telemetry
+    finally:
+        _current.reset(token)
+
+
+def start(name):
+    """Make a new collector current for the rest of this context (a CLI script's whole run)."""
+    telemetry = Telemetry(name)
+    _current.set(telemetry)
+    return telemetry
+
+
+@contextmanager
+def span(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        current().add_span(name, time.perf_counter() - start)
+
+
+def count(name, value=1):
+    current().count(name, value)
+
+
+def print_summary(telemetry):
+    """Human-readable version of summary(), for the CLI."""
+    summary = telemetry.summary()
+    print(f"\n{'Span':<28} | {'Count':>7} | {'Total (s)':>9} | {'Max (s)':>8}")
+    print("-" * 62)
+    for name, stats in summary["spans"].items():
+        print(f"{name:<28} | {stats['count']:>7} | {stats['total_seconds']:>9} | {stats['max_seconds']:>8}")
+    counters = ", ".join(f"{name}={value}" for name, value in summary["counters"].items())
+    rates = ", ".join(f"{name}={value}" for name, value in summary["rates"].items())
+    print(f"Elapsed: {summary['elapsed_seconds']}s")
+    if counters:
+        print(f"Counters: {counters}")
+    if rates:
+        print(f"Rates: {rates}")
+
+
+# --- SDK hooks -----------------------------------------------------------------
+
+async def _count_graph_bytes(response):
+    count("graph.bytes", int(response.headers.get("content-length") or 0))
+
+
+def instrument_graph_client(graph_client):
+    """Count the response bytes of every Graph request (Content-Length, so compressed size on the wire)."""
+    http_client = getattr(graph_client.request_adapter, "_http_client", None)
+    if http_client is not None:
+        hooks = http_client.event_hooks
+        hooks["response"].append(_count_graph_bytes)
+        http_client.event_hooks = hooks
+    return graph_client
+
+
+class TimedCredential:
+    """Wraps a sync or async credential to time token acquisition (credential.get_token spans)."""
+
+    def __init__(self, credential):
+        self.credential = credential
+
+    def get_token(self, *scopes, **kwargs):
+        start = time.perf_counter()
+        result = self.credential.get_token(*scopes, **kwargs)
+        if inspect.isawaitable(result):
+            return self._finish(result, start)
+        current().add_span("credential.get_token", time.perf_counter() - start)
+        return result
+
+    async def _finish(self, awaitable, start):
+        try:
+            return await awaitable
+        finally:
+            current().add_span("credential.get_token", time.perf_counter() - start)
+
+    def close(self):
+        return self.credential.close()
+
+    def __enter__(self):
+        self.credential.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        return self.credential.__exit__(*exc_info)
+
+    async def __aenter__(self):
+        await self.credential.__aenter__()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return await self.credential.__aexit__(*exc_info)
@@ -0,0 +1,65 @@
+import os
+
+# Credentials for a specific tenant. DefaultAzureCredential has no tenant_id argument:
+# its sources (CLI, managed identity, ...) pick a tenant themselves. Token requests
+# accept a tenant_id keyword, though, so TenantCredential adds it to every request and
+# the credential is told that tenant is allowed.
+
+
+class TenantCredential:
+    """Wraps a sync or async credential so every token is requested for tenant_id."""
+
+    def __init__(self, credential, tenant_id):
+        self.credential = credential
+        self.tenant_id = tenant_id
+
+    def get_token(self, *scopes, **kwargs):
+        # Returns a coroutine for async credentials; the Graph and Azure SDKs await it.
+        kwargs.setdefault("tenant_id", self.tenant_id)
+        return self.credential.get_token(*scopes, **kwargs)
+
+    def close(self):
+        return self.credential.close()
+
+    def __enter__(self):
+        self.credential.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        return self.credential.__exit__(*exc_info)
+
+    async def __aenter__(self):
+        await self.credential.__aenter__()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return await self.credential.__aexit__(*exc_info)
+
+
+def default_credential(credential_class, tenant_id=None):
+    """credential_class() (a DefaultAzureCredential), requesting its tokens for tenant_id if one is given."""
+    if not tenant_id:
+        return credential_class()
+    return TenantCredential(credential_class(additionally_allowed_tenants=[tenant_id]), tenant_id)
+
+
+def make_credential(tenant):
+    """
+    Async credential for one entry of the "tenants" list in audit_config.json:
+    a ClientSecretCredential when the entry has client_id and a secret (client_secret,
+    or the name of an environment variable holding it in client_secret_env), otherwise
+    DefaultAzureCredential pinned to the entry's tenant_id.
+    """
+    from azure.identity.aio import ClientSecretCredential, DefaultAzureCredential
+
+    tenant_id = tenant.get("tenant_id")
+    secret = tenant.get("client_secret")
+    if tenant.get("client_secret_env"):
+        secret = os.environ.get(tenant["client_secret_env"])
+        if not secret:
+            raise ValueError(f"Environment variable {tenant['client_secret_env']} is not set")
+    if tenant.get("client_id") and secret:
+        if not tenant_id:
+            raise ValueError("A client secret needs a tenant_id")
+        return ClientSecretCredential(tenant_id, tenant["client_id"], secret)
+    return default_credential(DefaultAzureCredential, tenant_id)
@@ -0,0 +1,239 @@
+import asyncio
+import gzip
+import json
+import os
+from datetime import datetime, timezone
+from audit_records import DirectoryObject
+from expiry_index import ExpiryIndex, parse_datetime
+import columnar_snapshot
+from columnar_snapshot import ColumnarSnapshot
+import telemetry
+from graph_paging import iter_linked_application_pages, iter_linked_service_principal_pages
+
+# Union of the fields needed by the secret, orphaned and unused audits, so each
+# collection only has to be crawled once per run.
+APPLICATION_SELECT = ["id", "appId", "displayName", "passwordCredentials", "keyCredentials"]
+# Only owner ids: their state (accountEnabled) is resolved separately, see owner_resolution.
+APPLICATION_EXPAND = ["owners($select=id)"]
+SERVICE_PRINCIPAL_SELECT = ["id", "appId", "displayName", "signInActivity"]
+
+
+# --- Projection --------------------------------------------------------------
+# Audit rules work on small plain dicts rather than SDK models, so the same rule
+# can run on a live crawl or on a snapshot loaded from disk.
+
+def _project_credential(cred):
+    return {
+        "key_id": str(cred.key_id) if cred.key_id else None,
+        "start_date_time": cred.start_date_time,
+        "end_date_time": cred.end_date_time,
+    }
+
+
+def _project_owner(owner):
+    odata_type = getattr(owner, "odata_type", None) or ""
+    # account_enabled: True/False when Graph told us, None when we can't tell.
+    account_enabled = None
+    if hasattr(owner, "account_enabled"):
+        account_enabled = owner.account_enabled is True
+    return DirectoryObject(
+        id=owner.id,
+        display_name=getattr(owner, "display_name", None) or "Unknown",
+        type=odata_type.replace("#microsoft.graph.", "") or "directoryObject",
+        account_enabled=account_enabled,
+        app_id=getattr(owner, "app_id", None),
+    )
+
+
+def project_application(app):
+    """Reduce an msgraph Application to the fields the audits need."""
+    return {
+        "id": app.id,
+        "app_id": app.app_id,
+        "display_name": app.display_name or "Unknown",
+        "password_credentials": [_project_credential(c) for c in app.password_credentials or []],
+        "key_credentials": [_project_credential(c) for c in app.key_credentials or []],
+        "owners": [_project_owner(o) for o in getattr(app, "owners", None) or []],
+    }
+
+
+def project_service_principal(sp):
+    """Reduce an msgraph ServicePrincipal to the fields the audits need."""
+    last_sign_in = None
+    sign_in_activity = getattr(sp, "sign_in_activity", None)
+    if sign_in_activity and hasattr(sign_in_activity, 'last_sign_in_date_time'):
+        last_sign_in = sign_in_activity.last_sign_in_date_time
+    elif sign_in_activity is None:
+        # The v1.0 models have no signInActivity property: it ends up in additional_data.
+        raw = (getattr(sp, "additional_data", None) or {}).get("signInActivity") or {}
+        last_sign_in = parse_graph_datetime(raw.get("lastSignInDateTime"))
+    return {
+        "id": sp.id,
+        "app_id": sp.app_id,
+        "display_name": sp.display_name or "Unknown",
+        "last_sign_in": last_sign_in,
+    }
+
+
+def project_service_principal_json(obj):
+    """Same as project_service_principal, for a service principal as raw Graph JSON."""
+    sign_in_activity = obj.get("signInActivity") or {}
+    return {
+        "id": obj["id"],
+        "app_id": obj.get("appId"),
+        "display_name": obj.get("displayName") or "Unknown",
+        "last_sign_in": parse_graph_datetime(sign_in_activity.get("lastSignInDateTime")),
+    }
+
+
+def parse_graph_datetime(value):
+    """Parse a Graph timestamp ('2024-05-01T10:00:00.1234567Z') into an aware datetime."""
+    if not value:
+        return None
+    if isinstance(value, datetime):
+        # kiota already parses date-looking strings in additional_data.
+        return value
+    value = value.replace("Z", "+00:00")
+    if "." in value:
+        # Graph sends up to 7 fractional digits, fromisoformat takes at most 6.
+        head, rest = value.split(".", 1)
+        digits = rest[:len(rest) - len(rest.lstrip("0123456789"))]
+        value = f"{head}.{digits[:6].ljust(6, '0')}{rest[len(digits):]}"
+    return datetime.fromisoformat(value)
+
+
+# --- Snapshot ----------------------------------------------------------------
+
+class TenantSnapshot:
+    """
+    Projected applications and service principals of one tenant, keyed by object id.
+
+    Can be written to / read back from a directory so audits can be re-evaluated
+    without crawling Graph again. The records are stored as Arrow files (see
+    columnar_snapshot); directories saved before that, as gzipped JSON lines, still load.
+    """
+
+    # The JSON lines files of older snapshots.
+    APPLICATIONS_FILE = "applications.jsonl.gz"
+    SERVICE_PRINCIPALS_FILE = "service_principals.jsonl.gz"
+    META_FILE = "snapshot.json"
+
+    def __init__(self, taken_at=None):
+        self.taken_at = taken_at or datetime.now(timezone.utc)
+        self.applications = {}
+        self.service_principals = {}
+
+    def add_application(self, record):
+        self.applications[record["id"]] = record
+
+    def add_service_principal(self, record):
+        self.service_principals[record["id"]] = record
+
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        columnar_snapshot.write_tenant(path, self.applications.values(), self.service_principals.values())
+        # A directory saved in the old format (e.g. incremental state) is converted: drop the stale files.
+        for name in (self.APPLICATIONS_FILE, self.SERVICE_PRINCIPALS_FILE):
+            if os.path.exists(os.path.join(path, name)):
+                os.remove(os.path.join(path, name))
+        with open(os.path.join(path, self.META_FILE), "w", encoding="utf-8") as f:
+            json.dump({
+                "format": "arrow",
+                "taken_at": self.taken_at.isoformat(),
+                "applications": len(self.applications),
+                "service_principals": len(self.service_principals),
+            }, f, indent=2)
+        # Sorted credential end dates, for instant "expires within N days" queries.
+        ExpiryIndex.from_applications(self.applications.values(), self.taken_at).save(path)
+        # appId -> application + service principal, for cross-audit queries (query_apps.py).
+        # Imported here: app_index uses the audit rules, whose modules import this one.
+        from app_index import AppIndex
+        AppIndex.from_snapshot(self).save(path)
+
+    @classmethod
+    def load(cls, path):
+        with open(os.path.join(path, cls.META_FILE), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        snapshot = cls(taken_at=datetime.fromisoformat(meta["taken_at"]))
+        if meta.get("format") == "arrow":
+            columns = ColumnarSnapshot(path)
+            for record in columns.applications():
+                snapshot.add_application(record)
+            for record in columns.service_principals():
+                snapshot.add_service_principal(record)
+            return snapshot
+        for record in _read_jsonl(os.path.join(path, cls.APPLICATIONS_FILE)):
+            for cred in record["password_credentials"] + record["key_credentials"]:
+                cred["start_date_time"] = parse_datetime(cred.get("start_date_time"))
+                cred["end_date_time"] = parse_datetime(cred["end_date_time"])
+            record["owners"] = [DirectoryObject.from_dict(owner) for owner in record["owners"]]
+            snapshot.add_application(record)
+        for record in _read_jsonl(os.path.join(path, cls.SERVICE_PRINCIPALS_FILE)):
+            record["last_sign_in"] = parse_datetime(record["last_sign_in"])
+            snapshot.add_service_principal(record)
+        return snapshot
+
+
+def _read_jsonl(file_path):
+    with gzip.open(file_path, "rt", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+# --- Crawl -------------------------------------------------------------------
+
+async def crawl_tenant(graph_client, on_application=None, on_service_principal=None, snapshot=None, owner_resolver=None,
+                       checkpoint=None):
+    """
+    Crawl /applications and /servicePrincipals once each, concurrently.
+
+    Every object is projected as soon as it arrives and handed to the callbacks.
+    With an OwnerResolver, the owners of each page of applications are resolved
+    (one $batch round-trip per page at most) before the page is handed out.
+    Pass a TenantSnapshot to also keep the projected records (e.g. to save them);
+    without one, nothing is retained beyond the page currently being evaluated.
+    With a CrawlCheckpoint, each collection continues from its stored next link (or is
+    skipped if it was completed) and progress is checkpointed after every page.
+    """
+    def resume_from(collection):
+        if checkpoint is None:
+            return False, None
+        return checkpoint.done(collection), checkpoint.next_link(collection)
+
+    async def crawl_applications():
+        done, start_link = resume_from("applications")
+        if done:
+            return
+        async for page, next_link in iter_linked_application_pages(graph_client, APPLICATION_SELECT,
+                                                                   expand=APPLICATION_EXPAND, start_link=start_link):
+            records = [project_application(app) for app in page]
+            if owner_resolver is not None:
+                with telemetry.span("owners.resolve"):
+                    await owner_resolver.resolve_applications(records)
+            with telemetry.span("evaluate.applications"):
+                for record in records:
+                    if snapshot is not None:
+                        snapshot.add_application(record)
+                    if on_application:
+                        on_application(record)
+            if checkpoint is not None:
+                checkpoint.page_done("applications", next_link, len(records))
+
+    async def crawl_service_principals():
+        done, start_link = resume_from("service_principals")
+        if done:
+            return
+        async for page, next_link in iter_linked_service_principal_pages(graph_client, SERVICE_PRINCIPAL_SELECT,
+                                                                         start_link=start_link):
+            with telemetry.span("evaluate.service_principals"):
+                for sp in page:
+                    record = project_service_principal(sp)
+                    if snapshot is not None:
+                        snapshot.add_service_principal(record)
+                    if on_service_principal:
+                        on_service_principal(record)
+            if checkpoint is not None:
+                checkpoint.page_done("service_principals", next_link, len(page))
+
+    await asyncio.gather(crawl_applications(), crawl_service_principals())
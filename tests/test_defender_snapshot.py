@@ -0,0 +1,89 @@
+import asyncio
+import os
+import sys
+import threading
+from contextlib import contextmanager
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "benchmarks")]
+
+import mock_server
+import request_scheduler
+from run_benchmark import UNLIMITED
+from run_audit import DummyCredential, mock_arg_client
+from defender_snapshot import DefenderSnapshotStore, diff_defender_items
+
+# Diff runs against the mock Resource Graph, with more items than fit on one page (1000
+# rows): every page has to be fingerprinted, or items past the first page look resolved.
+
+SUBSCRIPTIONS = 5
+
+
+@contextmanager
+def serve(defender_items):
+    config = mock_server.finish_config(mock_server.build_parser().parse_args(
+        ["--apps", "10", "--defender-items", str(defender_items), "--subscriptions", str(SUBSCRIPTIONS)]))
+    server = mock_server.make_server(config)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def run_diff(server, db_path, monkeypatch, subscriptions=None):
+    monkeypatch.setenv("BENCH_ARG_URL", server.base_url)
+    # Client-side rate limits lifted, as in the benchmarks: fresh schedulers pick them up.
+    for name, value in UNLIMITED.items():
+        monkeypatch.setenv(name, value)
+    monkeypatch.setattr(request_scheduler, "_schedulers", {})
+
+    async def run():
+        async with mock_arg_client(DummyCredential()) as arg_client:
+            return await diff_defender_items(arg_client, db_path, subscriptions=subscriptions)
+
+    return asyncio.run(run())
+
+
+def stored_ids(db_path):
+    store = DefenderSnapshotStore(db_path)
+    try:
+        return set(store.items())
+    finally:
+        store.close()
+
+
+def test_baseline_covers_every_page(tmp_path, monkeypatch):
+    db_path = str(tmp_path / "defender.db")
+    with serve(2500) as server:
+        diff = run_diff(server, db_path, monkeypatch)
+        pages = server.stats.snapshot()["by_endpoint"]["arg:resources"]
+    assert diff.baseline
+    assert len(diff.added) == 2500
+    assert all(item.name != "Unknown" for item in diff.added)
+    assert len(stored_ids(db_path)) == 2500
+    assert pages >= 3
+
+
+def test_items_past_the_first_page_are_not_resolved(tmp_path, monkeypatch):
+    db_path = str(tmp_path / "defender.db")
+    with serve(2500) as server:
+        run_diff(server, db_path, monkeypatch)
+        diff = run_diff(server, db_path, monkeypatch)
+    assert (len(diff.added), len(diff.changed), len(diff.resolved)) == (0, 0, 0)
+
+    # 300 items gone, from the last page.
+    with serve(2200) as server:
+        diff = run_diff(server, db_path, monkeypatch)
+    assert (len(diff.added), len(diff.resolved)) == (0, 300)
+    assert len(stored_ids(db_path)) == 2200
+
+
+def test_sharded_diff_covers_every_page(tmp_path, monkeypatch):
+    db_path = str(tmp_path / "defender.db")
+    subscriptions = [mock_server.Tenant._guid("9", s) for s in range(SUBSCRIPTIONS)]
+    with serve(2500) as server:
+        diff = run_diff(server, db_path, monkeypatch, subscriptions=subscriptions)
+    assert len(diff.added) == 2500
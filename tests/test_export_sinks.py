@@ -0,0 +1,102 @@
+import os
+import sys
+from datetime import datetime, timezone
+from typing import Optional
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+pa = pytest.importorskip("pyarrow")
+import pyarrow.parquet as pq
+
+from audit_records import OrphanedApp
+from export_sinks import ArrowSink, ParquetSink, Sink
+
+# Parquet/Arrow column types come from the declared types, not from whatever the first row
+# group happened to hold: a column that is empty there must still take dates and ints later.
+
+FIELDNAMES = ["App", "ApplicationObjectId", "DaysInactive", "OwnerCount", "NextExpiry"]
+TYPES = {"App": str, "ApplicationObjectId": Optional[str], "DaysInactive": Optional[int],
+         "OwnerCount": Optional[int], "NextExpiry": Optional[datetime]}
+EXPIRY = datetime(2026, 11, 1, tzinfo=timezone.utc)
+
+
+def row(name, next_expiry=None, days_inactive=None, owner_count=None):
+    return {"App": name, "ApplicationObjectId": None, "DaysInactive": days_inactive,
+            "OwnerCount": owner_count, "NextExpiry": next_expiry}
+
+
+def rows():
+    # First row group (2 rows): every optional column empty.
+    yield row("a")
+    yield row("b")
+    yield row("c", EXPIRY, 120, 2)
+    yield row("d", days_inactive=5)
+
+
+def write(sink_type, path):
+    with sink_type(path, FIELDNAMES, TYPES, row_group_size=2) as sink:
+        sink.write_many(rows())
+    return sink
+
+
+def test_parquet_declared_types(tmp_path):
+    path = str(tmp_path / "apps.parquet")
+    assert write(ParquetSink, path).count == 4
+
+    table = pq.read_table(path)
+    assert pq.ParquetFile(path).metadata.num_row_groups == 2
+    assert table.schema.field("NextExpiry").type == pa.timestamp("us", tz="UTC")
+    assert table.schema.field("DaysInactive").type == pa.int64()
+    assert table.schema.field("OwnerCount").type == pa.int64()
+    assert table.schema.field("ApplicationObjectId").type == pa.string()
+    assert table.column("NextExpiry").to_pylist() == [None, None, EXPIRY, None]
+    assert table.column("DaysInactive").to_pylist() == [None, None, 120, 5]
+
+
+def test_arrow_declared_types(tmp_path):
+    path = str(tmp_path / "apps.arrow")
+    write(ArrowSink, path)
+
+    with pa.ipc.open_stream(path) as reader:
+        table = reader.read_all()
+    assert table.schema.field("NextExpiry").type == pa.timestamp("us", tz="UTC")
+    assert table.column("OwnerCount").to_pylist() == [None, None, 2, None]
+
+
+def test_empty_export_keeps_declared_types(tmp_path):
+    path = str(tmp_path / "empty.parquet")
+    with ParquetSink(path, FIELDNAMES, TYPES):
+        pass
+
+    schema = pq.read_schema(path)
+    assert schema.field("NextExpiry").type == pa.timestamp("us", tz="UTC")
+    assert schema.field("App").type == pa.string()
+
+
+def test_undeclared_columns_are_inferred(tmp_path):
+    path = str(tmp_path / "tagged.parquet")
+    fieldnames = ["Tenant", "Count", "Note"]
+    with ParquetSink(path, fieldnames) as sink:
+        sink.write({"Tenant": "contoso", "Count": 3, "Note": None})
+
+    schema = pq.read_schema(path)
+    assert [field.type for field in schema] == [pa.string(), pa.int64(), pa.string()]
+
+
+def test_sinks_must_implement_write():
+    with pytest.raises(TypeError):
+        Sink("out.csv", ["App"])
+
+
+def test_record_column_types(tmp_path):
+    assert OrphanedApp.column_types()["OwnerCount"] is int
+    path = str(tmp_path / "orphaned.parquet")
+    with ParquetSink(path, OrphanedApp.FIELDNAMES, OrphanedApp.column_types()) as sink:
+        sink.write(OrphanedApp("a", "id-a", "No Owners", 0, ""))
+
+    table = pq.read_table(path)
+    assert table.schema.field("OwnerCount").type == pa.int64()
+    assert table.to_pylist() == [{"App": "a", "AppId": "id-a", "Type": "No Owners", "OwnerCount": 0, "Owners": ""}]
@@ -0,0 +1,79 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from audit_records import DirectoryObject
+from owner_graph import CHAIN_REASON, CYCLE_REASON, OwnerGraph
+
+
+def user(name, enabled=True):
+    return DirectoryObject(f"user-{name}", name, "user", enabled)
+
+
+def app_owner(app_id, enabled=True):
+    """The service principal of app_id, as an owner."""
+    return DirectoryObject(f"sp-{app_id}", f"SP {app_id}", "servicePrincipal", enabled, app_id)
+
+
+def orphans(apps):
+    graph = OwnerGraph()
+    for app_id, owners in apps.items():
+        graph.add_application({"app_id": app_id, "display_name": f"App {app_id}", "owners": owners})
+    return {item.app_id: item.reason for item in graph.transitive_orphans()}
+
+
+def test_chain_below_an_orphaned_app():
+    # disabled user -> A -> SP of A -> B -> SP of B -> C
+    found = orphans({
+        "A": [user("gone", enabled=False)],
+        "B": [app_owner("A")],
+        "C": [app_owner("B")],
+    })
+    # A has no enabled owner at all: that's check_orphaned's finding, not this one.
+    assert found == {"B": CHAIN_REASON, "C": CHAIN_REASON}
+
+
+def test_chain_from_a_real_owner_is_owned():
+    found = orphans({
+        "A": [user("alice")],
+        "B": [app_owner("A")],
+        "C": [app_owner("B")],
+        # Owned by another tenant's service principal: can't look further, counts as owned.
+        "D": [app_owner("external")],
+        "E": [app_owner("D"), app_owner("gone", enabled=False)],
+    })
+    assert found == {}
+
+
+def test_cycle():
+    # A and B own each other; C hangs off the cycle; S owns itself.
+    found = orphans({
+        "A": [app_owner("B")],
+        "B": [app_owner("A")],
+        "C": [app_owner("A")],
+        "S": [app_owner("S")],
+    })
+    assert found == {"A": CYCLE_REASON, "B": CYCLE_REASON, "C": CYCLE_REASON, "S": CYCLE_REASON}
+
+
+def test_cycle_with_a_real_owner_is_owned():
+    found = orphans({
+        "A": [app_owner("B"), user("alice")],
+        "B": [app_owner("A")],
+        "C": [app_owner("B")],
+    })
+    assert found == {}
+
+
+def test_chain_and_cycle_mixed():
+    # B is owned by both an orphaned app (A) and a cycle (C <-> D).
+    found = orphans({
+        "A": [user("gone", enabled=False)],
+        "X": [app_owner("A")],
+        "C": [app_owner("D")],
+        "D": [app_owner("C")],
+        "B": [app_owner("X"), app_owner("C")],
+    })
+    assert found == {"X": CHAIN_REASON, "C": CYCLE_REASON, "D": CYCLE_REASON, "B": CYCLE_REASON}
@@ -0,0 +1,99 @@
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from rotation_risk import CredentialTable
+
+TODAY = datetime(2026, 10, 17, tzinfo=timezone.utc)
+HORIZON = TODAY + timedelta(days=30)
+
+
+def window(start_days, end_days):
+    """A credential valid from TODAY + start_days to TODAY + end_days (None: no end date)."""
+    end = TODAY + timedelta(days=end_days) if end_days is not None else None
+    return {"start_date_time": TODAY + timedelta(days=start_days), "end_date_time": end}
+
+
+def app(name, secrets=(), certificates=()):
+    return {"app_id": f"id-{name}", "display_name": name,
+            "password_credentials": list(secrets), "key_credentials": list(certificates)}
+
+
+def analyze(*apps):
+    table = CredentialTable()
+    for item in apps:
+        table.add_application(item)
+    return table.analyze(TODAY, HORIZON)
+
+
+def risks(analysis):
+    return {risk.app: risk for risk in analysis.risks}
+
+
+def test_overlapping_rotation_is_covered():
+    # The old secret expires in 5 days, the new one has been valid for 10 and runs 200 more.
+    analysis = analyze(app("rotated", [window(-100, 5), window(-10, 200)]))
+    assert analysis.risks == []
+    assert analysis.expiring_credentials == 1
+    assert analysis.covered_credentials == 1
+    assert analysis.overlapping_apps == 1
+
+
+def test_certificate_covers_expiring_secret():
+    analysis = analyze(app("mixed", [window(-100, 5)], [window(-50, 400)]))
+    assert analysis.risks == []
+
+
+def test_gap_before_next_credential_is_a_risk():
+    # The next secret only starts 15 days after the current one ends.
+    analysis = analyze(app("gap", [window(-100, 5), window(20, 400)]))
+    risk = risks(analysis)["gap"]
+    assert (risk.status, risk.risk, risk.days_left) == ("Expiring", "Critical", 5)
+    assert risk.covered_until == TODAY + timedelta(days=5)
+    assert (risk.credentials, risk.valid_now) == (2, 1)
+    assert analysis.covered_credentials == 0
+
+
+def test_overlapping_credentials_extend_coverage():
+    # Three chained secrets: coverage runs to the end of the last one, 20 days out.
+    analysis = analyze(app("chain", [window(-300, -100), window(-120, 10), window(0, 20)]))
+    risk = risks(analysis)["chain"]
+    assert (risk.status, risk.risk, risk.days_left) == ("Expiring", "High", 20)
+
+
+def test_lapsed_within_horizon_vs_long_ago():
+    analysis = analyze(
+        app("recent", [window(-100, -10)]),
+        app("abandoned", [window(-400, -200)]),
+    )
+    found = risks(analysis)
+    assert set(found) == {"recent"}
+    assert (found["recent"].status, found["recent"].days_left, found["recent"].valid_now) == ("Expired", -10, 0)
+
+
+def test_no_end_date_never_expires():
+    analysis = analyze(
+        app("forever", [window(-100, None)]),
+        app("forever-rotated", [window(-100, 3), window(-100, None)]),
+    )
+    assert analysis.risks == []
+    assert analysis.covered_credentials == 1
+
+
+def test_apps_without_credentials_and_ordering():
+    analysis = analyze(
+        app("empty"),
+        app("later", [window(-100, 25)]),
+        app("sooner", [window(-100, 2)]),
+    )
+    assert [risk.app for risk in analysis.risks] == ["sooner", "later"]
+    assert [risk.risk for risk in analysis.risks] == ["Critical", "High"]
+
+
+def test_duplicates_are_counted():
+    analysis = analyze(app("dup", [window(-10, 300), window(-10, 300)], [window(-10, 300)]))
+    assert analysis.duplicate_apps == 1
+    assert analysis.risks == []